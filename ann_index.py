@@ -0,0 +1,92 @@
+import json
+import time
+import numpy as np
+from config import ANN_TABLES, ANN_BITS, ANN_SEED
+
+class RandomProjectionLSH:
+    """随机超平面 LSH：多张哈希表，每张表用 bits 个超平面的符号位作为桶编号，支持增量插入"""
+
+    def __init__(self, dim, tables=ANN_TABLES, bits=ANN_BITS, seed=ANN_SEED):
+        self.dim = dim
+        self.tables = tables
+        self.bits = bits
+        self.seed = seed
+        self.planes = np.random.RandomState(seed).standard_normal((tables * bits, dim)).astype(np.float32)
+        self.weights = (1 << np.arange(bits)).astype(np.int64)
+        self.buckets = [{} for _ in range(tables)]
+
+    def codes(self, vectors):
+        """返回每个向量在各表中的桶编号 (n, tables)"""
+        signs = (np.asarray(vectors, dtype=np.float32) @ self.planes.T) > 0
+        return signs.reshape(len(signs), self.tables, self.bits) @ self.weights
+
+    def add(self, vectors, start_id):
+        codes = self.codes(vectors)
+        for offset, row in enumerate(codes):
+            for table, code in zip(self.buckets, row.tolist()):
+                table.setdefault(code, []).append(start_id + offset)
+
+    def rebuild(self, vectors):
+        """按当前向量矩阵整体重建桶，用于加载快照或淘汰过期条目之后"""
+        self.buckets = [{} for _ in range(self.tables)]
+        if len(vectors) == 0:
+            return
+        codes = self.codes(vectors)
+        for t in range(self.tables):
+            order = np.argsort(codes[:, t], kind="stable")
+            unique, starts = np.unique(codes[order, t], return_index=True)
+            for code, ids in zip(unique.tolist(), np.split(order, starts[1:])):
+                self.buckets[t][code] = ids.tolist()
+
+    def candidates(self, queries):
+        """每条查询在任一张表中同桶的候选行号"""
+        result = []
+        for row in self.codes(queries):
+            ids = set()
+            for table, code in zip(self.buckets, row.tolist()):
+                ids.update(table.get(code, ()))
+            result.append(np.fromiter(ids, dtype=np.int64, count=len(ids)))
+        return result
+
+def benchmark_ann(size=10000, dim=256, queries=200, threshold=0.9, seed=0):
+    """召回率基准：对比 LSH 近似查询、整体矩阵精确扫描与 llm_agent.cosine_similarity 逐条比较的结果和耗时"""
+    from llm_agent import cosine_similarity
+    from embedding_index import EmbeddingIndex, normalize
+    rng = np.random.RandomState(seed)
+    history = normalize(rng.standard_normal((size, dim)))
+    # 一半查询是历史条目加扰动（余弦相似度约 0.89~0.995，跨越阈值），另一半为随机向量
+    picks = rng.randint(0, size, queries // 2)
+    scales = rng.uniform(0.1, 0.5, (len(picks), 1)) / np.sqrt(dim)
+    near = normalize(history[picks] + rng.standard_normal((len(picks), dim)) * scales)
+    probes = np.vstack([near, normalize(rng.standard_normal((queries - len(picks), dim)))])
+
+    index = EmbeddingIndex(history, [""] * size, [""] * size, ann_min_size=0)
+    start = time.perf_counter()
+    approx = index.max_similarity(probes)
+    ann_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index.max_similarity(probes, exact=True)
+    flat_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    exact = np.array([max(cosine_similarity(probe, past) for past in history) for probe in probes])
+    exact_seconds = time.perf_counter() - start
+
+    expected = exact > threshold
+    found = approx > threshold
+    return {
+        "size": size,
+        "dim": dim,
+        "queries": queries,
+        "duplicates": int(expected.sum()),
+        "recall": float((found & expected).sum() / max(1, expected.sum())),
+        "false_positives": int((found & ~expected).sum()),
+        "ann_seconds": ann_seconds,
+        "flat_seconds": flat_seconds,
+        "exact_seconds": exact_seconds,
+        "mean_candidates": float(np.mean([len(c) for c in index.ann.candidates(probes)]))
+    }
+
+if __name__ == "__main__":
+    print(json.dumps(benchmark_ann(), indent=2))
@@ -0,0 +1,293 @@
+"""历史回填：按时间窗口并发重新总结 mempool，或重新生成发布记录的 Embedding，并批量重建向量索引。
+
+用法:
+    python backfill.py summarize --start "2025-03-01 00:00:00" --end "2025-04-01 00:00:00" --rebuild-index
+    python backfill.py reindex --start "2025-03-01 00:00:00" --end "2025-04-01 00:00:00"
+
+时间范围按 --window-hours 切成窗口，最多 --concurrency 个窗口同时处理：S3 读取与模型调用是异步的，
+入库去重、分块和向量去重在进程池中执行。每个窗口完成后写入 backfill/<run>/<窗口>.json（产出）和 .npy（向量），
+中断后用相同参数重跑会跳过已完成的窗口。LLM 与 Embedding 请求按每分钟请求数/token 数节流，遇到限流退避重试。
+"""
+import io
+import os
+import sys
+import asyncio
+import argparse
+from bisect import bisect_right
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from openai import RateLimitError, APIConnectionError, InternalServerError
+from config import (BACKFILL_WINDOW_HOURS, BACKFILL_CONCURRENCY, BACKFILL_LLM_RPM, BACKFILL_LLM_TPM, BACKFILL_EMBEDDING_RPM,
+                    LLM_CHUNK_TOKEN_BUDGET, LLM_MAX_CONCURRENCY, DEDUP_SIMILARITY_THRESHOLD, EMBEDDING_INDEX_META)
+from utils import log_info, log_error, format_summary, strip_summary_header
+from checkpoint import shift_timestamp
+from dedup import DuplicateFilter
+from telegram_sender import TokenBucket
+from embedding_index import EmbeddingIndex, normalize
+from s3_storage import (async_list_s3_files, iter_mempool, FetchStats, run_in_s3_executor, save_to_s3, load_from_s3,
+                        save_bytes_to_s3, load_bytes_from_s3, backend)
+from llm_agent import call_llm, get_embeddings, ChunkBuilder
+
+BACKFILL_FOLDER = "backfill"
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+class ProviderThrottle:
+    """模型提供方限额：每分钟请求数与估算 token 数两个令牌桶，外加并发上限；
+    遇到 429 / 连接错误 / 5xx 时整体暂停并指数退避重试，最终失败抛出异常"""
+
+    def __init__(self, name, rpm, tpm=0, concurrency=LLM_MAX_CONCURRENCY, retries=5, base_delay=2.0):
+        self.name = name
+        self.requests = TokenBucket(rpm / 60, max(1.0, rpm / 6))  # 最多积攒 10 秒的额度
+        self.tokens = TokenBucket(tpm / 60, max(1.0, tpm / 6)) if tpm else None
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.retries = retries
+        self.base_delay = base_delay
+        self.throttled = 0
+
+    async def call(self, request, tokens=0):
+        for attempt in range(self.retries + 1):
+            await self.requests.acquire()
+            if self.tokens and tokens:
+                await self.tokens.acquire(tokens)
+            try:
+                async with self.semaphore:
+                    return await request()
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.retry_delay(e, attempt)
+                self.throttled += 1
+                self.requests.pause(delay)
+                log_info(f"{self.name} 限流或暂时不可用，{delay:.1f} 秒后重试 ({attempt + 1}/{self.retries}): {str(e)[:100]}")
+
+    def retry_delay(self, error, attempt):
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        try:
+            return max(float(retry_after), 0.5)
+        except (TypeError, ValueError):
+            return self.base_delay * 2 ** attempt
+
+def plan_windows(start, end, hours):
+    """把 [start, end) 切成长度为 hours 的窗口"""
+    windows, current = [], start
+    while current < end:
+        upper = min(shift_timestamp(current, hours * 3600), end)
+        windows.append((current, upper))
+        current = upper
+    return windows
+
+def window_name(window):
+    return window[0].replace(" ", "_")
+
+def prepare_chunks(messages, token_budget=LLM_CHUNK_TOKEN_BUDGET):
+    """进程池任务：窗口内按链接 + MinHash 去重后按 token 预算分块，返回 (分块, 重复数)"""
+    duplicate_filter = DuplicateFilter(window_seconds=float("inf"), max_entries=len(messages) + 1)
+    builder = ChunkBuilder(token_budget)
+    chunks, duplicates = [], 0
+    for message in messages:
+        if duplicate_filter.check(message):
+            duplicates += 1
+            continue
+        chunk = builder.add(message)
+        if chunk:
+            chunks.append(chunk)
+    last = builder.finish()
+    return (chunks + [last] if last else chunks), duplicates
+
+def select_distinct(vectors, threshold=DEDUP_SIMILARITY_THRESHOLD, block=512):
+    """进程池任务：按顺序贪心保留与已保留向量的余弦相似度都不超过 threshold 的行，返回保留的行号。
+    分块做矩阵乘法，内存占用与 block × 保留数成正比"""
+    vectors = normalize(vectors)
+    kept = []
+    for start in range(0, len(vectors), block):
+        chunk = vectors[start:start + block]
+        blocked = (chunk @ vectors[kept].T).max(axis=1) > threshold if kept else np.zeros(len(chunk), dtype=bool)
+        inner = chunk @ chunk.T
+        local = []
+        for i in range(len(chunk)):
+            if blocked[i] or (local and inner[i, local].max() > threshold):
+                continue
+            local.append(i)
+        kept.extend(start + i for i in local)
+    return kept
+
+class Backfill:
+    """回填一次运行：窗口规划、并发处理、逐窗口检查点与最终的索引重建"""
+
+    def __init__(self, mode, start, end, window_hours=BACKFILL_WINDOW_HOURS, concurrency=BACKFILL_CONCURRENCY,
+                 workers=None, run_id=None, llm_rpm=BACKFILL_LLM_RPM, llm_tpm=BACKFILL_LLM_TPM, embedding_rpm=BACKFILL_EMBEDDING_RPM):
+        self.mode = mode
+        self.start = start
+        self.end = end
+        self.windows = plan_windows(start, end, window_hours)
+        self.concurrency = concurrency
+        self.workers = workers or os.cpu_count()
+        # 默认运行 ID 由模式和时间范围确定，相同参数重跑即可续跑
+        self.run_id = run_id or f"{mode}_{start.replace(' ', '_')}_{end.replace(' ', '_')}"
+        self.folder = f"{BACKFILL_FOLDER}/{self.run_id}"
+        self.llm_throttle = ProviderThrottle("LLM", llm_rpm, llm_tpm)
+        self.embedding_throttle = ProviderThrottle("Embedding", embedding_rpm)
+        self.pool = None
+        self.completed = set()  # 已有检查点的窗口文件名
+        self.done = self.skipped = self.failed = 0
+
+    async def run_in_pool(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.pool, func, *args)
+
+    async def list_objects(self):
+        """一次列出整个时间范围的对象并按窗口分组"""
+        folder, partitioned = ("intel_mempool", True) if self.mode == "summarize" else ("intel_publish", False)
+        files = await async_list_s3_files(folder, shift_timestamp(self.start, -1), partitioned)
+        starts = [window[0] for window in self.windows]
+        grouped = {window: [] for window in self.windows}
+        for timestamp, key in files:
+            if timestamp >= self.end:
+                break
+            grouped[self.windows[bisect_right(starts, timestamp) - 1]].append((timestamp, key))
+        self.completed = set(await run_in_s3_executor(lambda: [key.rsplit("/", 1)[-1] for key in backend.list(f"{self.folder}/")]))
+        log_info(f"回填 {self.run_id}: {len(self.windows)} 个窗口, {len(files)} 个对象, 已有检查点 {sum(1 for name in self.completed if name.endswith('.json'))} 个")
+        return grouped
+
+    async def load_window(self, window):
+        """读取已完成窗口的检查点，未完成返回 None"""
+        name = window_name(window)
+        if f"{name}.json" not in self.completed:
+            return None
+        result = await run_in_s3_executor(load_from_s3, self.folder, f"{name}.json")
+        if not result:
+            return None
+        vectors = None
+        if result["rows"]:
+            data = await run_in_s3_executor(load_bytes_from_s3, self.folder, f"{name}.npy")
+            if data is None:
+                return None
+            vectors = np.load(io.BytesIO(data))
+        return result, vectors
+
+    async def save_window(self, window, result, vectors):
+        """先写向量再写 JSON：JSON 存在即表示窗口已完成"""
+        name = window_name(window)
+        if vectors is not None and len(vectors):
+            buffer = io.BytesIO()
+            np.save(buffer, np.asarray(vectors, dtype=np.float32))
+            await run_in_s3_executor(save_bytes_to_s3, buffer.getvalue(), self.folder, f"{name}.npy")
+        await run_in_s3_executor(save_to_s3, result, self.folder, f"{name}.json")
+
+    async def fetch(self, files):
+        stats = FetchStats()
+        messages = [message async for _, _, batch in iter_mempool(files, stats, read_segments=True) for message in batch]
+        if stats.failed_keys:
+            raise RuntimeError(f"{len(stats.failed_keys)} 个对象拉取失败: {stats.failed_keys[0]} 等")
+        return messages
+
+    async def summarize_window(self, window, files):
+        messages = await self.fetch(files)
+        chunks, duplicates = await self.run_in_pool(prepare_chunks, messages)
+        results = await asyncio.gather(*(call_llm("\n".join(chunk), throttle=self.llm_throttle) for chunk in chunks))
+        summaries = [summary for result in results if isinstance(result, list) for summary in result if summary.get("content")]
+        vectors = np.zeros((0, 0), dtype=np.float32)
+        if summaries:
+            vectors = np.asarray(await get_embeddings([summary["content"] for summary in summaries], throttle=self.embedding_throttle), dtype=np.float32)
+            kept = await self.run_in_pool(select_distinct, vectors)
+            summaries, vectors = [summaries[i] for i in kept], vectors[kept]
+        timestamp = max((message.get("timestamp", "") for message in messages), default=window[0]) or window[0]
+        outputs = [{"timestamp": timestamp, "content": format_summary(summary["category"], summary["content"], summary.get("importance"))}
+                   for summary in summaries]
+        return {"window": list(window), "messages": len(messages), "duplicates": duplicates, "chunks": len(chunks),
+                "rows": len(outputs), "outputs": outputs}, vectors
+
+    async def reindex_window(self, window, files):
+        records = [record for record in await self.fetch(files) if record.get("content")]
+        vectors = np.zeros((0, 0), dtype=np.float32)
+        if records:
+            vectors = np.asarray(await get_embeddings([strip_summary_header(record["content"]) for record in records], throttle=self.embedding_throttle), dtype=np.float32)
+        outputs = [{"timestamp": record.get("timestamp", ""), "content": record["content"]} for record in records]
+        return {"window": list(window), "messages": len(records), "rows": len(outputs), "outputs": outputs}, vectors
+
+    async def process_window(self, window, files, semaphore):
+        async with semaphore:
+            try:
+                loaded = await self.load_window(window)
+                if loaded:
+                    self.skipped += 1
+                    return loaded
+                handler = self.summarize_window if self.mode == "summarize" else self.reindex_window
+                result, vectors = await handler(window, files)
+                await self.save_window(window, result, vectors)
+                self.done += 1
+                log_info(f"回填窗口完成 {window[0]} ~ {window[1]}: {result['messages']} 条输入, {result['rows']} 条产出 "
+                         f"({self.done + self.skipped + self.failed}/{len(self.windows)})")
+                return result, vectors
+            except Exception as e:
+                self.failed += 1
+                log_error(f"回填窗口失败 {window[0]} ~ {window[1]}: {str(e)}")
+                return None
+
+    async def run(self, rebuild_index=False):
+        grouped = await self.list_objects()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            self.pool = pool
+            results = await asyncio.gather(*(self.process_window(window, grouped[window], semaphore) for window in self.windows))
+            log_info(f"回填 {self.run_id} 结束: 新完成 {self.done}, 已完成跳过 {self.skipped}, 失败 {self.failed}, "
+                     f"LLM 限流重试 {self.llm_throttle.throttled}, Embedding 限流重试 {self.embedding_throttle.throttled}")
+            if self.failed:
+                log_error("存在失败的窗口，未重建索引；用相同参数重跑即可只处理失败的窗口")
+                return False
+            if rebuild_index:
+                await self.rebuild_index(results)
+        return True
+
+    async def rebuild_index(self, results):
+        """按时间顺序汇总全部窗口的产出，一次构建向量索引并作为新版本快照发布；summarize 模式下跨窗口再去重一次"""
+        outputs, blocks = [], []
+        for result, vectors in results:
+            if result["rows"]:
+                outputs.extend(result["outputs"])
+                blocks.append(np.asarray(vectors, dtype=np.float32))
+        if not outputs:
+            log_info("回填没有产出，跳过索引重建")
+            return
+        vectors = np.concatenate(blocks)
+        if self.mode == "summarize":
+            kept = await self.run_in_pool(select_distinct, vectors)
+            outputs, vectors = [outputs[i] for i in kept], vectors[kept]
+        index = EmbeddingIndex(vectors, [output["timestamp"] for output in outputs], [output["content"] for output in outputs])
+        # 保存新版本后删除当前线上版本的向量对象；元数据最后写入，切换是原子的。
+        # 运行中的 Bot 下次保存索引时发现元数据已变，会切换到这个版本并补上它自己新增的条目，不会覆盖回旧版本
+        meta = await run_in_s3_executor(load_from_s3, "embeddings", EMBEDDING_INDEX_META)
+        index.version = meta.get("version") if meta else None
+        await run_in_s3_executor(index.save, replace=True)
+        log_info(f"向量索引已由回填重建: {len(index)} 条, 运行中的 Bot 在下次保存索引时切换到新版本")
+
+def parse_timestamp(value):
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").strftime("%Y-%m-%d %H:%M:%S")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="x_intel 历史回填：按窗口并发重新总结 mempool 或重建 Embedding 索引")
+    parser.add_argument("mode", choices=["summarize", "reindex"], help="summarize: 重新总结 mempool；reindex: 重新生成发布记录的 Embedding")
+    parser.add_argument("--start", type=parse_timestamp, required=True, help="起始时间（含），格式 YYYY-MM-DD HH:MM:SS")
+    parser.add_argument("--end", type=parse_timestamp, default=datetime.now().strftime("%Y-%m-%d %H:%M:%S"), help="结束时间（不含），默认当前时间")
+    parser.add_argument("--window-hours", type=int, default=BACKFILL_WINDOW_HOURS)
+    parser.add_argument("--concurrency", type=int, default=BACKFILL_CONCURRENCY, help="同时处理的窗口数")
+    parser.add_argument("--workers", type=int, default=None, help="进程池大小，默认 CPU 核数")
+    parser.add_argument("--run-id", help="检查点目录名，默认由模式和时间范围生成")
+    parser.add_argument("--llm-rpm", type=int, default=BACKFILL_LLM_RPM)
+    parser.add_argument("--llm-tpm", type=int, default=BACKFILL_LLM_TPM)
+    parser.add_argument("--embedding-rpm", type=int, default=BACKFILL_EMBEDDING_RPM)
+    parser.add_argument("--rebuild-index", action="store_true", help="全部窗口完成后用产出重建线上向量索引（reindex 模式总是重建）")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.start >= args.end:
+        sys.exit("--start 必须早于 --end")
+    backfill = Backfill(args.mode, args.start, args.end, args.window_hours, args.concurrency, args.workers, args.run_id,
+                        args.llm_rpm, args.llm_tpm, args.embedding_rpm)
+    ok = asyncio.run(backfill.run(rebuild_index=args.rebuild_index or args.mode == "reindex"))
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""离线基准与压测：本地 S3 替身 + 假 OpenAI 兼容服务，回放频道流量并运行总结周期，输出 JSON 结果。
+
+用法:
+    python benchmark.py --rounds 5 --messages 500 --llm-latency 0.2 --output bench.json
+    python benchmark.py --storage moto --replay recorded.jsonl
+
+--storage local 使用临时目录中的 SQLite 存储（默认，无额外依赖）；moto 和 tiered 需要安装 moto[server]，
+走与线上相同的 boto3 调用路径。--replay 读取 JSONL（每行一条含 content 的消息，如 mempool 导出），
+否则生成合成流量。每轮先回放 --messages 条消息，再运行一次 summarize_cycle，随历史增长逐轮记录指标。
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import asyncio
+import hashlib
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SOURCES = ["BlockBeats", "PANews", "Odaily", "Wu Blockchain", "CoinDesk", "The Block"]
+TOPICS = ["BTC", "ETH", "SOL", "稳定币", "ETF", "Layer2", "空投", "交易所", "监管", "DeFi"]
+EVENTS = ["资金流入", "价格突破", "链上大额转账", "上线新交易对", "发布治理提案", "遭遇攻击", "完成融资", "发布季度报告"]
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """OpenAI 兼容的 /chat/completions 和 /embeddings，按配置的延迟返回；Embedding 由文本哈希确定，结果可复现"""
+
+    server_version = "FakeOpenAI/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path.endswith("/chat/completions"):
+            time.sleep(server.llm_latency)
+            response = server.chat(body)
+        elif self.path.endswith("/embeddings"):
+            time.sleep(server.embedding_latency)
+            response = server.embeddings(body)
+        else:
+            self.send_error(404)
+            return
+        data = json.dumps(response, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, llm_latency=0.2, embedding_latency=0.05, dim=256, summaries_per_call=2):
+        super().__init__(("127.0.0.1", 0), FakeOpenAIHandler)
+        self.llm_latency = llm_latency
+        self.embedding_latency = embedding_latency
+        self.dim = dim
+        self.summaries_per_call = summaries_per_call
+        self.calls = {"chat": 0, "embeddings": 0, "embedding_inputs": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-openai", daemon=True).start()
+        return self
+
+    def chat(self, body):
+        with self._lock:
+            self.calls["chat"] += 1
+        prompt = body["messages"][-1]["content"]
+        lines = [line for line in prompt.split("\n")[1:] if line.strip()]
+        summaries = [
+            {"category": "Just in", "importance": "中", "content": f"{line[:60]} (汇总 {len(lines)} 条)"}
+            for line in lines[:self.summaries_per_call]
+        ]
+        return {
+            "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()), "model": body.get("model", ""),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": json.dumps(summaries, ensure_ascii=False)}}],
+            "usage": {"prompt_tokens": len(prompt) // 2, "completion_tokens": 40 * len(summaries), "total_tokens": len(prompt) // 2 + 40 * len(summaries)}
+        }
+
+    def embeddings(self, body):
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        with self._lock:
+            self.calls["embeddings"] += 1
+            self.calls["embedding_inputs"] += len(inputs)
+        data = []
+        for i, text in enumerate(inputs):
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+            rng = random.Random(seed)
+            data.append({"object": "embedding", "index": i, "embedding": [rng.gauss(0, 1) for _ in range(self.dim)]})
+        return {"object": "list", "data": data, "model": body.get("model", ""), "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)}}
+
+def synthetic_messages(count, seed=0):
+    """合成频道消息：首行来源、正文、末行链接，与 receive_message 解析的格式一致"""
+    rng = random.Random(seed)
+    for i in range(count):
+        source = rng.choice(SOURCES)
+        text = f"{rng.choice(TOPICS)} {rng.choice(EVENTS)}，规模约 {rng.randint(1, 900)} 百万美元，编号 {seed}-{i}"
+        yield f"{source}\n{text}\nhttps://example.com/{seed}/{i}"
+
+def recorded_messages(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)["content"]
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered) + 0.5) - 1))]
+
+def counter_totals(snapshot, prefix):
+    """把 metrics.snapshot() 中以 prefix 开头的序列汇总为 {序列: 次数}"""
+    totals = {}
+    for series, value in snapshot.items():
+        if series.startswith(prefix):
+            totals[series] = value["count"] if isinstance(value, dict) else value
+    return totals
+
+def diff(after, before):
+    return {key: value - before.get(key, 0) for key, value in after.items() if value - before.get(key, 0)}
+
+class BenchBot:
+    """Telegram Bot 替身，只记录发送的消息"""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent += 1
+        return SimpleNamespace(chat_id=chat_id, text=text)
+
+def configure_environment(args, workdir):
+    """在导入 config 之前设置环境变量：存储、模型地址指向本地替身，关闭回执、选主和指标端点"""
+    os.environ.update({
+        "ADMIN_HANDLES": os.getenv("ADMIN_HANDLES", "@bench"),
+        "TELEGRAM_TOKEN": "0:bench",
+        "LLM_API_KEY": "bench", "EMBEDDING_API_KEY": "bench",
+        "MODEL_ID": "bench-llm", "EMBEDDING_MODEL_ID": "bench-embedding",
+        "LLM_BASE_URL": args.openai_url, "EMBEDDING_BASE_URL": args.openai_url,
+        "STORAGE_BACKEND": "s3" if args.storage == "moto" else args.storage,
+        "LOCAL_STORAGE_PATH": os.path.join(workdir, "bench.db"),
+        "EMBEDDING_SNAPSHOT_DIR": os.path.join(workdir, "snapshots"),
+        "INGEST_ACK_INTERVAL": "0",
+        "CONTINUOUS_SUMMARY": "false",
+        "LEADER_ELECTION": "none",
+        "METRICS_PORT": "0",
+        "METRICS_DUMP_PATH": "",
+        "COMPACTION_ENABLED": "false",
+        "LOG_LEVEL": args.log_level,
+    })
+    os.environ.pop("EMBEDDING_CACHE_PATH", None)
+
+def start_moto():
+    """启动 moto S3 服务并建桶；moto 是可选依赖，只在 --storage moto 时需要"""
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        sys.exit("--storage moto 需要安装 moto[server]")
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # moto 服务每个请求一行访问日志
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    os.environ.update({
+        "S3_ENDPOINT_URL": f"http://{host}:{port}", "S3_BUCKET": "x-intel-bench",
+        "AWS_ACCESS_KEY_ID": "bench", "AWS_SECRET_ACCESS_KEY": "bench", "AWS_DEFAULT_REGION": "us-east-1"
+    })
+    import boto3
+    boto3.client("s3", endpoint_url=os.environ["S3_ENDPOINT_URL"]).create_bucket(Bucket="x-intel-bench")
+    return server
+
+async def run_benchmark(args, fake):
+    # 业务模块读取的配置在导入时确定，必须在 configure_environment 之后导入
+    from telegram import Update, Message, Chat
+    from bot import CryptoBot
+    from metrics import metrics
+    from embedding_index import get_embedding_index
+
+    bot = CryptoBot()
+    channels = [(f"-100{i}", f"source-{i}") for i in range(args.channels)]
+    bot.receive_channels = channels
+    bot.publish_channel = ("-1009999", "publish")
+    bot.review_channel = ("-1008888", "review")
+    bot.review_enabled = args.review
+    context = SimpleNamespace(bot=BenchBot(), bot_data={}, job_queue=None, application=None)
+    traffic = recorded_messages(args.replay) if args.replay else synthetic_messages(args.rounds * args.messages, args.seed)
+    chat = {cid: Chat(int(cid), Chat.CHANNEL) for cid, _ in channels}
+    update_id = 0
+    rounds, cycle_latencies, ingest_rates = [], [], []
+    history = 0
+
+    for round_number in range(1, args.rounds + 1):
+        before = metrics.snapshot()
+        calls_before = dict(fake.calls)
+        started = time.perf_counter()
+        ingested = 0
+        for text in traffic:
+            update_id += 1
+            cid = channels[update_id % len(channels)][0]
+            post = Message(update_id, datetime.now(), chat[cid], text=text)
+            await bot.receive_message(Update(update_id, channel_post=post), context)
+            ingested += 1
+            if ingested >= args.messages:
+                break
+        if not ingested:
+            break
+        ingest_seconds = time.perf_counter() - started
+        history += ingested
+
+        started = time.perf_counter()
+        await bot.summarize_cycle(context)
+        cycle_seconds = time.perf_counter() - started
+
+        after = metrics.snapshot()
+        storage_ops = diff(counter_totals(after, "storage_op_seconds"), counter_totals(before, "storage_op_seconds"))
+        ingest_rates.append(ingested / ingest_seconds if ingest_seconds else 0.0)
+        cycle_latencies.append(cycle_seconds)
+        rounds.append({
+            "round": round_number,
+            "messages": ingested,
+            "history_messages": history,
+            "index_size": len(get_embedding_index()),
+            "ingest_seconds": round(ingest_seconds, 4),
+            "ingest_messages_per_second": round(ingest_rates[-1], 1),
+            "cycle_seconds": round(cycle_seconds, 4),
+            "storage_ops": {series.split("{", 1)[1].rstrip("}"): count for series, count in storage_ops.items()},
+            "storage_ops_total": sum(storage_ops.values()),
+            "llm_calls": fake.calls["chat"] - calls_before["chat"],
+            "embedding_calls": fake.calls["embeddings"] - calls_before["embeddings"],
+            "embedding_inputs": fake.calls["embedding_inputs"] - calls_before["embedding_inputs"],
+            "telegram_sent": context.bot.sent
+        })
+        print(f"第 {round_number} 轮: 入库 {ingested} 条 {ingest_rates[-1]:.0f} 条/秒, 周期 {cycle_seconds:.3f}s, "
+              f"存储操作 {rounds[-1]['storage_ops_total']}, LLM {rounds[-1]['llm_calls']}, Embedding {rounds[-1]['embedding_calls']}", file=sys.stderr)
+
+    await bot.mempool_buffer.close()
+    return {
+        "rounds": rounds,
+        "summary": {
+            "messages": history,
+            "ingest_messages_per_second_mean": round(sum(ingest_rates) / len(ingest_rates), 1) if ingest_rates else None,
+            "cycle_seconds_p50": percentile(cycle_latencies, 50),
+            "cycle_seconds_p90": percentile(cycle_latencies, 90),
+            "cycle_seconds_p99": percentile(cycle_latencies, 99),
+            "cycle_seconds_max": max(cycle_latencies) if cycle_latencies else None,
+            "storage_ops_total": sum(row["storage_ops_total"] for row in rounds),
+            "llm_calls": fake.calls["chat"],
+            "embedding_calls": fake.calls["embeddings"],
+            "embedding_inputs": fake.calls["embedding_inputs"]
+        },
+        "metrics": metrics.snapshot()
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="x_intel 离线基准：回放流量并运行总结周期，输出 JSON 结果")
+    parser.add_argument("--rounds", type=int, default=5, help="轮数，每轮回放一批消息后运行一次总结周期")
+    parser.add_argument("--messages", type=int, default=200, help="每轮回放的消息数")
+    parser.add_argument("--channels", type=int, default=4, help="来源频道数")
+    parser.add_argument("--replay", help="回放录制的 JSONL 消息，不指定则生成合成流量")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--storage", choices=["local", "tiered", "moto"], default="local", help="local: 临时 SQLite；moto: 本地 S3 服务；tiered: 本地缓存 + moto")
+    parser.add_argument("--review", action="store_true", help="走审核路径而不是直接发布")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="假 LLM 每次调用的延迟（秒）")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="假 Embedding 每次调用的延迟（秒）")
+    parser.add_argument("--embedding-dim", type=int, default=256)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="结果 JSON 写入的文件，默认输出到标准输出")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    args.output = os.path.abspath(args.output) if args.output else None
+    args.replay = os.path.abspath(args.replay) if args.replay else None
+    cwd = os.getcwd()
+    fake = FakeOpenAIServer(args.llm_latency, args.embedding_latency, args.embedding_dim).start()
+    args.openai_url = fake.base_url
+    with tempfile.TemporaryDirectory(prefix="x-intel-bench-") as workdir:
+        moto = start_moto() if args.storage in ("moto", "tiered") else None
+        configure_environment(args, workdir)
+        os.chdir(workdir)  # 日志和其他相对路径文件写在临时目录
+        try:
+            results = asyncio.run(run_benchmark(args, fake))
+        finally:
+            os.chdir(cwd)
+            if moto:
+                moto.stop()
+            fake.shutdown()
+    results["config"] = {key: value for key, value in vars(args).items() if key != "openai_url"}
+    results["python"] = sys.version.split()[0]
+    results["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
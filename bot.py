@@ -1,58 +1,101 @@
 import json
+import time
+IMPORT_STARTED = time.perf_counter()  # 启动报告中的模块导入耗时从这里开始计
 import asyncio
+from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
 from telegram.error import TelegramError
 
-from config import TELEGRAM_TOKEN, ADMIN_HANDLES, DEFAULT_SUMMARY_CYCLE
-from s3_storage import append_to_mempool, save_published_message, list_s3_files, load_from_s3, save_to_s3
-from llm_agent import analyze_messages
+from config import TELEGRAM_TOKEN, ADMIN_HANDLES, DEFAULT_SUMMARY_CYCLE, INGEST_DEDUP_ENABLED, PIPELINE_SUMMARIZE_WORKERS, CONTINUOUS_SUMMARY, MICRO_BATCH_SIZE, MICRO_BATCH_SECONDS, INGEST_ACK_INTERVAL, CONFIG_REFRESH_SECONDS, COMPACTION_ENABLED, COMPACTION_INTERVAL_SECONDS, METRICS_DUMP_PATH, METRICS_DUMP_SECONDS, CLUSTER_ENABLED
+from s3_storage import save_published_message, save_published_messages, async_list_s3_files, iter_mempool, FetchStats, MempoolBuffer, run_in_s3_executor, ETagMismatch
+from llm_agent import call_llm, filter_duplicates, rank_summaries, ChunkBuilder
+from embedding_index import get_embedding_index, flush_embedding_index, EmbeddingIndex
+from pipeline import Stage, Pipeline
+from dedup import DuplicateFilter
+from config_store import ConfigStore
+from priority import is_priority
+from telegram_sender import OutboundSender
+from review_queue import ReviewQueue
+from checkpoint import CycleCheckpoint
+from leader import create_elector
+from compaction import compact_history
+from clustering import MessageClusterer
+from scheduler import SummaryScheduler
+from metrics import metrics, Trace, dump_metrics, start_metrics_server
 from utils import log_info, log_error, get_timestamp, format_summary
 
-# 启用详细调试日志，确保输出到控制台和文件
-import logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("x-intel.log"),
-        logging.StreamHandler()  # 输出到控制台
-    ]
-)
+# 日志配置见 utils.setup_logging：经队列异步写入文件和控制台，级别由 LOG_LEVEL 控制
 
 class CryptoBot:
-    def __init__(self):
+    def __init__(self, startup=None):
         log_info("开始初始化 CryptoBot")
+        startup = startup or Trace(metrics, "初始化", metric="startup")
         try:
-            self.admins = self.load_config("admins") or ADMIN_HANDLES
-            self.receive_channels = self.load_config("receive_channels") or []
-            self.review_channel = self.load_config("review_channel")
-            self.publish_channel = self.load_config("publish_channel")
-            self.review_enabled = self.load_config("review_enabled") if self.load_config("review_enabled") is not None else True
-            self.summary_cycle = self.load_config("summary_cycle") or DEFAULT_SUMMARY_CYCLE
-            self.last_position = self.load_config("last_position") or "2025-03-03 00:00:00"
+            with startup.span("config"):
+                self.config = ConfigStore().load()  # 有本地快照时不访问 S3，由后台预热同步
+            self.apply_config()
+            self.elector = create_elector()  # 多副本部署时只有主节点执行总结，其他副本只接收消息
+            with startup.span("checkpoint"):
+                self.checkpoint = CycleCheckpoint(term=self.lease_term).load(self.load_config("last_position") or "2025-03-03 00:00:00")
+            self.mempool_buffer = MempoolBuffer()
+            self.duplicate_filter = DuplicateFilter() if INGEST_DEDUP_ENABLED else None
+            self.cycle_lock = asyncio.Lock()
+            self.cycle_requested = False
+            self.pending_count = 0  # 上次总结以来入库的消息数（连续模式）
+            self.micro_batch_timer = None
+            self.scheduler = SummaryScheduler(self.summarize_cycle, lambda: self.summary_cycle * 60)  # 唯一排定总结周期的地方
+            self.sender = OutboundSender()
+            self.review_queue = ReviewQueue()
+            self.ack_state = {}  # chat_id -> (上次回执时间, 期间入库条数)
+            self.warmup = None  # 后台预热任务，首个总结周期等待它完成
             log_info("CryptoBot 初始化完成")
         except Exception as e:
             log_error(f"CryptoBot 初始化失败: {str(e)}")
             raise
 
+    def lease_term(self):
+        """主节点租约的任期，写入周期检查点作为隔离令牌；单进程部署为 0"""
+        return self.elector.lease.term if self.elector else 0
+
     def is_admin(self, username):
         return f"@{username}" in self.admins
 
     def update_status(self, status):
         log_info(f"Bot 状态: {status}")
 
-    def load_config(self, key):
+    def apply_config(self):
+        self.admins = self.load_config("admins") or ADMIN_HANDLES
+        self.receive_channels = self.load_config("receive_channels") or []
+        self.review_channel = self.load_config("review_channel")
+        self.publish_channel = self.load_config("publish_channel")
+        self.review_enabled = self.config.get("review_enabled", True)
+        self.summary_cycle = self.load_config("summary_cycle") or DEFAULT_SUMMARY_CYCLE
+
+    async def refresh_config(self, context: ContextTypes.DEFAULT_TYPE):
+        """多副本模式下定期同步其他副本对共享配置的修改"""
         try:
-            data = load_from_s3("config", f"{key}.json")
-            return data.get("value") if data else None
+            changed = await self.config.refresh()
         except Exception as e:
-            log_error(f"加载 S3 配置失败 ({key}): {str(e)}")
-            return None
+            log_error(f"刷新共享配置失败: {str(e)}")
+            return
+        if not changed:
+            return
+        log_info(f"共享配置已被其他副本修改: {sorted(changed)}")
+        self.apply_config()
+        if "receive_channels" in changed:
+            await self.update_receive_channels(context.application)
+
+    @property
+    def is_summarizer(self):
+        return self.elector is None or self.elector.is_leader
 
-    def save_config(self, key, value):
+    def load_config(self, key):
+        return self.config.get(key)
+
+    async def save_config(self, key, value):
         try:
-            save_to_s3({"value": value}, "config", f"{key}.json")
+            self.config.set(key, value)
             log_info(f"配置保存: {key} = {value}")
         except Exception as e:
             log_error(f"保存 S3 配置失败 ({key}): {str(e)}")
@@ -93,10 +136,11 @@ class CryptoBot:
              InlineKeyboardButton("设置发布频道", callback_data="set_publish_channel"),
              InlineKeyboardButton("设置周期", callback_data="set_cycle")]
         ]
+        text = f"管理菜单\n\n{self.scheduler.describe()}"
         if update.callback_query:
-            await update.callback_query.edit_message_text("管理菜单", reply_markup=InlineKeyboardMarkup(keyboard))
+            await update.callback_query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
         else:
-            await update.message.reply_text("管理菜单", reply_markup=InlineKeyboardMarkup(keyboard))
+            await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
     async def get_id(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = update.message.chat_id
@@ -140,19 +184,19 @@ class CryptoBot:
             idx = int(data.split("_")[2])
             if 0 <= idx < len(self.receive_channels):
                 chat_id, name = self.receive_channels.pop(idx)
-                self.save_config("receive_channels", self.receive_channels)
+                await self.save_config("receive_channels", self.receive_channels)
                 log_info(f"已移除接收频道: {chat_id} ({name})")
                 await query.message.reply_text(f"已解除 {name}({chat_id}) 的监控任务")
                 await self.update_receive_channels(context.application)
             await self.query_receive_channel(update, context)
         elif data == "enable_review":
             self.review_enabled = True
-            self.save_config("review_enabled", True)
+            await self.save_config("review_enabled", True)
             log_info("审核已开启")
             await self.start(update, context)
         elif data == "disable_review":
             self.review_enabled = False
-            self.save_config("review_enabled", False)
+            await self.save_config("review_enabled", False)
             log_info("审核已关闭")
             await self.start(update, context)
         elif data == "query_admin":
@@ -165,7 +209,7 @@ class CryptoBot:
             idx = int(data.split("_")[2])
             if 0 <= idx < len(self.admins):
                 admin = self.admins.pop(idx)
-                self.save_config("admins", self.admins)
+                await self.save_config("admins", self.admins)
                 log_info(f"已移除管理员: {admin}")
                 await query.message.reply_text(f"已移除管理员: {admin}")
             await self.query_admin(update, context)
@@ -175,26 +219,72 @@ class CryptoBot:
             await self.set_publish_channel_prompt(update, context)
         elif data == "set_cycle":
             await self.set_cycle_prompt(update, context)
+        elif data in ("summarize_no_reset", "summarize_reset") and not self.is_summarizer:
+            await query.message.reply_text("当前副本不是总结主节点，请稍后重试或等待主节点的周期总结")
         elif data == "summarize_no_reset":
-            await self.summarize_cycle(context)
-            await query.message.reply_text("总结完成，未重置周期计时")
+            ran = await self.summarize_cycle(context)
+            await query.message.reply_text("总结完成，未重置周期计时" if ran else "已合并到进行中的总结，未重置周期计时")
             await self.start(update, context)
         elif data == "summarize_reset":
-            await self.summarize_cycle(context)
-            context.job_queue.run_repeating(self.summarize_cycle, interval=self.summary_cycle * 60, first=0)
-            await query.message.reply_text("总结完成，已重置周期计时")
+            ran = await self.summarize_cycle(context)
+            self.scheduler.schedule(context.job_queue)
+            await query.message.reply_text("总结完成，已重置周期计时" if ran else "已合并到进行中的总结，已重置周期计时")
             await self.start(update, context)
         elif data == "back":
             await self.start(update, context)
-        elif data.startswith("approve_"):
-            summary = context.bot_data.get(data)
-            if summary and self.publish_channel:
-                await context.bot.send_message(self.publish_channel[0], summary)
-                save_published_message({"content": summary, "timestamp": get_timestamp()})
-                log_info(f"审核通过并发布: {summary[:20]}...")
-            await query.edit_message_text("已通过并发布")
-        elif data.startswith("reject_"):
+        elif data.startswith(("approve_all_", "reject_all_")):
+            await self.review_batch(query, context, data)
+        elif data.startswith(("approve_", "reject_")):
+            await self.review_one(query, context, data)
+
+    async def review_one(self, query, context, data):
+        """按钮格式 approve_<批次>_<ID> / reject_<批次>_<ID>；旧格式或已处理、已过期的按钮查不到记录"""
+        action, _, rest = data.partition("_")
+        batch, _, review_id = rest.partition("_")
+        item = await self.review_queue.pop(batch, review_id) if review_id else None
+        if item is None:
+            await query.edit_message_text("已处理或已过期")
+            return
+        summary = item["summary"]
+        if action == "reject":
             await query.edit_message_text("已驳回")
+            return
+        if self.publish_channel:
+            try:
+                sent = await self.sender.send(context.bot, self.publish_channel[0], summary)
+            except Exception as e:
+                log_error(f"审核通过后发布失败: {str(e)}")
+                sent = None
+            if sent is None:
+                # 发布失败时放回队列，原消息上的按钮仍可再次点击
+                await self.review_queue.restore([item])
+                await query.message.reply_text("发布失败，已放回待审核，请稍后重新点击通过")
+                return
+            await save_published_message({"content": summary, "timestamp": get_timestamp()})
+            log_info(f"审核通过并发布: {summary[:20]}...")
+        await query.edit_message_text("已通过并发布")
+
+    async def review_batch(self, query, context, data):
+        """整批通过或驳回：一次取出批次内仍待审核的总结，通过时排队发布并批量写入已发布记录，发布失败的放回队列"""
+        action, batch = data.split("_all_", 1)
+        items = await self.review_queue.pop_batch(batch)
+        if action == "reject":
+            log_info(f"整批驳回: {batch}, {len(items)} 条")
+            await query.edit_message_text(f"已整批驳回 {len(items)} 条")
+            return
+        published, failed = [], []
+        if self.publish_channel:
+            deliveries = [self.sender.enqueue(context.bot, self.publish_channel[0], item["summary"]) for item in items]
+            for item, sent in zip(items, await asyncio.gather(*deliveries, return_exceptions=True)):
+                if isinstance(sent, list) and all(sent):
+                    published.append({"content": item["summary"], "timestamp": get_timestamp()})
+                else:
+                    failed.append(item)
+            if failed:
+                await self.review_queue.restore(failed)
+            await save_published_messages(published)
+        log_info(f"整批通过并发布: {batch}, {len(published)} 条, 发布失败放回 {len(failed)} 条")
+        await query.edit_message_text(f"已整批通过并发布 {len(published)} 条" + (f"，{len(failed)} 条发布失败已放回待审核" if failed else ""))
 
     async def query_receive_channel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         self.update_status("运行中 - 查询接收频道")
@@ -298,7 +388,7 @@ class CryptoBot:
                 chat = await context.bot.get_chat(chat_id)
                 channel_name = chat.title
                 self.receive_channels.append((str(chat_id), channel_name))
-                self.save_config("receive_channels", self.receive_channels)
+                await self.save_config("receive_channels", self.receive_channels)
                 log_info(f"已添加接收频道: {chat_id} ({channel_name})")
                 await update.message.reply_text(f"{channel_name}({chat_id}) 已纳入监控视野")
                 await self.update_receive_channels(context.application)
@@ -310,7 +400,7 @@ class CryptoBot:
                 chat_id = int(text)
                 chat = await context.bot.get_chat(chat_id)
                 self.review_channel = (str(chat_id), chat.title)
-                self.save_config("review_channel", self.review_channel)
+                await self.save_config("review_channel", self.review_channel)
                 await update.message.reply_text(f"审核频道设置为：{chat.title}({chat_id})")
                 await self.start(update, context)
             except (ValueError, TelegramError) as e:
@@ -320,7 +410,7 @@ class CryptoBot:
                 chat_id = int(text)
                 chat = await context.bot.get_chat(chat_id)
                 self.publish_channel = (str(chat_id), chat.title)
-                self.save_config("publish_channel", self.publish_channel)
+                await self.save_config("publish_channel", self.publish_channel)
                 await update.message.reply_text(f"发布频道设置为：{chat.title}({chat_id})")
                 await self.start(update, context)
             except (ValueError, TelegramError) as e:
@@ -328,8 +418,8 @@ class CryptoBot:
         elif action == "set_cycle":
             try:
                 self.summary_cycle = int(text)
-                self.save_config("summary_cycle", self.summary_cycle)
-                context.job_queue.run_repeating(self.summarize_cycle, interval=self.summary_cycle * 60, first=0)
+                await self.save_config("summary_cycle", self.summary_cycle)
+                self.scheduler.schedule(context.job_queue)
                 await update.message.reply_text(f"总结周期设置为：{text} 分钟")
                 await self.start(update, context)
             except ValueError:
@@ -337,7 +427,7 @@ class CryptoBot:
         elif action == "add_admin":
             if text.startswith("@"):
                 self.admins.append(text)
-                self.save_config("admins", self.admins)
+                await self.save_config("admins", self.admins)
                 log_info(f"已添加管理员: {text}")
                 await update.message.reply_text(f"已添加管理员: {text}")
                 await self.query_admin(update, context)
@@ -370,75 +460,367 @@ class CryptoBot:
             "content": message_text,
             "original_link": message_text.split("\n")[-1] if "\n" in message_text else ""
         }
+        if self.duplicate_filter and self.duplicate_filter.check(message):
+            log_info(f"忽略重复消息 - chat_id: {chat_id}, 内容: {message['content'][:100]}")
+            return
         log_info(f"处理消息 - chat_id: {chat_id}, 内容: {message['content'][:100]}")
         try:
-            append_to_mempool(message)
-            log_info(f"成功存储消息到 S3 - chat_id: {chat_id}, 文件名: {message['timestamp'].replace(' ', '_')}.json")
+            await self.mempool_buffer.add(message)
+            log_info(f"消息已进入 mempool 缓冲 - chat_id: {chat_id}, 待写入: {len(self.mempool_buffer)} 条")
         except Exception as e:
             log_error(f"存储消息到 S3 失败 - chat_id: {chat_id}, 错误: {str(e)}")
-            await context.bot.send_message(chat_id, f"存储消息失败: {str(e)}")
+            await self.sender.send(context.bot, chat_id, f"存储消息失败: {str(e)}")
+            return
+        self.scheduler.record_message()
+        await self.send_ingest_ack(context, chat_id)
+        if CONTINUOUS_SUMMARY:
+            self.on_message_ingested(message, context)
+
+    async def send_ingest_ack(self, context, chat_id):
+        """入库回执按来源频道限频：每 INGEST_ACK_INTERVAL 秒最多一条，汇总期间入库条数；间隔为 0 时不回执"""
+        if INGEST_ACK_INTERVAL <= 0:
+            return
+        now = time.monotonic()
+        last_sent, count = self.ack_state.get(chat_id, (None, 0))
+        count += 1
+        if last_sent is not None and now - last_sent < INGEST_ACK_INTERVAL:
+            self.ack_state[chat_id] = (last_sent, count)
             return
-        await context.bot.send_message(chat_id, "消息已接收并存储")
+        self.ack_state[chat_id] = (now, 0)
+        await self.sender.send(context.bot, chat_id, "消息已接收并存储" if count == 1 else f"消息已接收并存储 (共 {count} 条)")
+
+    def on_message_ingested(self, message, context):
+        """连续模式：疑似 Breaking 的消息立即触发总结，否则累计到条数或时长上限时触发小批量总结"""
+        self.pending_count += 1
+        if is_priority(message):
+            log_info(f"疑似重大事件，立即触发总结: {message['content'][:50]}")
+            self.trigger_summary(context, "priority")
+        elif self.pending_count >= MICRO_BATCH_SIZE:
+            self.trigger_summary(context, "batch_size")
+        elif self.micro_batch_timer is None:
+            self.micro_batch_timer = asyncio.create_task(self.trigger_summary_later(context))
+
+    async def trigger_summary_later(self, context):
+        await asyncio.sleep(MICRO_BATCH_SECONDS)
+        self.micro_batch_timer = None
+        if self.pending_count:
+            self.trigger_summary(context, "batch_age")
+
+    def trigger_summary(self, context, reason):
+        log_info(f"触发小批量总结 ({reason}), 待总结消息: {self.pending_count} 条")
+        self.pending_count = 0
+        if self.micro_batch_timer is not None:
+            self.micro_batch_timer.cancel()
+            self.micro_batch_timer = None
+        self.scheduler.trigger(context.job_queue, reason, force=reason == "priority")
 
     async def summarize_cycle(self, context: ContextTypes.DEFAULT_TYPE):
+        """周期任务、手动总结和连续模式共用的入口；同一时间只运行一轮，运行中的触发合并为结束后再跑一轮。
+        本次调用实际执行完总结时返回 True，合并到进行中的总结或被跳过时返回 False"""
+        if self.cycle_lock.locked():
+            self.cycle_requested = True
+            log_info("总结进行中，本次触发合并到下一轮")
+            return False
+        async with self.cycle_lock:
+            if self.warmup is not None:
+                await self.warmup
+            self.cycle_requested = True
+            while self.cycle_requested:
+                self.cycle_requested = False
+                if not self.is_summarizer:
+                    log_info("当前副本不是总结主节点，跳过本次总结")
+                    return False
+                if self.elector:
+                    # 主节点可能刚刚接管，从共享检查点读取最新游标；提交时的 ETag 校验会拒绝已失效的旧主节点
+                    await run_in_s3_executor(self.checkpoint.load)
+                self.scheduler.cycle_started()
+                try:
+                    await self.run_cycle(context)
+                except ETagMismatch:
+                    # 检查点已被其他副本推进（本副本多半已被接管），放弃本轮，重新读取检查点
+                    log_error("周期检查点已被其他副本更新，本副本放弃本轮总结")
+                    await run_in_s3_executor(self.checkpoint.load)
+                    return False
+            return True
+
+    async def run_cycle(self, context: ContextTypes.DEFAULT_TYPE):
         self.update_status("运行中 - 周期性总结")
-        messages = self.get_new_messages()
-        if not messages:
+        try:
+            await self.mempool_buffer.flush()
+        except Exception as e:
+            log_error(f"总结前写出 mempool 缓冲失败: {str(e)}")
+        if self.duplicate_filter:
+            log_info(f"本周期入库前过滤重复消息: {self.duplicate_filter.pop_cycle_stats()} 条")
+        try:
+            await self.review_queue.purge_expired()
+        except Exception as e:
+            log_error(f"清理过期待审核记录失败: {str(e)}")
+        if self.checkpoint.pending:
+            # 上一周期已提交但未交付完（如交付途中重启），先重放剩余产出，不重新调用 LLM
+            log_info(f"重放周期 {self.checkpoint.cycle} 未交付的 {len(self.checkpoint.outputs) - self.checkpoint.delivered} 条产出")
+            await self.deliver_outputs(context)
+            if self.checkpoint.pending:
+                # 提交新周期会覆盖待交付的产出：交付仍失败时本轮不拉取新消息，下一轮继续重放
+                log_error(f"周期 {self.checkpoint.cycle} 仍有 {len(self.checkpoint.outputs) - self.checkpoint.delivered} 条产出未交付，本轮不拉取新消息")
+                return
+        fetch_stats = FetchStats()
+        message_count = 0
+        message_timestamps = []
+        trace = Trace(metrics, "总结周期")
+        cycle = self.review_queue.new_batch()
+        cycle_index = EmbeddingIndex()  # 本周期已接受的总结，跨块去重由它完成，不再额外调用 LLM 合并
+        accepted = []
+        failed_chunks = []  # LLM 总结或去重失败的块，其来源对象不推进游标，下一周期重试
+        summarized = 0
+        # 本周期的输入在列出时即固定：总结期间新到的消息落在游标之后，留给下一周期
+        with trace.span("list"):
+            files = await self.list_new_objects()
+        if not files:
             log_info("无新消息")
             return
-        summaries = analyze_messages(messages, self.last_position)
-        self.last_position = get_timestamp()
-        self.save_config("last_position", self.last_position)
-        for summary in summaries:
+
+        clusterer = MessageClusterer() if CLUSTER_ENABLED else None
+
+        async def consumed():
+            nonlocal message_count
+            async for message in self.iter_messages(files, fetch_stats):
+                message_count += 1
+                message_timestamps.append(message.get("timestamp"))
+                yield message
+
+        async def chunks():
+            builder = ChunkBuilder()
+            # 聚类后同一事件只有一条代表消息进入分块，提示词规模随事件数而不是原始消息数增长
+            source = clusterer.representatives(consumed()) if clusterer else consumed()
+            async for message in source:
+                chunk = builder.add(message)
+                if chunk:
+                    yield chunk
+            last = builder.finish()
+            if last:
+                yield last
+
+        async def summarize(chunk):
+            nonlocal summarized
+            try:
+                summaries = await call_llm("\n".join(chunk))
+            except Exception as e:
+                log_error(f"分块总结失败，{len(chunk)} 条消息的来源对象下一周期重试: {str(e)}")
+                failed_chunks.append(chunk)
+                return None
+            summarized += 1
+            return [(chunk, summaries)] if summaries else None
+
+        async def dedup(item):
+            chunk, summaries = item
+            try:
+                summaries = await filter_duplicates(summaries, cycle_index, accepted)
+            except Exception as e:
+                log_error(f"总结去重失败，{len(chunk)} 条消息的来源对象下一周期重试: {str(e)}")
+                failed_chunks.append(chunk)
+                return
+            accepted.extend(summaries)
+
+        # 拉取/分块 -> LLM 总结 -> Embedding 去重，各阶段通过有界队列并发重叠
+        pipeline = Pipeline([
+            Stage("summarize", summarize, PIPELINE_SUMMARIZE_WORKERS),
+            Stage("dedup", dedup)
+        ])
+        with trace.span("pipeline"):
+            await pipeline.run(chunks())
+        log_info(f"获取到 {message_count} 条新消息 (对象拉取: {fetch_stats})")
+        pipeline.log_stats()
+        if clusterer:
+            clusterer.log_stats()
+        # 各块并发完成，顺序不定：整个周期按类别和重要性统一排序后再交付
+        outputs = [format_summary(summary["category"], summary["content"], summary.get("importance")) for summary in rank_summaries(accepted)]
+        for summary in outputs:
             log_info(f"总结结果: {summary}")
-            if self.review_enabled and self.review_channel:
-                await self.send_review(context, summary)
-            elif self.publish_channel:
-                await context.bot.send_message(self.publish_channel[0], summary)
-                save_published_message({"content": summary, "timestamp": get_timestamp()})
-        log_info(f"总结完成，位置: {self.last_position}")
-
-    def get_new_messages(self):
-        files = list_s3_files("intel_mempool", self.last_position)
-        messages = []
-        for timestamp, key in files:
-            data = load_from_s3("intel_mempool", key.split("/")[-1])
-            if data:
-                messages.append(data)
-        log_info(f"获取到 {len(messages)} 条新消息")
-        return messages
-
-    async def send_review(self, context, summary):
-        key = f"approve_{summary[:10]}"
-        context.bot_data[key] = summary
+        failed, deferred = list(fetch_stats.failed_keys), []
+        unsummarized = sorted(set().union(*(chunk.source_keys() for chunk in failed_chunks)))
+        if unsummarized:
+            metrics.inc("cycle_failed_chunks_total", len(failed_chunks))
+            # 部分块失败计入对象的失败次数（反复失败最终转入死信）；全部失败多半是 LLM 服务不可用，只推迟不计次数
+            if summarized:
+                failed += unsummarized
+            else:
+                deferred = unsummarized
+            log_error(f"{len(failed_chunks)} 块总结失败，{len(unsummarized)} 个 mempool 对象下一周期重试")
+        # 游标与产出一次写入检查点；在此之前崩溃，下次从原游标重新总结，不会产生重复输出
+        with trace.span("commit"):
+            await self.checkpoint.commit(cycle, files, failed, outputs, deferred)
+        with trace.span("deliver"):
+            await self.deliver_outputs(context)
+        if outputs:
+            observe_delivery_delay(message_timestamps, "review" if self.review_enabled and self.review_channel else "publish")
+        metrics.inc("cycle_messages_total", message_count)
+        metrics.inc("cycle_outputs_total", len(outputs))
+        trace.finish()
+        log_info(f"Telegram 出站: {self.sender.stats()}")
+        log_info(f"总结完成，位置: {self.checkpoint.position}")
+
+    async def warm_up(self, application):
+        """后台预热：与 S3 同步本地快照中的配置、加载向量索引；此时 polling 已经开始，不影响接收消息"""
+        warmup = Trace(metrics, "后台预热", metric="startup")
+        try:
+            if self.config.from_snapshot:
+                with warmup.span("config_refresh"):
+                    changed = await self.config.refresh()
+                if changed:
+                    log_info(f"本地配置快照已过期，已同步: {sorted(changed)}")
+                    self.apply_config()
+                    if "receive_channels" in changed:
+                        await self.update_receive_channels(application)
+            with warmup.span("embedding_index"):
+                await run_in_s3_executor(get_embedding_index)
+        except Exception as e:
+            log_error(f"后台预热失败: {str(e)}")
+        warmup.finish()
+
+    async def dump_metrics(self, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            await asyncio.to_thread(dump_metrics, METRICS_DUMP_PATH)
+        except Exception as e:
+            log_error(f"写出指标文件失败: {str(e)}")
+
+    async def compact(self, context: ContextTypes.DEFAULT_TYPE):
+        """定期把旧的 mempool 分段和发布记录压缩为列式归档；只在主节点执行。
+        只处理早于游标沉淀窗口的对象，与正在运行的总结周期列出的范围不重叠，无需互斥"""
+        if not self.is_summarizer:
+            return
+        try:
+            dead_letter = [entry["key"] for entry in self.checkpoint.dead_letter]
+            await run_in_s3_executor(compact_history, self.checkpoint.position, dead_letter=dead_letter)
+        except Exception as e:
+            log_error(f"历史数据压缩失败: {str(e)}")
+
+    async def deliver_outputs(self, context):
+        """交付检查点中尚未交付的产出并记录进度；审核与发布记录使用由周期和序号确定的 ID，重放时覆盖而不是重复。
+        只推进到连续发送成功的位置，之后的产出留在检查点中等待重放"""
+        checkpoint = self.checkpoint
+        cycle, start = checkpoint.cycle, checkpoint.delivered
+        outputs = checkpoint.outputs[start:]
+        if self.review_enabled and self.review_channel:
+            for index, summary in enumerate(outputs, start):
+                if await self.send_review(context, summary, cycle, f"{index:06x}") is None:
+                    log_error(f"审核消息发送失败，剩余 {len(outputs) - (index - start)} 条留待重放")
+                    return
+                await checkpoint.mark_delivered(index + 1)
+            if outputs:
+                await self.send_review_controls(context, cycle, start + len(outputs))
+            return
+        sent = len(outputs)
+        if self.publish_channel:
+            # 排队发送，发布频道限流时同一批总结会合并为一条消息
+            deliveries = [self.sender.enqueue(context.bot, self.publish_channel[0], summary) for summary in outputs]
+            results = await asyncio.gather(*deliveries, return_exceptions=True)
+            sent = next((i for i, result in enumerate(results) if not (isinstance(result, list) and all(result))), len(outputs))
+            if sent < len(outputs):
+                log_error(f"发布失败，已发布 {sent} 条，剩余 {len(outputs) - sent} 条留待重放")
+            # 已发布的总结一次性写入并批量生成 Embedding；未发出的不写入，避免之后的相似总结被当作重复丢弃
+            await save_published_messages([
+                {"id": f"{cycle}_{index:06x}", "content": summary, "timestamp": checkpoint.committed_at}
+                for index, summary in enumerate(outputs[:sent], start)
+            ])
+        await checkpoint.mark_delivered(start + sent)
+
+    async def list_new_objects(self):
+        # mempool 按小时分区，只列出游标沉淀窗口所在分区及之后的对象，重启后的开销只与新消息数有关
+        files = await async_list_s3_files("intel_mempool", self.checkpoint.list_start(), partitioned=True)
+        return self.checkpoint.select(files)
+
+    async def iter_messages(self, files, stats):
+        """逐条产出消息，并记下来源 mempool 对象（mempool_keys），所在块总结失败时据此重试"""
+        async for _, key, batch in iter_mempool(files, stats):
+            for message in batch:
+                message["mempool_keys"] = [key]
+                yield message
+
+    async def send_review(self, context, summary, batch, review_id=None):
+        """加入待审核队列并发送带按钮的审核消息，发送失败时返回 None"""
+        item = await self.review_queue.add(summary, batch, review_id)
         keyboard = [
-            [InlineKeyboardButton("通过", callback_data=key),
-             InlineKeyboardButton("驳回", callback_data=f"reject_{summary[:10]}")]
+            [InlineKeyboardButton("通过", callback_data=f"approve_{batch}_{item['id']}"),
+             InlineKeyboardButton("驳回", callback_data=f"reject_{batch}_{item['id']}")]
         ]
         self.update_status(f"运行中 - 发送审核: {summary[:20]}...")
-        await context.bot.send_message(self.review_channel[0], summary, reply_markup=InlineKeyboardMarkup(keyboard))
+        return await self.sender.send(context.bot, self.review_channel[0], summary, reply_markup=InlineKeyboardMarkup(keyboard))
+
+    async def send_review_controls(self, context, batch, count):
+        keyboard = [
+            [InlineKeyboardButton("全部通过", callback_data=f"approve_all_{batch}"),
+             InlineKeyboardButton("全部驳回", callback_data=f"reject_all_{batch}")]
+        ]
+        await self.sender.send(context.bot, self.review_channel[0], f"本周期共 {count} 条待审核总结", reply_markup=InlineKeyboardMarkup(keyboard))
+
+def observe_delivery_delay(timestamps, path):
+    """记录本周期消息从入库到交付（发布频道或审核频道）的延迟"""
+    now = datetime.now()  # 与 get_timestamp 一致，消息时间戳是本地时间
+    for timestamp in timestamps:
+        try:
+            delay = (now - datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")).total_seconds()
+        except (TypeError, ValueError):
+            continue
+        metrics.observe("message_delivery_delay_seconds", max(delay, 0.0), path=path)
 
 def main():
     log_info("进入 main 函数")
+    # 启动报告：导入、配置、检查点、构建 Application 和 post_init 各自的耗时，向量索引等放到后台预热
+    startup = Trace(metrics, "启动", metric="startup", started=IMPORT_STARTED)
+    startup.record("import", time.perf_counter() - IMPORT_STARTED)
     try:
-        bot = CryptoBot()
+        bot = CryptoBot(startup)
         bot.update_status("Bot 启动")
+        start_metrics_server()
     except Exception as e:
         log_error(f"创建 CryptoBot 实例失败: {str(e)}")
         return
 
+    async def post_shutdown(application):
+        log_info("进入 post_shutdown，写出 mempool 缓冲")
+        try:
+            await bot.mempool_buffer.close()
+        except Exception as e:
+            log_error(f"关闭时写出 mempool 缓冲失败: {str(e)}")
+        try:
+            await bot.sender.flush()
+        except Exception as e:
+            log_error(f"关闭时发送排队消息失败: {str(e)}")
+        try:
+            await bot.config.flush()
+        except Exception as e:
+            log_error(f"关闭时写回配置失败: {str(e)}")
+        try:
+            await flush_embedding_index()
+        except Exception as e:
+            log_error(f"关闭时保存向量快照失败: {str(e)}")
+        if bot.elector:
+            try:
+                await bot.elector.stop()
+            except Exception as e:
+                log_error(f"关闭时释放主节点租约失败: {str(e)}")
+
     async def post_init(application):
         log_info("进入 post_init")
         try:
-            await bot.update_receive_channels(application)
+            with startup.span("post_init"):
+                await bot.update_receive_channels(application)
+                if bot.elector:
+                    # 先完成一次选主，避免首个周期任务在身份确定前被跳过
+                    await bot.elector.step()
+                    bot.elector.start()
+                    application.job_queue.run_repeating(bot.refresh_config, interval=CONFIG_REFRESH_SECONDS, first=CONFIG_REFRESH_SECONDS)
+            bot.warmup = application.create_task(bot.warm_up(application))
             log_info("Bot 初始化完成，消息处理器已注册")
+            startup.finish()
         except Exception as e:
             log_error(f"Post_init 失败: {str(e)}")
             raise
 
     try:
         log_info("创建 Application")
-        application = Application.builder().token(TELEGRAM_TOKEN).post_init(post_init).build()
+        with startup.span("build"):
+            application = Application.builder().token(TELEGRAM_TOKEN).post_init(post_init).post_shutdown(post_shutdown).build()
         log_info("Application 创建成功")
 
         application.add_handler(CommandHandler("start", bot.start))
@@ -448,11 +830,11 @@ def main():
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot.handle_text))
         log_info("处理器添加完成")
 
-        application.job_queue.run_repeating(
-            bot.summarize_cycle,
-            interval=bot.summary_cycle * 60,
-            first=0
-        )
+        bot.scheduler.start(application.job_queue)  # 首轮立即执行，之后按负载和 token 预算自适应排定
+        if COMPACTION_ENABLED:
+            application.job_queue.run_repeating(bot.compact, interval=COMPACTION_INTERVAL_SECONDS, first=COMPACTION_INTERVAL_SECONDS)
+        if METRICS_DUMP_PATH:
+            application.job_queue.run_repeating(bot.dump_metrics, interval=METRICS_DUMP_SECONDS, first=METRICS_DUMP_SECONDS)
         log_info("周期性任务已调度")
 
         log_info("Bot 开始运行 polling")
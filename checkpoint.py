@@ -0,0 +1,178 @@
+from datetime import datetime, timedelta
+from config import CYCLE_CHECKPOINT_FILE, CURSOR_SETTLE_SECONDS, CHECKPOINT_MAX_ATTEMPTS
+from utils import log_info, log_error, get_timestamp
+from metrics import metrics
+from s3_storage import (load_json_with_etag, save_json_if_match, list_s3_files, run_in_s3_executor, partition_path, conditional_put, ETagMismatch,
+                        load_bytes_from_s3, save_bytes_to_s3, delete_keys_from_s3)
+
+CHECKPOINT_FOLDER = "checkpoint"
+MEMPOOL_FOLDER = "intel_mempool"
+DEAD_LETTER_LIMIT = 100  # 检查点中保留的死信记录数，超出后丢弃最早的
+
+def shift_timestamp(timestamp, seconds):
+    return (datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S") + timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S")
+
+def key_timestamp(key):
+    return key.split("/")[-1][:19].replace("_", " ")
+
+def migrate_flat_mempool(position):
+    """把旧版扁平布局（intel_mempool/<时间>_...）中 position 之后、尚未总结的对象移入按小时分区的布局。
+    分区列出从小时分区开始，扁平键排在所有分区之前，不移动就永远列不到；先写新键再删旧键，中断后重跑是幂等的"""
+    moved = 0
+    for timestamp, key in list_s3_files(MEMPOOL_FOLDER, position):
+        if key.count("/") != 1:
+            continue
+        filename = key.split("/")[-1]
+        data = load_bytes_from_s3(MEMPOOL_FOLDER, filename)
+        if data is None:
+            continue
+        save_bytes_to_s3(data, f"{MEMPOOL_FOLDER}/{partition_path(timestamp)}", filename)
+        delete_keys_from_s3([key])
+        moved += 1
+    if moved:
+        log_info(f"已把 {moved} 个旧版扁平布局的未总结 mempool 对象移入小时分区")
+    return moved
+
+class CycleCheckpoint:
+    """总结周期检查点：mempool 游标与本周期产出写在同一个对象里，一次 PUT 原子提交。
+    游标是已消费的最大 mempool 键（键按时间字典序单调递增），外加沉淀窗口内已消费键的集合，
+    用来接收其他写入方迟到的分段而不重复消费。产出逐条交付并记录进度，重启后从未交付处重放。
+    处理失败的键按次数重试，连续失败 max_attempts 次后转入死信列表并视为已消费，游标不会永久卡在损坏的对象上"""
+
+    def __init__(self, filename=CYCLE_CHECKPOINT_FILE, settle_seconds=CURSOR_SETTLE_SECONDS, max_attempts=CHECKPOINT_MAX_ATTEMPTS, term=None):
+        self.filename = filename
+        self.term = term or (lambda: 0)  # 返回当前主节点任期（租约 term），随检查点写入作为隔离令牌
+        self.settle_seconds = settle_seconds
+        self.max_attempts = max_attempts
+        self.watermark = None  # 已消费的最大 mempool 键
+        self.recent = set()  # 沉淀窗口内或水位之后已消费的键
+        self.attempts = {}  # 处理失败、等待重试的键 -> 已失败次数
+        self.dead_letter = []  # 放弃重试的键 [{key, attempts, at}]，最近的 DEAD_LETTER_LIMIT 条
+        self.cycle = None
+        self.committed_at = None
+        self.outputs = []
+        self.delivered = 0
+        self.etag = None
+
+    def load(self, legacy_position=None):
+        """启动时读取检查点；不存在时从旧版 last_position 迁移，把该时间及之前的对象视为已消费"""
+        data, self.etag = load_json_with_etag(CHECKPOINT_FOLDER, self.filename)
+        if data is not None:
+            self.watermark = data.get("watermark")
+            self.recent = set(data.get("recent", []))
+            self.attempts = data.get("attempts", {})
+            self.dead_letter = data.get("dead_letter", [])
+            self.cycle = data.get("cycle")
+            self.committed_at = data.get("committed_at")
+            self.outputs = data.get("outputs", [])
+            self.delivered = data.get("delivered", 0)
+            log_info(f"周期检查点加载完成: 游标 {self.watermark}, 待交付 {len(self.outputs) - self.delivered} 条")
+        elif legacy_position:
+            # "~" 排在 "_" 之后：与旧逻辑一致，last_position 同一秒的分段视为已处理
+            self.watermark = f"{MEMPOOL_FOLDER}/{partition_path(legacy_position)}/{legacy_position.replace(' ', '_')}~"
+            migrate_flat_mempool(legacy_position)
+            files = list_s3_files(MEMPOOL_FOLDER, shift_timestamp(legacy_position, -self.settle_seconds), partitioned=True)
+            self.recent = {key for _, key in files if key <= self.watermark}
+            log_info(f"已从 last_position {legacy_position} 迁移周期游标")
+        return self
+
+    @property
+    def pending(self):
+        return self.delivered < len(self.outputs)
+
+    @property
+    def position(self):
+        """游标对应的时间，仅用于展示"""
+        return key_timestamp(self.watermark) if self.watermark else None
+
+    def list_start(self):
+        return shift_timestamp(self.position, -self.settle_seconds) if self.watermark else None
+
+    def select(self, files):
+        """从 list_s3_files 结果中挑出尚未消费的对象：水位之后的新键，以及沉淀窗口内迟到的键"""
+        start = self.list_start()
+        return [
+            (timestamp, key) for timestamp, key in files
+            if key not in self.recent and (self.watermark is None or key > self.watermark or timestamp > start)
+        ]
+
+    def advance(self, planned, failed, deferred=()):
+        """按本周期计划消费的键推进游标，返回 (水位, 已消费键, 重试计数, 本次转入死信的键)。
+        failed 是处理失败的键，计一次失败，未达到 max_attempts 时不算消费，水位停在第一个待重试键之前；
+        deferred 是本周期整体未能处理（如 LLM 服务不可用）的键，下次重试但不计失败次数"""
+        attempts = dict(self.attempts)
+        dead = []
+        for key in sorted(set(failed)):
+            attempts[key] = attempts.get(key, 0) + 1
+            if attempts[key] >= self.max_attempts:
+                dead.append(key)
+        retry = (set(failed) | set(deferred)) - set(dead)
+        recent = self.recent | {key for _, key in planned if key not in retry}
+        # 之前周期已消费、因前面有待重试键而留在水位之后的键，在该键消费或转入死信后一并越过
+        watermark = self.watermark
+        for key in sorted(recent | retry):
+            if key in retry:
+                break
+            if watermark is None or key > watermark:
+                watermark = key
+        if watermark:
+            cutoff = shift_timestamp(key_timestamp(watermark), -self.settle_seconds)
+            recent = {key for key in recent if key > watermark or key_timestamp(key) > cutoff}
+        return watermark, recent, {key: count for key, count in attempts.items() if key in retry}, dead
+
+    def document(self):
+        return {
+            "watermark": self.watermark,
+            "recent": sorted(self.recent),
+            "attempts": self.attempts,
+            "dead_letter": self.dead_letter,
+            "term": self.term(),
+            "cycle": self.cycle,
+            "committed_at": self.committed_at,
+            "outputs": self.outputs,
+            "delivered": self.delivered
+        }
+
+    def _save(self):
+        # ETag 条件写入：另一个副本已推进检查点时抛出 ETagMismatch，而不是覆盖它的进度
+        document = self.document()
+        if not conditional_put():
+            # 存储端不保证条件写入时，写前检查任期：新主节点写过检查点后，旧主节点的写入一律拒绝
+            current, etag = load_json_with_etag(CHECKPOINT_FOLDER, self.filename)
+            if etag != self.etag or (current or {}).get("term", 0) > document["term"]:
+                raise ETagMismatch(f"{CHECKPOINT_FOLDER}/{self.filename}")
+        self.etag = save_json_if_match(document, CHECKPOINT_FOLDER, self.filename, self.etag)
+        if not conditional_put():
+            # 比对与 PUT 之间仍有窗口，回读确认最后写入的是自己；被覆盖时放弃，由覆盖方的进度为准
+            _, etag = load_json_with_etag(CHECKPOINT_FOLDER, self.filename)
+            if etag != self.etag:
+                raise ETagMismatch(f"{CHECKPOINT_FOLDER}/{self.filename}")
+
+    async def commit(self, cycle, planned, failed, outputs, deferred=()):
+        """一次写入同时推进游标并记录本周期的全部产出（待交付）"""
+        watermark, recent, attempts, dead = self.advance(planned, failed, deferred)
+        previous = self.document()
+        self.watermark, self.recent, self.attempts = watermark, recent, attempts
+        if dead:
+            now = get_timestamp()
+            self.dead_letter = (self.dead_letter + [{"key": key, "attempts": self.max_attempts, "at": now} for key in dead])[-DEAD_LETTER_LIMIT:]
+        self.cycle, self.committed_at = cycle, get_timestamp()
+        self.outputs, self.delivered = list(outputs), 0
+        try:
+            await run_in_s3_executor(self._save)
+        except Exception:
+            self.watermark, self.recent = previous["watermark"], set(previous["recent"])
+            self.attempts, self.dead_letter = previous["attempts"], previous["dead_letter"]
+            self.cycle, self.committed_at = previous["cycle"], previous["committed_at"]
+            self.outputs, self.delivered = previous["outputs"], previous["delivered"]
+            raise
+        for key in dead:
+            log_error(f"mempool 对象连续 {self.max_attempts} 次处理失败，已转入死信并跳过: {key}")
+        metrics.inc("checkpoint_dead_letter_total", len(dead))
+        log_info(f"周期 {cycle} 已提交: 游标 {self.watermark}, 产出 {len(self.outputs)} 条, 待重试 {len(self.attempts)} 个对象")
+
+    async def mark_delivered(self, count):
+        self.delivered = count
+        if not self.pending:
+            self.outputs, self.delivered = [], 0  # 全部交付后清空，检查点只保留游标
+        await run_in_s3_executor(self._save)
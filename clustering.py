@@ -0,0 +1,115 @@
+import numpy as np
+from config import CLUSTER_SIMILARITY_THRESHOLD, CLUSTER_BATCH_SIZE, CLUSTER_TEXT_CHARS, CLUSTER_MAX_LINKS
+from utils import log_info
+from metrics import metrics
+from embedding_index import normalize
+from llm_agent import get_embeddings
+
+def greedy_clusters(vectors, threshold=CLUSTER_SIMILARITY_THRESHOLD):
+    """贪心阈值聚类：按顺序取第一条未归类的向量作为中心，把与它余弦相似度达到 threshold 的未归类向量并入；
+    相似度矩阵一次算出，每个簇只做一次向量化的行比较。返回每行的簇编号（从 0 开始，按出现顺序）"""
+    vectors = normalize(vectors)
+    similarity = vectors @ vectors.T
+    labels = np.full(len(vectors), -1, dtype=np.int64)
+    cluster = 0
+    for i in range(len(vectors)):
+        if labels[i] >= 0:
+            continue
+        members = (labels < 0) & (similarity[i] >= threshold)
+        members[i] = True
+        labels[members] = cluster
+        cluster += 1
+    return labels, similarity
+
+def medoid(members, similarity):
+    """簇内与其他成员相似度之和最大的一条作为代表"""
+    if len(members) == 1:
+        return members[0]
+    return members[int(similarity[np.ix_(members, members)].sum(axis=1).argmax())]
+
+def merge_sources(representative, message):
+    """把消息的来源 mempool 对象键并入代表消息（原地追加），代表所在的块总结失败时这些对象一并重试"""
+    if representative.get("mempool_keys") is not None and message.get("mempool_keys"):
+        representative["mempool_keys"].extend(key for key in message["mempool_keys"] if key not in representative["mempool_keys"])
+
+class MessageClusterer:
+    """LLM 前的消息聚类：同一事件被多个频道转发时只把一条代表消息交给 LLM，并附带来源数和链接。
+    一个总结周期使用一个实例：按批聚类，后续批次中与已发送代表相似的消息只计入，不再重复发送"""
+
+    def __init__(self, threshold=CLUSTER_SIMILARITY_THRESHOLD, batch_size=CLUSTER_BATCH_SIZE):
+        self.threshold = threshold
+        self.batch_size = batch_size
+        self.leaders = None  # 已发送代表的归一化向量
+        self.leader_messages = []  # 与 leaders 各行对应的代表消息
+        self.messages = 0
+        self.clusters = 0
+        self.absorbed = 0  # 并入之前批次代表的消息数
+
+    async def cluster(self, messages):
+        """对一批消息聚类，返回代表消息（原消息的副本，多成员簇带 cluster_size / cluster_sources / cluster_links）"""
+        self.messages += len(messages)
+        embeddings = await get_embeddings([message.get("content", "")[:CLUSTER_TEXT_CHARS] for message in messages])
+        valid = [i for i, embedding in enumerate(embeddings) if embedding is not None]
+        representatives = [dict(messages[i]) for i, embedding in enumerate(embeddings) if embedding is None]  # Embedding 失败的消息单独成簇
+        if valid:
+            vectors = normalize([embeddings[i] for i in valid])
+            if self.leaders is not None:
+                similarity = vectors @ self.leaders.T
+                seen = similarity.max(axis=1) >= self.threshold
+                for row, leader in zip(np.flatnonzero(seen), similarity[seen].argmax(axis=1)):
+                    merge_sources(self.leader_messages[leader], messages[valid[row]])
+                self.absorbed += int(seen.sum())
+                valid = [i for i, skip in zip(valid, seen) if not skip]
+                vectors = vectors[~seen]
+        if valid:
+            labels, similarity = greedy_clusters(vectors, self.threshold)
+            leaders = []
+            for cluster in range(labels.max() + 1):
+                members = np.flatnonzero(labels == cluster)
+                leader = medoid(members, similarity)
+                leaders.append(leader)
+                representative = self.representative(messages[valid[leader]], [messages[valid[member]] for member in members])
+                self.leader_messages.append(representative)
+                representatives.append(representative)
+            self.leaders = vectors[leaders] if self.leaders is None else np.vstack([self.leaders, vectors[leaders]])
+        self.clusters += len(representatives)
+        metrics.inc("cluster_messages_total", len(messages))
+        metrics.inc("cluster_representatives_total", len(representatives))
+        representatives.sort(key=lambda message: message.get("timestamp", ""))
+        return representatives
+
+    @staticmethod
+    def representative(leader, members):
+        message = dict(leader)
+        if leader.get("mempool_keys") is not None:
+            message["mempool_keys"] = []
+            for member in members:
+                merge_sources(message, member)
+        if len(members) > 1:
+            sources, links = [], []
+            for member in members:
+                if member.get("source") and member["source"] not in sources:
+                    sources.append(member["source"])
+                if member.get("original_link") and member["original_link"] not in links:
+                    links.append(member["original_link"])
+            message["cluster_size"] = len(members)
+            message["cluster_sources"] = sources
+            message["cluster_links"] = links[:CLUSTER_MAX_LINKS]
+        return message
+
+    async def representatives(self, messages):
+        """包装消息的异步迭代器：攒满一批后聚类，依次产出代表消息"""
+        batch = []
+        async for message in messages:
+            batch.append(message)
+            if len(batch) >= self.batch_size:
+                for representative in await self.cluster(batch):
+                    yield representative
+                batch = []
+        if batch:
+            for representative in await self.cluster(batch):
+                yield representative
+
+    def log_stats(self):
+        if self.messages:
+            log_info(f"消息聚类: {self.messages} 条消息 -> {self.clusters} 条代表, 其中 {self.absorbed} 条并入之前批次的事件")
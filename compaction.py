@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+from itertools import groupby
+from config import COMPACTION_AGE_HOURS, CURSOR_SETTLE_SECONDS, TIMEZONE
+from utils import log_info, log_error
+from s3_storage import (list_s3_files, fetch_mempool_object, save_bytes_to_s3, delete_keys_from_s3, load_from_s3,
+                        save_to_s3, encode_columns, COLUMNAR_SUFFIX)
+
+COMPACTION_STATE_FOLDER = "checkpoint"
+COMPACTION_STATE_FILE = "compaction.json"
+# (目录, 是否按小时分区, 分组键长度)：mempool 每个小时分区压成一个对象，扁平的发布记录每天压成一个对象
+COMPACTION_FOLDERS = [("intel_mempool", True, 13), ("intel_publish", False, 10)]
+
+def shift_timestamp(timestamp, seconds):
+    return (datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S") + timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S")
+
+def message_identity(message):
+    return (message.get("timestamp"), message.get("chat_id"), message.get("id"), message.get("content"))
+
+def compact_group(keys, skip=()):
+    """把同一组（同一目录、同一小时或同一天）的对象合并为一个列式归档对象，写入成功后删除原对象，返回 (消息数, 合并的对象数)。
+    组内已有归档对象（上次写入后、删除前中断）时一并读入并按消息去重，重跑是幂等的。
+    skip 中的键（检查点死信）和无法读取的对象原样保留，不影响组内其余对象的压缩"""
+    messages, seen, merged = [], set(), []
+    for key in keys:
+        if key in skip:
+            log_info(f"压缩跳过死信对象: {key}")
+            continue
+        try:
+            batch = fetch_mempool_object(key)
+        except Exception as e:
+            log_error(f"压缩跳过无法读取的对象: {key}, 错误: {str(e)}")
+            continue
+        merged.append(key)
+        for message in batch:
+            identity = message_identity(message)
+            if identity not in seen:
+                seen.add(identity)
+                messages.append(message)
+    if not merged:
+        return 0, 0
+    messages.sort(key=lambda message: message.get("timestamp", ""))
+    folder, last = merged[-1].rsplit("/", 1)
+    filename = f"{last[:19]}_compact{COLUMNAR_SUFFIX}"
+    save_bytes_to_s3(encode_columns(messages), folder, filename)
+    delete_keys_from_s3([key for key in merged if key != f"{folder}/{filename}"])
+    return len(messages), len(merged)
+
+def compact_folder(folder, partitioned, group_length, cutoff, start_time=None, skip=()):
+    """压缩 folder 中早于 cutoff 所在小时/天的对象；只含一个归档对象的组跳过，某组失败时继续处理其余组，
+    返回 (压缩组数, 删除对象数, 消息数, 是否全部成功)"""
+    files = list_s3_files(folder, start_time, partitioned)
+    groups = compacted = removed = 0
+    complete = True
+    for _, group in groupby((item for item in files if item[0][:group_length] < cutoff[:group_length]), key=lambda item: item[0][:group_length]):
+        keys = [key for _, key in group]
+        if len(keys) == 1 and keys[0].endswith(COLUMNAR_SUFFIX):
+            continue
+        try:
+            count, merged = compact_group(keys, skip)
+            compacted += count
+            groups += 1
+            removed += merged
+        except Exception as e:
+            log_error(f"压缩失败: {keys[0]} 等 {len(keys)} 个对象, 错误: {str(e)}")
+            complete = False
+    return groups, removed, compacted, complete
+
+def compact_history(position=None, age_hours=COMPACTION_AGE_HOURS, dead_letter=()):
+    """定期压缩任务：把旧的 mempool 分段和发布记录合并为按时间分区的列式归档对象，减少对象数、体积和读取请求。
+    mempool 只压缩早于周期游标沉淀窗口的对象（已被总结消费），不会影响游标的选取；dead_letter 中的键原样保留"""
+    skip = set(dead_letter)
+    state = load_from_s3(COMPACTION_STATE_FOLDER, COMPACTION_STATE_FILE) or {}
+    now = TIMEZONE.localize(datetime.now()).strftime("%Y-%m-%d %H:%M:%S")
+    for folder, partitioned, group_length in COMPACTION_FOLDERS:
+        cutoff = shift_timestamp(now, -age_hours * 3600)
+        if folder == "intel_mempool":
+            if not position:
+                continue
+            cutoff = min(cutoff, shift_timestamp(position, -CURSOR_SETTLE_SECONDS))
+        groups, removed, messages, complete = compact_folder(folder, partitioned, group_length, cutoff, state.get(folder), skip)
+        if complete:
+            # 下次从本次截止的小时/天开始列出；减 1 秒是因为 list_s3_files 跳过时间等于 start_time 的对象
+            floor = cutoff[:group_length] + "0000-00-00 00:00:00"[group_length:]
+            state[folder] = max(state.get(folder) or "", shift_timestamp(floor, -1))
+        if groups:
+            log_info(f"{folder} 压缩完成: {groups} 组, {removed} 个对象合并为 {groups} 个归档, 共 {messages} 条")
+    save_to_s3(state, COMPACTION_STATE_FOLDER, COMPACTION_STATE_FILE)
+    return state
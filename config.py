@@ -9,15 +9,96 @@ TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 S3_BUCKET = os.getenv("S3_BUCKET")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")  # 可指向 MinIO / moto server 等本地 S3
+S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", "16"))  # 异步 S3 请求的最大并发数
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "s3")  # 存储后端：s3、local（单节点 SQLite）、tiered（本地读缓存 + S3）
+LOCAL_STORAGE_PATH = os.getenv("LOCAL_STORAGE_PATH", "x-intel.db")  # local / tiered 模式的 SQLite 文件
+TIERED_CACHE_PREFIXES = [p for p in os.getenv("TIERED_CACHE_PREFIXES", "intel_mempool/,intel_publish/").split(",") if p]  # tiered 模式下缓存到本地的只写一次对象前缀
+TIERED_CACHE_DAYS = int(os.getenv("TIERED_CACHE_DAYS", "7"))  # tiered 模式本地缓存保留天数
+S3_FETCH_RETRIES = int(os.getenv("S3_FETCH_RETRIES", "3"))  # 批量拉取时单个对象的重试次数
+S3_RETRY_BASE_DELAY = float(os.getenv("S3_RETRY_BASE_DELAY", "0.5"))  # 重试退避基数（秒），按 2 的幂增长
 LLM_API_KEY = os.getenv("LLM_API_KEY")
 LLM_BASE_URL = os.getenv("LLM_BASE_URL")
 MODEL_ID = os.getenv("MODEL_ID")
 EMBEDDING_API_KEY = os.getenv("EMBEDDING_API_KEY")
 EMBEDDING_BASE_URL = os.getenv("EMBEDDING_BASE_URL")
 EMBEDDING_MODEL_ID = os.getenv("EMBEDDING_MODEL_ID")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))  # 单次 Embedding 请求最多携带的文本数
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))  # 内存 Embedding 缓存上限（字节）
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")  # 设置后启用 SQLite 磁盘缓存，重启后无需重新请求
+EMBEDDING_CACHE_DISK_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_DISK_MAX_ROWS", "100000"))  # 磁盘缓存最多保留的条数，超出后按最近访问时间淘汰，0 表示不限
 ADMIN_HANDLES = os.getenv("ADMIN_HANDLES").split(",")
 DEFAULT_SUMMARY_CYCLE = 60  # 分钟
+CONTINUOUS_SUMMARY = os.getenv("CONTINUOUS_SUMMARY", "false").lower() == "true"  # 事件驱动的连续总结模式，周期任务仍作为兜底
+MICRO_BATCH_SIZE = int(os.getenv("MICRO_BATCH_SIZE", "20"))  # 连续模式下累计多少条新消息触发一次小批量总结
+MICRO_BATCH_SECONDS = int(os.getenv("MICRO_BATCH_SECONDS", "120"))  # 连续模式下最早一条未总结消息的最长等待秒数
+SCHEDULER_MIN_INTERVAL_MINUTES = float(os.getenv("SCHEDULER_MIN_INTERVAL_MINUTES", "5"))  # 自适应调度两轮总结之间的最短间隔（分钟），设定周期为最长间隔
+SCHEDULER_TARGET_BATCH = int(os.getenv("SCHEDULER_TARGET_BATCH", "200"))  # 每轮总结期望处理的消息数，消息速率越高间隔越短
+SCHEDULER_RATE_WINDOW_MINUTES = float(os.getenv("SCHEDULER_RATE_WINDOW_MINUTES", "15"))  # 估算消息速率的滑动窗口（分钟）
+SCHEDULER_TOKEN_BUDGET = int(os.getenv("SCHEDULER_TOKEN_BUDGET", "0"))  # 每小时 LLM + Embedding token 预算，0 表示不限制
+SCHEDULER_BUDGET_SOFT_LIMIT = float(os.getenv("SCHEDULER_BUDGET_SOFT_LIMIT", "0.8"))  # 用量达到预算的该比例后开始拉长间隔
+SCHEDULER_MAX_STRETCH = float(os.getenv("SCHEDULER_MAX_STRETCH", "4"))  # 接近预算时间隔最多放大为设定周期的倍数
+PRIORITY_SCORE_THRESHOLD = int(os.getenv("PRIORITY_SCORE_THRESHOLD", "3"))  # 关键词打分达到该值的消息立即触发总结
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))  # 全局每秒最多发送条数（Telegram 上限约 30）
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "0.33"))  # 单个群组/频道每秒发送条数（Telegram 上限约 20 条/分钟）
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))  # 单个会话允许的突发条数
+TELEGRAM_SEND_RETRIES = int(os.getenv("TELEGRAM_SEND_RETRIES", "3"))  # 遇到 RetryAfter 时的最大重试次数
+INGEST_ACK_INTERVAL = int(os.getenv("INGEST_ACK_INTERVAL", "300"))  # 每个来源频道的入库回执最短间隔（秒），0 表示关闭回执
+CONFIG_DOCUMENT = "bot_config.json"  # config 目录下合并后的配置文档
+CONFIG_SNAPSHOT_PATH = os.getenv("CONFIG_SNAPSHOT_PATH", "config.snapshot.json")  # 配置文档的本地快照，启动时直接读取、后台再与 S3 同步；为空则不使用
+CONFIG_SAVE_DEBOUNCE_SECONDS = float(os.getenv("CONFIG_SAVE_DEBOUNCE_SECONDS", "2"))  # 配置修改后延迟合并写回的秒数
+MEMPOOL_FLUSH_SIZE = int(os.getenv("MEMPOOL_FLUSH_SIZE", "50"))  # mempool 缓冲累计条数达到该值即写入一个分段
+MEMPOOL_FLUSH_SECONDS = int(os.getenv("MEMPOOL_FLUSH_SECONDS", "30"))  # 缓冲中最早一条消息的最长等待秒数
+MEMPOOL_GZIP = os.getenv("MEMPOOL_GZIP", "true").lower() == "true"  # 分段是否 gzip 压缩
+MEMPOOL_READ_SEGMENTS = os.getenv("MEMPOOL_READ_SEGMENTS", "true").lower() == "true"  # 拉取时是否直接读取批量分段对象
+LLM_CHUNK_TOKEN_BUDGET = int(os.getenv("LLM_CHUNK_TOKEN_BUDGET", "6000"))  # 单次 LLM 请求中消息部分的估算 token 上限
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))  # 分块总结时同时进行的 LLM 请求数
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "16"))  # 总结流水线各阶段输入队列的容量
+PIPELINE_SUMMARIZE_WORKERS = int(os.getenv("PIPELINE_SUMMARIZE_WORKERS", str(LLM_MAX_CONCURRENCY)))  # LLM 分块总结阶段的 worker 数
+INGEST_DEDUP_ENABLED = os.getenv("INGEST_DEDUP_ENABLED", "true").lower() == "true"  # 入库前过滤多频道转发的重复消息
+INGEST_DEDUP_WINDOW_SECONDS = int(os.getenv("INGEST_DEDUP_WINDOW_SECONDS", str(6 * 3600)))  # 重复检测的滑动窗口（秒）
+INGEST_DEDUP_MAX_ENTRIES = int(os.getenv("INGEST_DEDUP_MAX_ENTRIES", "20000"))  # 窗口内最多保留的指纹数
+CLUSTER_ENABLED = os.getenv("CLUSTER_ENABLED", "true").lower() == "true"  # 总结前按 Embedding 聚类，同一事件只把一条代表消息交给 LLM
+CLUSTER_SIMILARITY_THRESHOLD = float(os.getenv("CLUSTER_SIMILARITY_THRESHOLD", "0.88"))  # 消息余弦相似度达到该值视为同一事件
+CLUSTER_BATCH_SIZE = int(os.getenv("CLUSTER_BATCH_SIZE", "500"))  # 每批聚类的消息数，一个周期内的消息通常一批完成
+CLUSTER_TEXT_CHARS = 1000  # 做聚类 Embedding 时每条消息截取的字符数
+CLUSTER_MAX_LINKS = 5  # 代表消息附带的最多链接数
+NEAR_DUPLICATE_THRESHOLD = 0.8  # MinHash 估计的 Jaccard 相似度达到该值视为近重复
+MINHASH_MIN_LENGTH = 20  # 正文短于该长度时只按链接判重，避免短文本误判
+CYCLE_CHECKPOINT_FILE = "cycle.json"  # checkpoint 目录下的周期检查点（mempool 游标 + 待交付产出）
+CURSOR_SETTLE_SECONDS = int(os.getenv("CURSOR_SETTLE_SECONDS", "120"))  # 游标沉淀窗口（秒），接收其他写入方迟到的 mempool 分段，应大于 MEMPOOL_FLUSH_SECONDS
+CHECKPOINT_MAX_ATTEMPTS = int(os.getenv("CHECKPOINT_MAX_ATTEMPTS", "3"))  # 同一 mempool 对象连续处理失败多少次后转入死信，游标越过它
+LEADER_ELECTION = os.getenv("LEADER_ELECTION", "none")  # 多副本选主方式：none（单进程）、s3（S3 租约对象）、file（本机文件锁，测试用）
+LEADER_LEASE_SECONDS = int(os.getenv("LEADER_LEASE_SECONDS", "30"))  # 总结主节点租约时长（秒），每 1/3 时长续约一次
+LEADER_LOCK_FILE = os.getenv("LEADER_LOCK_FILE", "/tmp/x-intel-leader.lock")  # file 模式使用的锁文件
+INSTANCE_ID = os.getenv("INSTANCE_ID", "")  # 副本标识，为空时由主机名和进程号生成
+CONFIG_REFRESH_SECONDS = int(os.getenv("CONFIG_REFRESH_SECONDS", "60"))  # 多副本模式下重新读取共享配置的间隔（秒）
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # Prometheus 抓取端点 /metrics 的端口，0 表示不启动
+METRICS_DUMP_PATH = os.getenv("METRICS_DUMP_PATH", "")  # 设置后定期把指标以 Prometheus 文本格式写入该文件
+METRICS_DUMP_SECONDS = int(os.getenv("METRICS_DUMP_SECONDS", "60"))  # 指标写文件的间隔（秒）
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")  # 日志级别；httpx 等第三方库固定为 WARNING，避免每个请求都写日志
+REVIEW_CACHE_SIZE = int(os.getenv("REVIEW_CACHE_SIZE", "500"))  # 待审核总结在内存中缓存的最大条数，其余从 S3 读取
+REVIEW_TTL_HOURS = int(os.getenv("REVIEW_TTL_HOURS", "48"))  # 待审核总结的有效期（小时），过期后按钮失效并被清理
+DEDUP_SIMILARITY_THRESHOLD = 0.9  # 与已发布内容的余弦相似度超过该值视为重复
+EMBEDDING_INDEX_FILE = "index.npz"  # 旧版单文件 npz 向量索引快照，仅用于迁移
+EMBEDDING_INDEX_META = "index.meta.json"  # embeddings 目录下的向量索引元数据（版本、时间戳、内容），向量本体为 index-<版本>.npy
+EMBEDDING_SNAPSHOT_DIR = os.getenv("EMBEDDING_SNAPSHOT_DIR", "snapshots")  # 向量快照的本地缓存目录，加载时内存映射，为空则不落盘
+COMPACTION_ENABLED = os.getenv("COMPACTION_ENABLED", "true").lower() == "true"  # 是否定期把旧 mempool 分段和发布记录压缩为列式归档
+COMPACTION_AGE_HOURS = int(os.getenv("COMPACTION_AGE_HOURS", "24"))  # 只压缩早于该小时数的对象
+COMPACTION_INTERVAL_SECONDS = int(os.getenv("COMPACTION_INTERVAL_SECONDS", str(6 * 3600)))  # 压缩任务执行间隔（秒）
+BACKFILL_WINDOW_HOURS = int(os.getenv("BACKFILL_WINDOW_HOURS", "6"))  # 历史回填把时间范围切成该小时数的窗口，每个窗口独立处理和记录检查点
+BACKFILL_CONCURRENCY = int(os.getenv("BACKFILL_CONCURRENCY", "8"))  # 同时处理的回填窗口数
+BACKFILL_LLM_RPM = int(os.getenv("BACKFILL_LLM_RPM", "60"))  # 回填时 LLM 每分钟请求数上限
+BACKFILL_LLM_TPM = int(os.getenv("BACKFILL_LLM_TPM", "200000"))  # 回填时 LLM 每分钟估算 token 上限，0 表示不限
+BACKFILL_EMBEDDING_RPM = int(os.getenv("BACKFILL_EMBEDDING_RPM", "300"))  # 回填时 Embedding 每分钟请求数上限
+EMBEDDING_HORIZON_DAYS = int(os.getenv("EMBEDDING_HORIZON_DAYS", "30"))  # 去重只比较该天数内的发布历史，0 表示全部保留
+EMBEDDING_SAVE_DEBOUNCE_SECONDS = float(os.getenv("EMBEDDING_SAVE_DEBOUNCE_SECONDS", "300"))  # 新增已发布内容后延迟多久保存向量快照（秒），期间的新增合并为一次保存
+ANN_MIN_SIZE = int(os.getenv("ANN_MIN_SIZE", "5000"))  # 索引条数达到该值后改用 LSH 近似查询
+ANN_TABLES = 16  # LSH 哈希表数量
+ANN_BITS = 10  # 每张表的超平面数（桶编号位数）
+ANN_SEED = 20250303  # 超平面随机种子，固定后快照加载时可确定性重建
 TIMEZONE = pytz.timezone("Asia/Shanghai")  # UTC+8 时区
 SYSTEM_PROMPT = (f"你是一个加密货币信息分析助手，负责从Twitter消息中提炼重要内容。\n"+
                  f"分类为：1. 重大事件 Breaking; 2. 重要快讯 Just in（高/中/低）; 3. 收录发言/观点 Curated（价值内容/meme内容）。\n"+
-                 f"避免重复总结已发布内容。")
\ No newline at end of file
+                 f"避免重复总结已发布内容。\n"+
+                 f"消息末尾若标注了同一事件的消息数和来源，说明多个频道在转发，数量越多越应提高重要性。")
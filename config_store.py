@@ -0,0 +1,145 @@
+import os
+import json
+import asyncio
+from config import CONFIG_DOCUMENT, CONFIG_SAVE_DEBOUNCE_SECONDS, CONFIG_SNAPSHOT_PATH, STORAGE_BACKEND, S3_BUCKET, S3_ENDPOINT_URL, LOCAL_STORAGE_PATH
+from utils import log_info, log_error
+from s3_storage import load_json_with_etag, save_json_if_match, load_from_s3, run_in_s3_executor, s3_executor, ETagMismatch, conditional_put
+
+# 合并为单文档之前，每个配置项各自存放在 config/<key>.json
+LEGACY_CONFIG_KEYS = ["admins", "receive_channels", "review_channel", "publish_channel", "review_enabled", "summary_cycle", "last_position"]
+MAX_WRITE_ATTEMPTS = 5
+# 快照所属的存储位置，切换存储后端或桶后不会误用旧快照
+SNAPSHOT_SOURCE = f"{STORAGE_BACKEND}:{S3_BUCKET}:{S3_ENDPOINT_URL or ''}:{LOCAL_STORAGE_PATH if STORAGE_BACKEND == 'local' else ''}"
+
+class ConfigStore:
+    """单文档配置存储：读取走内存缓存，写入先更新内存再防抖合并写回 S3，用 ETag 乐观并发避免多副本互相覆盖"""
+
+    def __init__(self, filename=CONFIG_DOCUMENT, debounce=CONFIG_SAVE_DEBOUNCE_SECONDS, snapshot_path=CONFIG_SNAPSHOT_PATH):
+        self.filename = filename
+        self.debounce = debounce
+        self.snapshot_path = snapshot_path
+        self.from_snapshot = False  # 值来自本地快照，尚未与 S3 上的共享文档同步
+        self.values = {}
+        self.etag = None
+        self.dirty = set()
+        self._flush_lock = asyncio.Lock()
+        self._timer = None
+
+    def load(self):
+        """启动时优先读取本地快照（不访问 S3，之后由 refresh 同步）；没有快照时一次 GET 读取整个配置文档；
+        文档不存在时从旧版逐项配置并发读取并迁移"""
+        if self.load_snapshot():
+            return self
+        data, self.etag = load_json_with_etag("config", self.filename)
+        if data is not None:
+            self.values = data
+            self.save_snapshot()
+            log_info(f"配置文档加载完成: {len(self.values)} 项")
+            return self
+        legacy_values = s3_executor.map(lambda key: load_from_s3("config", f"{key}.json"), LEGACY_CONFIG_KEYS)
+        for key, legacy in zip(LEGACY_CONFIG_KEYS, legacy_values):
+            if legacy and legacy.get("value") is not None:
+                self.values[key] = legacy["value"]
+        if self.values:
+            self.dirty.update(self.values)
+            self._write()
+            log_info(f"已从旧版逐项配置迁移 {len(self.values)} 项到 {self.filename}")
+        return self
+
+    def load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+            if snapshot.get("filename") != self.filename or snapshot.get("source") != SNAPSHOT_SOURCE:
+                return False
+            self.values, self.etag = snapshot["values"], snapshot.get("etag")
+        except Exception as e:
+            log_error(f"读取本地配置快照失败，改为从 S3 加载: {str(e)}")
+            return False
+        self.from_snapshot = True
+        log_info(f"已从本地快照加载配置: {len(self.values)} 项，稍后与 S3 同步")
+        return True
+
+    def save_snapshot(self):
+        """把与 S3 一致的配置写入本地快照（先写临时文件再改名）"""
+        if not self.snapshot_path:
+            return
+        try:
+            with open(f"{self.snapshot_path}.tmp", "w", encoding="utf-8") as f:
+                json.dump({"filename": self.filename, "source": SNAPSHOT_SOURCE, "etag": self.etag, "values": self.values}, f, ensure_ascii=False)
+            os.replace(f"{self.snapshot_path}.tmp", self.snapshot_path)
+        except Exception as e:
+            log_error(f"写入本地配置快照失败: {str(e)}")
+
+    def get(self, key, default=None):
+        value = self.values.get(key)
+        return default if value is None else value
+
+    def set(self, key, value):
+        """更新内存并安排一次防抖写回，短时间内的多次修改合并为一次 PUT"""
+        self.values[key] = value
+        self.dirty.add(key)
+        if self._timer is None:
+            try:
+                self._timer = asyncio.get_running_loop().create_task(self._flush_later())
+            except RuntimeError:
+                self._write()  # 没有事件循环（如启动阶段）时直接同步写入
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.debounce)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception as e:
+            log_error(f"配置写回失败，保留待写项等待下次重试: {str(e)}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self.dirty:
+                await run_in_s3_executor(self._write)
+
+    async def refresh(self):
+        """重新读取共享配置文档（多副本时其他副本可能已修改），本地未写回的项不被覆盖，返回发生变化的键"""
+        async with self._flush_lock:
+            return await run_in_s3_executor(self._refresh)
+
+    def _refresh(self):
+        remote, etag = load_json_with_etag("config", self.filename)
+        self.from_snapshot = False
+        if remote is None or etag == self.etag:
+            return set()
+        changed = {key for key, value in remote.items() if key not in self.dirty and self.values.get(key) != value}
+        for key in changed:
+            self.values[key] = remote[key]
+        self.etag = etag
+        self.save_snapshot()
+        return changed
+
+    def _write(self):
+        """写回本地修改；ETag 不一致时重新读取远端文档，以本地修改覆盖后重试"""
+        for _ in range(MAX_WRITE_ATTEMPTS):
+            pending = set(self.dirty)
+            document = dict(self.values)
+            try:
+                self.etag = save_json_if_match(document, "config", self.filename, self.etag)
+                if not conditional_put():
+                    # 不支持条件写入时，比对 ETag 与 PUT 之间仍有窗口，回读确认本次修改没有被并发写入覆盖
+                    remote, etag = load_json_with_etag("config", self.filename)
+                    if etag != self.etag and any((remote or {}).get(key) != document.get(key) for key in pending):
+                        raise ETagMismatch(f"config/{self.filename}")
+                self.dirty -= {key for key in pending if self.values.get(key) == document.get(key)}
+                self.save_snapshot()
+                log_info(f"配置已写回: {sorted(pending)}")
+                return
+            except ETagMismatch:
+                remote, self.etag = load_json_with_etag("config", self.filename)
+                for key, value in (remote or {}).items():
+                    if key not in self.dirty:
+                        self.values[key] = value
+                log_info("配置文档已被其他副本修改，合并后重试")
+        raise ETagMismatch(f"config/{self.filename}")
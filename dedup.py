@@ -0,0 +1,149 @@
+import re
+import time
+import hashlib
+import unicodedata
+from collections import deque
+from urllib.parse import urlsplit, parse_qsl, urlencode
+import numpy as np
+from metrics import metrics
+from config import INGEST_DEDUP_WINDOW_SECONDS, INGEST_DEDUP_MAX_ENTRIES, NEAR_DUPLICATE_THRESHOLD, MINHASH_MIN_LENGTH
+
+URL_PATTERN = re.compile(r"https?://\S+")
+TWITTER_HOSTS = {"twitter.com", "x.com", "mobile.twitter.com", "fxtwitter.com", "vxtwitter.com", "fixupx.com"}
+# 只用于追踪来源、不影响链接指向内容的查询参数；utm_ 开头的全部视为追踪参数
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "igshid", "mc_cid", "mc_eid", "yclid", "ref", "ref_src", "ref_url",
+                   "si", "spm", "feature"}
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16  # 16 段 x 4 行，Jaccard 约 0.5 以上即成为候选，再用签名估计值精确判定
+LSH_ROWS = MINHASH_PERMUTATIONS // LSH_BANDS
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_rng = np.random.RandomState(20250303)
+PERMUTATION_A = _rng.randint(1, 1 << 32, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+PERMUTATION_B = _rng.randint(0, 1 << 32, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+def normalize_link(link):
+    """规范化原文链接：统一 Twitter 各镜像域名，推文只保留 status ID；其他链接去掉锚点和追踪参数，其余查询参数排序后保留"""
+    link = (link or "").strip()
+    if not link.startswith(("http://", "https://")):
+        return ""
+    parts = urlsplit(link)
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = parts.path.rstrip("/")
+    if host in TWITTER_HOSTS:
+        match = re.search(r"/status(?:es)?/(\d+)", path)
+        return f"x.com/status/{match.group(1)}" if match else f"x.com{path.lower()}"
+    params = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                    if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS)
+    return f"{host}{path}?{urlencode(params)}" if params else f"{host}{path}"
+
+def is_near_duplicate_text(content, others, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """不依赖 Embedding 的文本比较：规范化后完全相同，或 MinHash 估计的 Jaccard 相似度达到阈值"""
+    body = normalize_body({"content": content})
+    if not body:
+        return False
+    signature = minhash(body)
+    for other in others:
+        other_body = normalize_body({"content": other})
+        if other_body == body or (other_body and np.mean(minhash(other_body) == signature) >= threshold):
+            return True
+    return False
+
+def normalize_body(message):
+    """去掉来源行和链接后做 NFKC、小写与空白压缩，作为相似度比较的正文"""
+    content = message.get("content", "")
+    if "\n" in content and message.get("source") == content.split("\n")[0]:
+        content = content.split("\n", 1)[1]
+    content = URL_PATTERN.sub(" ", unicodedata.normalize("NFKC", content).lower())
+    return re.sub(r"\s+", " ", content).strip()
+
+def minhash(text, shingle_size=3):
+    """基于字符 n-gram 的 MinHash 签名，对中英文混排都适用"""
+    shingles = {text[i:i + shingle_size] for i in range(max(1, len(text) - shingle_size + 1))}
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingles],
+        dtype=np.uint64
+    )
+    # a, b, h 均小于 2^32，a * h + b 不会溢出 uint64
+    permuted = (hashes[:, None] * PERMUTATION_A + PERMUTATION_B) % MERSENNE_PRIME
+    return permuted.min(axis=0).astype(np.uint32)
+
+def band_keys(signature):
+    return [(i, signature[i * LSH_ROWS:(i + 1) * LSH_ROWS].tobytes()) for i in range(LSH_BANDS)]
+
+class DuplicateFilter:
+    """入库前的近重复过滤：原文链接精确匹配 + MinHash/LSH 近似匹配，滑动窗口内存有界"""
+
+    def __init__(self, window_seconds=INGEST_DEDUP_WINDOW_SECONDS, max_entries=INGEST_DEDUP_MAX_ENTRIES,
+                 threshold=NEAR_DUPLICATE_THRESHOLD, min_length=MINHASH_MIN_LENGTH):
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.min_length = min_length
+        self.entries = deque()  # (序号, 写入时间, 链接键, 签名)
+        self.signatures = {}
+        self.links = {}
+        self.buckets = {}
+        self.next_id = 0
+        self.suppressed = 0
+        self.total_suppressed = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _evict(self, now):
+        while self.entries and (len(self.entries) > self.max_entries or now - self.entries[0][1] > self.window_seconds):
+            entry_id, _, link_key, signature = self.entries.popleft()
+            if link_key and self.links.get(link_key, 0) > 1:
+                self.links[link_key] -= 1
+            elif link_key:
+                self.links.pop(link_key, None)
+            if signature is not None:
+                del self.signatures[entry_id]
+                for key in band_keys(signature):
+                    bucket = self.buckets.get(key)
+                    if bucket is not None:
+                        bucket.discard(entry_id)
+                        if not bucket:
+                            del self.buckets[key]
+
+    def _near_duplicate(self, signature):
+        candidates = set()
+        for key in band_keys(signature):
+            candidates.update(self.buckets.get(key, ()))
+        metrics.inc("ingest_dedup_comparisons_total", len(candidates))
+        for entry_id in candidates:
+            if np.mean(self.signatures[entry_id] == signature) >= self.threshold:
+                return True
+        return False
+
+    def check(self, message):
+        """判断消息是否为窗口内已见内容的重复；非重复时登记到索引"""
+        now = time.monotonic()
+        self._evict(now)
+        link_key = normalize_link(message.get("original_link"))
+        body = normalize_body(message)
+        signature = minhash(body) if len(body) >= self.min_length else None
+        if (link_key and link_key in self.links) or (signature is not None and self._near_duplicate(signature)):
+            self.suppressed += 1
+            self.total_suppressed += 1
+            metrics.inc("ingest_messages_total", result="duplicate")
+            return True
+        entry_id = self.next_id
+        self.next_id += 1
+        self.entries.append((entry_id, now, link_key, signature))
+        if link_key:
+            self.links[link_key] = self.links.get(link_key, 0) + 1
+        if signature is not None:
+            self.signatures[entry_id] = signature
+            for key in band_keys(signature):
+                self.buckets.setdefault(key, set()).add(entry_id)
+        self._evict(now)
+        metrics.inc("ingest_messages_total", result="new")
+        return False
+
+    def pop_cycle_stats(self):
+        """返回本周期被过滤的重复数并清零"""
+        suppressed, self.suppressed = self.suppressed, 0
+        return suppressed
@@ -0,0 +1,124 @@
+import hashlib
+import re
+import time
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from config import EMBEDDING_CACHE_MAX_BYTES, EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_DISK_MAX_ROWS
+from utils import log_info, log_error
+
+def normalize_text(text):
+    """Unicode NFKC 规范化并压缩空白，使转发时格式略有差异的相同内容命中同一缓存项"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+def cache_key(text, model_id):
+    return hashlib.sha256(f"{model_id}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """内容寻址的 Embedding 缓存：内存 LRU（按字节数淘汰）+ 可选的 SQLite 磁盘层（按条数上限淘汰最久未访问的）。
+    磁盘层的访问时间在写入和磁盘命中时更新，内存命中不回写，淘汰顺序是近似 LRU"""
+
+    def __init__(self, max_bytes=EMBEDDING_CACHE_MAX_BYTES, path=EMBEDDING_CACHE_PATH, disk_max_rows=EMBEDDING_CACHE_DISK_MAX_ROWS):
+        self.max_bytes = max_bytes
+        self.disk_max_rows = disk_max_rows
+        self.disk_rows = 0
+        self.entries = OrderedDict()
+        self.size_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            try:
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, accessed REAL NOT NULL DEFAULT 0)")
+                if "accessed" not in [row[1] for row in self._db.execute("PRAGMA table_info(embeddings)")]:
+                    # 旧版缓存文件没有访问时间，已有条目视为最久未访问
+                    self._db.execute("ALTER TABLE embeddings ADD COLUMN accessed REAL NOT NULL DEFAULT 0")
+                self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed)")
+                self._db.commit()
+                self.disk_rows = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                self._evict_disk()
+                log_info(f"Embedding 磁盘缓存已启用: {path}")
+            except Exception as e:
+                log_error(f"Embedding 磁盘缓存打开失败，仅使用内存缓存: {str(e)}")
+                self._db = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _remember(self, key, vector):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return
+        self.entries[key] = vector
+        self.size_bytes += vector.nbytes
+        while self.size_bytes > self.max_bytes and self.entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.size_bytes -= evicted.nbytes
+
+    def get(self, key):
+        with self._lock:
+            vector = self.entries.get(key)
+            if vector is not None:
+                self.entries.move_to_end(key)
+                self.memory_hits += 1
+                return vector
+            if self._db is not None:
+                row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                    try:
+                        self._db.execute("UPDATE embeddings SET accessed = ? WHERE key = ?", (time.time(), key))
+                        self._db.commit()
+                    except Exception as e:
+                        log_error(f"Embedding 磁盘缓存更新访问时间失败: {str(e)}")
+                    return vector
+            self.misses += 1
+            return None
+
+    def put_many(self, items):
+        """写入 (key, embedding) 列表，磁盘层一次事务提交"""
+        with self._lock:
+            rows = []
+            for key, embedding in items:
+                vector = np.asarray(embedding, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes(), time.time()))
+            if self._db is not None and rows:
+                try:
+                    self._db.executemany("INSERT OR REPLACE INTO embeddings (key, vector, accessed) VALUES (?, ?, ?)", rows)
+                    self._db.commit()
+                    self.disk_rows = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                    self._evict_disk()
+                except Exception as e:
+                    log_error(f"Embedding 磁盘缓存写入失败: {str(e)}")
+
+    def _evict_disk(self):
+        """磁盘层超过条数上限时删除最久未访问的条目，一次删到上限的 90%，避免每次写入都触发淘汰；调用方持有锁"""
+        if not self.disk_max_rows or self.disk_rows <= self.disk_max_rows:
+            return
+        excess = self.disk_rows - int(self.disk_max_rows * 0.9)
+        self._db.execute("DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY accessed LIMIT ?)", (excess,))
+        self._db.commit()
+        self.disk_rows -= excess
+        log_info(f"Embedding 磁盘缓存淘汰 {excess} 条最久未访问的条目")
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size_bytes,
+            "disk_rows": self.disk_rows,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+        }
+
+embedding_cache = EmbeddingCache()
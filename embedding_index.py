@@ -0,0 +1,344 @@
+import io
+import os
+import uuid
+import asyncio
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+from config import (EMBEDDING_INDEX_FILE, EMBEDDING_INDEX_META, EMBEDDING_SNAPSHOT_DIR, EMBEDDING_HORIZON_DAYS, EMBEDDING_SAVE_DEBOUNCE_SECONDS,
+                    ANN_MIN_SIZE, TIMEZONE)
+from utils import log_info, log_error, get_timestamp
+from ann_index import RandomProjectionLSH
+from metrics import metrics
+from s3_storage import (save_bytes_to_s3, load_bytes_from_s3, list_s3_files, load_from_s3, delete_keys_from_s3, load_json_with_etag,
+                        save_json_if_match, ETagMismatch, run_in_s3_executor)
+from storage_backend import ANY
+
+TAIL_FOLDER = "embeddings/tail"  # 快照之后新增条目的增量对象，每批发布写一个，并入快照后删除
+
+_embedding_index = None
+_index_lock = threading.Lock()
+
+def normalize(vectors):
+    """按行做 L2 归一化，零向量保持为零"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def snapshot_filename(version):
+    return f"index-{version}.npy"
+
+def cache_snapshot(version, data):
+    """把向量快照写入本地缓存目录（先写临时文件再改名），并删除旧版本"""
+    if not EMBEDDING_SNAPSHOT_DIR:
+        return None
+    os.makedirs(EMBEDDING_SNAPSHOT_DIR, exist_ok=True)
+    path = os.path.join(EMBEDDING_SNAPSHOT_DIR, snapshot_filename(version))
+    with open(f"{path}.tmp", "wb") as f:
+        f.write(data)
+    os.replace(f"{path}.tmp", path)
+    for name in os.listdir(EMBEDDING_SNAPSHOT_DIR):
+        if name.startswith("index-") and name.endswith(".npy") and name != snapshot_filename(version):
+            os.remove(os.path.join(EMBEDDING_SNAPSHOT_DIR, name))
+    return path
+
+def load_snapshot_vectors(version):
+    """加载向量快照：本地缓存中有该版本时直接内存映射，否则下载一次并落盘后映射"""
+    path = os.path.join(EMBEDDING_SNAPSHOT_DIR, snapshot_filename(version)) if EMBEDDING_SNAPSHOT_DIR else None
+    if path and os.path.exists(path):
+        return np.load(path, mmap_mode="r")
+    data = load_bytes_from_s3("embeddings", snapshot_filename(version))
+    if data is None:
+        raise ValueError(f"向量快照不存在: {snapshot_filename(version)}")
+    path = cache_snapshot(version, data)
+    return np.load(path, mmap_mode="r") if path else np.load(io.BytesIO(data))
+
+class EmbeddingIndex:
+    """已发布内容的内存向量索引：归一化后的 float32 矩阵 + 时间戳/内容元数据，规模较大时用 LSH 近似查询"""
+
+    def __init__(self, vectors=None, timestamps=None, contents=None, ann_min_size=ANN_MIN_SIZE, normalized=False):
+        self._lock = threading.Lock()
+        self.version = None  # 当前快照版本，保存新版本后删除旧的向量对象
+        self.meta_etag = None  # 加载或保存时元数据的 ETag，保存时据此发现其他写入方发布的新版本
+        self.unsaved = []  # 上次快照之后新增的 (归一化向量, 时间戳, 内容)，切换到他人发布的新版本时重新补上
+        self.unsaved_tail = []  # 内容已在内存中、尚未并入快照的增量对象键，快照保存成功后删除
+        self._timer = None
+        self._save_lock = asyncio.Lock()
+        self.timestamps = list(timestamps or [])
+        self.contents = list(contents or [])
+        self.ann_min_size = ann_min_size
+        self.ann = None
+        if vectors is None or len(vectors) == 0:
+            self._data = None
+            self._size = 0
+        else:
+            # 已归一化的快照（可能是只读的内存映射）直接使用，首次追加扩容时才复制到内存
+            self._data = vectors if normalized else normalize(vectors)
+            self._size = len(self._data)
+            self.ann = RandomProjectionLSH(self._data.shape[1])
+            self.ann.rebuild(self._data)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def dim(self):
+        return self._data.shape[1] if self._data is not None else None
+
+    @property
+    def vectors(self):
+        """当前有效的向量矩阵视图 (n, dim)"""
+        if self._data is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self._data[:self._size]
+
+    def add(self, embedding, timestamp, content):
+        """增量追加一条向量，容量按倍数扩展以避免每次整体拷贝"""
+        vector = normalize(embedding)[0]
+        with self._lock:
+            self._append(vector, timestamp, content)
+            self.unsaved.append((vector, timestamp, content))
+
+    def add_many(self, embeddings, timestamps, contents):
+        """追加一批向量：先写入一个只含本批的增量对象再加入内存，写入量与索引规模无关；
+        完整快照由 save_later 合并保存，进程在此之前退出时由 load 从增量对象补回"""
+        vectors = normalize(embeddings)
+        buffer = io.BytesIO()
+        np.savez(buffer, vectors=vectors, timestamps=np.array(timestamps, dtype=str), contents=np.array(contents, dtype=str))
+        filename = f"{get_timestamp().replace(' ', '_')}_{uuid.uuid4().hex[:8]}.npz"
+        save_bytes_to_s3(buffer.getvalue(), TAIL_FOLDER, filename)
+        with self._lock:
+            for vector, timestamp, content in zip(vectors, timestamps, contents):
+                self._append(vector, timestamp, content)
+                self.unsaved.append((vector, timestamp, content))
+            self.unsaved_tail.append(f"{TAIL_FOLDER}/{filename}")
+
+    def _append(self, vector, timestamp, content):
+        """追加一条已归一化的向量，调用方持有锁"""
+        if self._data is None:
+            self._data = np.zeros((16, vector.shape[0]), dtype=np.float32)
+            self.ann = RandomProjectionLSH(vector.shape[0])
+        elif vector.shape[0] != self._data.shape[1]:
+            raise ValueError(f"Embedding 维度不一致: {vector.shape[0]} != {self._data.shape[1]}")
+        if self._size == len(self._data):
+            grown = np.zeros((len(self._data) * 2, self._data.shape[1]), dtype=np.float32)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+        self._data[self._size] = vector
+        self.ann.add(vector.reshape(1, -1), self._size)
+        self._size += 1
+        self.timestamps.append(timestamp)
+        self.contents.append(content)
+
+    def max_similarity(self, embeddings, exact=False):
+        """返回每条查询与历史的最大余弦相似度；小索引或 exact=True 时一次矩阵乘法精确计算，否则只比较 LSH 候选"""
+        if not len(embeddings):
+            return np.zeros(0, dtype=np.float32)
+        queries = normalize(embeddings)
+        with self._lock:
+            if self._size == 0:
+                return np.full(len(queries), -1.0, dtype=np.float32)
+            if exact or self._size < self.ann_min_size:
+                metrics.inc("dedup_comparisons_total", self._size * len(queries), mode="exact")
+                return (self._data[:self._size] @ queries.T).max(axis=0)
+            scores = np.full(len(queries), -1.0, dtype=np.float32)
+            for i, (query, candidates) in enumerate(zip(queries, self.ann.candidates(queries))):
+                if len(candidates):
+                    metrics.inc("dedup_comparisons_total", len(candidates), mode="ann")
+                    scores[i] = (self._data[candidates] @ query).max()
+            return scores
+
+    def prune(self, horizon_days=EMBEDDING_HORIZON_DAYS):
+        """淘汰早于时间窗口的条目并重建 LSH 桶；时间戳未知的旧数据保留，返回淘汰条数"""
+        if not horizon_days or self._size == 0:
+            return 0
+        cutoff = (TIMEZONE.localize(datetime.now()) - timedelta(days=horizon_days)).strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            keep = [i for i, timestamp in enumerate(self.timestamps) if not timestamp or timestamp >= cutoff]
+            removed = self._size - len(keep)
+            if removed:
+                self._data = self._data[keep].copy() if keep else None
+                self._size = len(keep)
+                self.timestamps = [self.timestamps[i] for i in keep]
+                self.contents = [self.contents[i] for i in keep]
+                if self._data is None:
+                    self.ann = None
+                else:
+                    self.ann.rebuild(self._data)
+        if removed:
+            log_info(f"向量索引淘汰 {removed} 条早于 {cutoff} 的条目")
+        return removed
+
+    @classmethod
+    def from_bytes(cls, data):
+        """解析旧版 npz 单文件快照"""
+        with np.load(io.BytesIO(data), allow_pickle=False) as snapshot:
+            return cls(snapshot["vectors"], snapshot["timestamps"].tolist(), snapshot["contents"].tolist())
+
+    def save(self, replace=False, retry=True):
+        """快照为列式的两部分：index-<版本>.npy（归一化后的 float32 矩阵，可直接内存映射）和元数据 JSON。
+        元数据最后写入，作为切换版本的提交点；LSH 桶由固定种子在加载时重建，无需单独存储。
+        元数据按 ETag 条件写入：其他写入方（如回填重建索引）已发布新版本时不覆盖它，而是加载新版本、补上本进程
+        未保存的条目后再保存。replace=True 时无条件发布（回填重建索引）"""
+        self.prune()
+        version = uuid.uuid4().hex[:12]
+        with self._lock:
+            vectors = self.vectors.copy()
+            meta = {"version": version, "rows": len(vectors), "timestamps": list(self.timestamps), "contents": list(self.contents)}
+            saved = len(self.unsaved)
+            tail = list(self.unsaved_tail)
+        buffer = io.BytesIO()
+        np.save(buffer, vectors)
+        data = buffer.getvalue()
+        save_bytes_to_s3(data, "embeddings", snapshot_filename(version))
+        try:
+            self.meta_etag = save_json_if_match(meta, "embeddings", EMBEDDING_INDEX_META, ANY if replace else self.meta_etag)
+        except ETagMismatch:
+            delete_keys_from_s3([f"embeddings/{snapshot_filename(version)}"])
+            if not retry:
+                raise
+            log_info("向量索引已被其他写入方更新，加载新版本并补上本进程未保存的条目")
+            self.reload()
+            return self.save(retry=False)
+        with self._lock:
+            del self.unsaved[:saved]
+            self.unsaved_tail = [key for key in self.unsaved_tail if key not in tail]
+        if tail:
+            delete_keys_from_s3(tail)
+        try:
+            cache_snapshot(version, data)
+        except Exception as e:
+            log_error(f"向量快照写入本地缓存失败: {str(e)}")
+        if self.version:
+            delete_keys_from_s3([f"embeddings/{snapshot_filename(self.version)}"])
+        self.version = version
+        log_info(f"向量索引已快照: {len(self)} 条, 版本 {version}")
+
+    def reload(self):
+        """切换到存储中的最新版本，再补上本进程尚未保存的条目（按内容跳过新版本中已有的）"""
+        latest = type(self).load()
+        with self._lock:
+            self._data, self._size, self.ann = latest._data, latest._size, latest.ann
+            self.timestamps, self.contents = latest.timestamps, latest.contents
+            self.version, self.meta_etag = latest.version, latest.meta_etag
+            self.unsaved_tail = list(dict.fromkeys(latest.unsaved_tail + self.unsaved_tail))
+            self.unsaved = latest.unsaved + self.unsaved
+            present = set(self.contents)
+            for vector, timestamp, content in self.unsaved:
+                if content not in present:
+                    self._append(vector, timestamp, content)
+        log_info(f"向量索引已切换到版本 {self.version}: {len(self)} 条")
+
+    def save_later(self, delay=EMBEDDING_SAVE_DEBOUNCE_SECONDS):
+        """延迟保存快照，期间的新增合并为一次保存；没有事件循环时直接同步保存"""
+        if self._timer is None:
+            try:
+                self._timer = asyncio.get_running_loop().create_task(self._save_later(delay))
+            except RuntimeError:
+                self.save()
+
+    async def _save_later(self, delay):
+        await asyncio.sleep(delay)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception as e:
+            log_error(f"向量快照保存失败，增量对象保留等待下次重试: {str(e)}")
+
+    async def flush(self):
+        async with self._save_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self.unsaved or self.unsaved_tail:
+                await run_in_s3_executor(self.save)
+
+    def replay_tail(self):
+        """补回快照之后写入的增量对象（按内容跳过快照中已有的），下次保存快照后删除"""
+        replayed = 0
+        for _, key in list_s3_files(TAIL_FOLDER):
+            data = load_bytes_from_s3(TAIL_FOLDER, key.split("/")[-1])
+            if data is None:
+                continue
+            with np.load(io.BytesIO(data), allow_pickle=False) as tail:
+                vectors, timestamps, contents = tail["vectors"], tail["timestamps"].tolist(), tail["contents"].tolist()
+            with self._lock:
+                present = set(self.contents)
+                for vector, timestamp, content in zip(vectors, timestamps, contents):
+                    if content not in present:
+                        self._append(vector, timestamp, content)
+                        self.unsaved.append((vector, timestamp, content))
+                        present.add(content)
+                        replayed += 1
+                self.unsaved_tail.append(key)
+        if replayed:
+            log_info(f"从增量对象补回向量索引 {replayed} 条")
+        return self
+
+    @classmethod
+    def load(cls):
+        """加载向量索引并补回快照之后的增量对象"""
+        return cls._load().replay_tail()
+
+    @classmethod
+    def _load(cls):
+        """加载快照：元数据 + 内存映射的 npy 快照；没有时依次从旧版 npz 快照、逐条 JSON embedding 迁移一次"""
+        try:
+            meta, etag = load_json_with_etag("embeddings", EMBEDDING_INDEX_META)
+        except Exception:
+            meta, etag = None, None
+        if meta:
+            try:
+                vectors = load_snapshot_vectors(meta["version"])[:meta["rows"]]
+                index = cls(vectors, meta["timestamps"], meta["contents"], normalized=True)
+                index.version = meta["version"]
+                index.meta_etag = etag
+                index.prune()
+                log_info(f"向量索引加载完成: {len(index)} 条, 版本 {index.version}")
+                return index
+            except Exception as e:
+                log_error(f"向量快照加载失败，改为从旧数据重建: {str(e)}")
+        data = load_bytes_from_s3("embeddings", EMBEDDING_INDEX_FILE)
+        if data:
+            try:
+                index = cls.from_bytes(data)
+                index.meta_etag = etag
+                index.save()
+                log_info(f"已从旧版 npz 快照迁移向量索引: {len(index)} 条")
+                return index
+            except Exception as e:
+                log_error(f"向量索引快照解析失败，改为从旧数据重建: {str(e)}")
+        index = cls.from_legacy_files()
+        index.meta_etag = etag
+        if len(index):
+            index.save()
+        return index
+
+    @classmethod
+    def from_legacy_files(cls):
+        index = cls()
+        for _, key in list_s3_files("embeddings"):
+            if not key.endswith(".json") or key.endswith(EMBEDDING_INDEX_META):
+                continue
+            past_data = load_from_s3("embeddings", key.split("/")[-1])
+            if past_data and past_data.get("embedding"):
+                index.add(past_data["embedding"], past_data.get("timestamp", ""), past_data.get("content", ""))
+        log_info(f"从旧版 embedding 文件迁移向量索引: {len(index)} 条")
+        return index
+
+def get_embedding_index():
+    """进程内共享的向量索引，首次调用时从 S3 加载"""
+    global _embedding_index
+    if _embedding_index is None:
+        with _index_lock:
+            if _embedding_index is None:
+                _embedding_index = EmbeddingIndex.load()
+    return _embedding_index
+
+async def flush_embedding_index():
+    """关闭时保存尚未并入快照的条目；本进程没有加载过索引时不做任何事"""
+    if _embedding_index is not None:
+        await _embedding_index.flush()
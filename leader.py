@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import fcntl
+import socket
+import asyncio
+import uuid
+from config import LEADER_ELECTION, LEADER_LEASE_SECONDS, LEADER_LOCK_FILE, INSTANCE_ID
+from utils import log_info, log_error
+from s3_storage import load_json_with_etag, save_json_if_match, run_in_s3_executor, ETagMismatch, conditional_put
+
+LEASE_FOLDER = "leases"
+
+def default_instance_id():
+    return INSTANCE_ID or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:4]}"
+
+class S3Lease:
+    """S3 租约对象：{holder, expires, term}，用 ETag 条件写入抢占或续约，过期后其他副本可接管。
+    term 每次换主递增，可作为隔离令牌；依赖各副本时钟大致同步"""
+
+    def __init__(self, name="summarizer", holder=None, ttl=LEADER_LEASE_SECONDS):
+        self.filename = f"{name}.json"
+        self.holder = holder or default_instance_id()
+        self.ttl = ttl
+        self.term = 0
+
+    def try_acquire(self):
+        """抢占或续约租约，返回当前是否持有"""
+        lease, etag = load_json_with_etag(LEASE_FOLDER, self.filename)
+        now = time.time()
+        if lease and lease.get("holder") != self.holder and lease.get("expires", 0) > now:
+            return False
+        term = lease.get("term", 0) if lease and lease.get("holder") == self.holder else (lease or {}).get("term", 0) + 1
+        document = {"holder": self.holder, "expires": now + self.ttl, "term": term}
+        try:
+            save_json_if_match(document, LEASE_FOLDER, self.filename, etag)
+        except ETagMismatch:
+            return False
+        if not conditional_put():
+            # 不支持条件写入时两个副本可能同时写入，回读确认最后写入的是自己
+            lease, _ = load_json_with_etag(LEASE_FOLDER, self.filename)
+            if not lease or lease.get("holder") != self.holder:
+                return False
+        self.term = term
+        return True
+
+    def release(self):
+        lease, etag = load_json_with_etag(LEASE_FOLDER, self.filename)
+        if lease and lease.get("holder") == self.holder:
+            try:
+                save_json_if_match(dict(lease, expires=0), LEASE_FOLDER, self.filename, etag)
+            except ETagMismatch:
+                pass
+
+class FileLease:
+    """本机文件锁（fcntl.flock），用于单机多进程测试；进程退出时锁自动释放。
+    锁文件内容为 {holder, term}，term 在每次抢到锁时基于文件中的值递增，与 S3 租约一样可作为跨进程的隔离令牌"""
+
+    def __init__(self, path=LEADER_LOCK_FILE, holder=None):
+        self.path = path
+        self.holder = holder or default_instance_id()
+        self.term = 0
+        self._file = None
+
+    def try_acquire(self):
+        if self._file is not None:
+            return True
+        handle = open(self.path, "a+")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        handle.seek(0)
+        try:
+            term = json.loads(handle.read() or "{}").get("term", 0)
+        except (ValueError, AttributeError):
+            term = 0  # 旧版锁文件只有 holder 文本
+        handle.seek(0)
+        handle.truncate()
+        handle.write(json.dumps({"holder": self.holder, "term": term + 1}))
+        handle.flush()
+        os.fsync(handle.fileno())
+        self._file = handle
+        self.term = term + 1
+        return True
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+class LeaderElector:
+    """后台定期抢占/续约租约，维护 is_leader；续约失败立即降级，租约到期前未续约也视为失去主节点身份"""
+
+    def __init__(self, lease, ttl=LEADER_LEASE_SECONDS):
+        self.lease = lease
+        self.ttl = ttl
+        self.interval = ttl / 3
+        self.valid_until = 0.0
+        self._task = None
+
+    @property
+    def is_leader(self):
+        return time.monotonic() < self.valid_until
+
+    @property
+    def holder(self):
+        return self.lease.holder
+
+    async def step(self):
+        was_leader = self.is_leader
+        started = time.monotonic()
+        try:
+            acquired = await run_in_s3_executor(self.lease.try_acquire)
+        except Exception as e:
+            log_error(f"租约续约失败: {str(e)}")
+            acquired = False
+        # 以发起请求的时间计算有效期，留出请求耗时的余量
+        self.valid_until = started + self.ttl if acquired else 0.0
+        if acquired and not was_leader:
+            log_info(f"当选总结主节点: {self.holder} (term {self.lease.term})")
+        elif was_leader and not acquired:
+            log_info(f"失去总结主节点身份: {self.holder}")
+        return acquired
+
+    async def _run(self):
+        while True:
+            await self.step()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.is_leader:
+            self.valid_until = 0.0
+            await run_in_s3_executor(self.lease.release)
+
+def create_elector(mode=LEADER_ELECTION):
+    """按配置创建选主器；none 表示单进程部署，始终执行总结"""
+    if mode == "s3":
+        return LeaderElector(S3Lease())
+    if mode == "file":
+        return LeaderElector(FileLease())
+    return None
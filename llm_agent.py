@@ -1,68 +1,194 @@
 import json
+import asyncio
 import numpy as np
-from openai import OpenAI
-from config import LLM_API_KEY, LLM_BASE_URL, SYSTEM_PROMPT, MODEL_ID, EMBEDDING_API_KEY, EMBEDDING_BASE_URL, EMBEDDING_MODEL_ID
-from utils import log_info, log_error, format_summary
-from s3_storage import list_s3_files, load_from_s3
+from config import LLM_API_KEY, LLM_BASE_URL, SYSTEM_PROMPT, LLM_CHUNK_TOKEN_BUDGET, MODEL_ID, EMBEDDING_API_KEY, EMBEDDING_BASE_URL, EMBEDDING_MODEL_ID, EMBEDDING_BATCH_SIZE, DEDUP_SIMILARITY_THRESHOLD
+from utils import log_info, log_error
+from embedding_index import get_embedding_index
+from s3_storage import run_in_s3_executor
+from dedup import is_near_duplicate_text
+from embedding_cache import embedding_cache, cache_key
+from metrics import metrics
 
-# 创建独立的 LLM 和 Embedding 客户端
-llm_client = OpenAI(api_key=LLM_API_KEY, base_url=LLM_BASE_URL)
-embedding_client = OpenAI(api_key=EMBEDDING_API_KEY, base_url=EMBEDDING_BASE_URL)
+# 独立的 LLM 和 Embedding 客户端，首次调用时才导入 openai 并创建，导入本模块不付出这部分启动开销
+_clients = {}
 
-def get_embedding(text):
-    """调用火山引擎 Embedding API"""
-    try:
-        response = embedding_client.embeddings.create(
+def get_client(kind):
+    client = _clients.get(kind)
+    if client is None:
+        from openai import AsyncOpenAI
+        if kind == "llm":
+            client = AsyncOpenAI(api_key=LLM_API_KEY, base_url=LLM_BASE_URL)
+        else:
+            client = AsyncOpenAI(api_key=EMBEDDING_API_KEY, base_url=EMBEDDING_BASE_URL)
+        _clients[kind] = client
+    return client
+
+async def request_embeddings(texts):
+    metrics.inc("embedding_inputs_total", len(texts))
+    async with metrics.timer("embedding_request"):
+        response = await get_client("embedding").embeddings.create(
             model=EMBEDDING_MODEL_ID,
-            input=[text],
+            input=texts,
             encoding_format="float"
         )
-        embedding = response.data[0].embedding
-        log_info(f"成功生成 Embedding: {text[:20]}...")
-        return embedding
+    if getattr(response, "usage", None):
+        metrics.inc("embedding_tokens_total", response.usage.total_tokens or 0)
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+async def embed_batch(texts, throttle=None):
+    """调用火山引擎 Embedding API，一次请求携带多条文本；传入 throttle 时按限额节流、限流时退避重试，最终失败抛出异常"""
+    if throttle is not None:
+        return await throttle.call(lambda: request_embeddings(texts), sum(map(estimate_tokens, texts)))
+    try:
+        embeddings = await request_embeddings(texts)
+        log_info(f"成功生成 Embedding: {len(texts)} 条")
+        return embeddings
     except Exception as e:
         log_error(f"Embedding 生成失败: {str(e)}")
-        return None
+        return [None] * len(texts)
+
+async def get_embeddings(texts, batch_size=EMBEDDING_BATCH_SIZE, throttle=None):
+    """批量生成 Embedding，先查缓存，未命中的去重后按 batch_size 打包并发请求；结果与输入一一对应，失败项为 None"""
+    if not texts:
+        return []
+    keys = [cache_key(text, EMBEDDING_MODEL_ID) for text in texts]
+    found = {}
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key in found or key in missing:
+            continue
+        vector = embedding_cache.get(key)
+        if vector is not None:
+            found[key] = vector
+        else:
+            missing[key] = text
+    if missing:
+        missing_keys = list(missing)
+        batches = [missing_keys[i:i + batch_size] for i in range(0, len(missing_keys), batch_size)]
+        results = await asyncio.gather(*(embed_batch([missing[key] for key in batch], throttle) for batch in batches))
+        fetched = [(key, embedding) for batch, result in zip(batches, results) for key, embedding in zip(batch, result) if embedding is not None]
+        embedding_cache.put_many(fetched)
+        found.update((key, np.asarray(embedding, dtype=np.float32)) for key, embedding in fetched)
+    return [found.get(key) for key in keys]
+
+async def get_embedding(text):
+    return (await get_embeddings([text]))[0]
 
 def cosine_similarity(vec1, vec2):
     """计算余弦相似度"""
     return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
 
-def call_llm(messages):
-    """调用火山引擎 LLM"""
-    try:
-        prompt = f"消息列表：\n{messages}"
-        completion = llm_client.chat.completions.create(
+async def request_completion(prompt, system_prompt):
+    async with metrics.timer("llm_request"):
+        completion = await get_client("llm").chat.completions.create(
             model=MODEL_ID,
             messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "system", "content": system_prompt},
                 {"role": "user", "content": prompt}
             ]
         )
-        result = completion.choices[0].message.content
-        log_info("LLM 分析完成")
-        return json.loads(result)  # 假设返回 JSON
-    except Exception as e:
-        log_error(f"LLM 调用失败: {str(e)}")
-        return []
+    if completion.usage:
+        metrics.inc("llm_tokens_total", completion.usage.prompt_tokens or 0, kind="prompt")
+        metrics.inc("llm_tokens_total", completion.usage.completion_tokens or 0, kind="completion")
+    return completion.choices[0].message.content
+
+async def call_llm(messages, system_prompt=SYSTEM_PROMPT, throttle=None):
+    """调用火山引擎 LLM，返回总结列表；超时、服务端错误或返回的不是 JSON 列表时抛出异常，
+    由调用方决定重试还是跳过，不会与"没有情报"（空列表）混淆。传入 throttle 时（批量回填）按限额节流、限流时退避重试"""
+    prompt = f"消息列表：\n{messages}"
+    if throttle is not None:
+        result = await throttle.call(lambda: request_completion(prompt, system_prompt), estimate_tokens(system_prompt) + estimate_tokens(prompt))
+    else:
+        try:
+            result = await request_completion(prompt, system_prompt)
+        except Exception as e:
+            log_error(f"LLM 调用失败: {str(e)}")
+            raise
+    summaries = json.loads(result)
+    if not isinstance(summaries, list):
+        raise ValueError(f"LLM 返回的不是 JSON 列表: {result[:100]}")
+    log_info("LLM 分析完成")
+    return summaries
+
+def estimate_tokens(text):
+    """粗略估算 token 数：中日韩字符按 1 个计，其余按 4 个字符 1 个计"""
+    cjk = sum(1 for ch in text if "\u2e80" <= ch <= "\u9fff" or "\uac00" <= ch <= "\ud7af")
+    return cjk + (len(text) - cjk) // 4 + 1
+
+def format_message(message):
+    line = f"{message.get('source', '')} {message['content']} {message.get('attachment_link', '')} {message.get('original_link', '')}"
+    if message.get("cluster_size", 1) > 1:
+        # 聚类后的代表消息：附上同一事件的消息数、来源和其他链接
+        line += f" [同一事件共 {message['cluster_size']} 条消息, 来源: {', '.join(message.get('cluster_sources', []))}; 链接: {' '.join(message.get('cluster_links', []))}]"
+    return line
+
+class Chunk(list):
+    """一块格式化后的消息行；sources 收集块内消息的 mempool_keys（列表引用），块总结失败时据此找出需要重试的 mempool 对象"""
+
+    def __init__(self, lines=(), sources=()):
+        super().__init__(lines)
+        self.sources = list(sources)
+
+    def source_keys(self):
+        return {key for keys in self.sources for key in keys}
+
+class ChunkBuilder:
+    """增量分块：逐条加入消息，超出 token 预算时吐出已满的一块，单条超出预算的消息独占一块"""
+
+    def __init__(self, token_budget=LLM_CHUNK_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self.current = Chunk()
+        self.current_tokens = 0
+
+    def add(self, message):
+        line = format_message(message)
+        tokens = estimate_tokens(line)
+        full = None
+        if self.current and self.current_tokens + tokens > self.token_budget:
+            full = self.finish()
+        self.current.append(line)
+        if message.get("mempool_keys") is not None:
+            self.current.sources.append(message["mempool_keys"])
+        self.current_tokens += tokens
+        return full
+
+    def finish(self):
+        chunk, self.current, self.current_tokens = self.current, Chunk(), 0
+        return chunk or None
+
+CATEGORY_RANK = {"Breaking": 0, "Just in": 1, "Curated": 2}
+IMPORTANCE_RANK = {"高": 0, "中": 1, "低": 2}
+
+def rank_summaries(summaries):
+    """按类别和重要性排序（稳定排序，同级保持原有顺序）"""
+    return sorted(summaries, key=lambda s: (
+        CATEGORY_RANK.get(s.get("category"), len(CATEGORY_RANK)),
+        IMPORTANCE_RANK.get(s.get("importance"), len(IMPORTANCE_RANK))
+    ))
 
-def analyze_messages(messages, last_position):
-    """分析消息并生成总结"""
-    message_text = "\n".join([f"{m['source']} {m['content']} {m['attachment_link']} {m['original_link']}" for m in messages])
-    summaries = call_llm(message_text)
-    
-    # RAG 去重
-    embeddings = list_s3_files("embeddings")
-    formatted_summaries = []
-    for summary in summaries:
-        content = summary["content"]
-        embedding = get_embedding(content)
-        is_duplicate = False
-        for _, embedding_key in embeddings:
-            past_data = load_from_s3("embeddings", embedding_key.split("/")[-1])
-            if past_data and cosine_similarity(embedding, past_data["embedding"]) > 0.9:
-                is_duplicate = True
-                break
-        if not is_duplicate:
-            formatted_summaries.append(format_summary(summary["category"], content, summary.get("importance")))
-    return formatted_summaries
\ No newline at end of file
+async def filter_duplicates(summaries, cycle_index=None, cycle_accepted=()):
+    """RAG 去重：一批总结一次批量 Embedding，与历史索引做一次矩阵乘法；
+    传入 cycle_index 时还会与本周期已接受的总结比较，并把新接受的加入其中。
+    Embedding 失败的总结退回文本比较（规范化精确匹配 + MinHash），与 cycle_accepted 和本批已接受的总结去重。
+    返回非重复的总结（原始字典，由调用方排序后格式化）"""
+    index = await run_in_s3_executor(get_embedding_index)  # 首次调用时从 S3 加载，不阻塞事件循环
+    embeddings = await get_embeddings([summary["content"] for summary in summaries])
+    valid = [i for i, embedding in enumerate(embeddings) if embedding is not None]
+    scores = dict(zip(valid, index.max_similarity([embeddings[i] for i in valid])))
+    accepted = []
+    for i, summary in enumerate(summaries):
+        score = scores.get(i)
+        if score is None:
+            seen = [other["content"] for other in list(cycle_accepted) + accepted]
+            if is_near_duplicate_text(summary["content"], seen):
+                log_info(f"总结与本周期已接受的内容重复 (Embedding 不可用，文本比较): {summary['content'][:20]}...")
+                continue
+        if score is not None and cycle_index is not None and len(cycle_index):
+            score = max(score, cycle_index.max_similarity([embeddings[i]])[0])
+        if score is not None and score > DEDUP_SIMILARITY_THRESHOLD:
+            log_info(f"总结与已发布内容重复 (相似度 {score:.3f}): {summary['content'][:20]}...")
+            continue
+        if score is not None and cycle_index is not None:
+            cycle_index.add(embeddings[i], "", summary["content"])
+        accepted.append(summary)
+    return accepted
@@ -0,0 +1,190 @@
+import os
+import time
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import METRICS_PORT, METRICS_DUMP_PATH
+from utils import log_info, log_error
+
+# 延迟直方图的桶上界（秒），覆盖本地存储的亚毫秒级到消息入库至发布的小时级
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400, 43200, 86400)
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Registry:
+    """进程内指标注册表：计数器与直方图，按 (名称, 标签) 区分；线程安全（S3 调用在线程池中执行）"""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def timer(self, name, **labels):
+        return Timer(self, name, labels)
+
+    def total(self, name):
+        """同名计数器在所有标签上的合计"""
+        with self._lock:
+            return sum(value for (series, _), value in self.counters.items() if series == name)
+
+    def snapshot(self):
+        """返回 {指标名{标签}: 值} 的简要视图，直方图给出次数、总和与平均值"""
+        with self._lock:
+            view = {format_series(name, labels): value for (name, labels), value in self.counters.items()}
+            for (name, labels), histogram in self.histograms.items():
+                view[format_series(name, labels)] = {
+                    "count": histogram.count,
+                    "sum": round(histogram.sum, 6),
+                    "avg": round(histogram.sum / histogram.count, 6) if histogram.count else 0.0
+                }
+        return view
+
+    def render(self):
+        """Prometheus 文本格式"""
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (series, labels), value in sorted(self.counters.items()):
+                    if series == name:
+                        lines.append(f"{format_series(name, labels)} {value}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (series, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if series != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                        cumulative += count
+                        lines.append(f"{format_series(name + '_bucket', labels + (('le', str(bound)),))} {cumulative}")
+                    lines.append(f"{format_series(name + '_sum', labels)} {histogram.sum}")
+                    lines.append(f"{format_series(name + '_count', labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_series(name, labels):
+    if not labels:
+        return name
+    escaped = ",".join(f'{key}="{escape_label(value)}"' for key, value in labels)
+    return f"{name}{{{escaped}}}"
+
+class Timer:
+    """计时上下文（同步/异步均可），退出时把耗时记入直方图；出现异常时额外计入 <名称>_errors_total"""
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.started = None
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.started
+        self.registry.observe(f"{self.name}_seconds", self.elapsed, **self.labels)
+        if exc_type is not None:
+            self.registry.inc(f"{self.name}_errors_total", **self.labels)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+class Trace:
+    """一次流程（总结周期、启动）的分段计时：每个 span 记入 <metric>_stage_seconds{stage=...}，结束时输出一行汇总日志"""
+
+    def __init__(self, registry, name, metric="cycle", started=None):
+        self.registry = registry
+        self.name = name
+        self.metric = metric
+        self.started = time.perf_counter() if started is None else started
+        self.spans = []
+
+    def span(self, stage):
+        timer = self.registry.timer(f"{self.metric}_stage", stage=stage)
+        self.spans.append((stage, timer))
+        return timer
+
+    def record(self, stage, seconds):
+        """记录一段在 span 之外测得的耗时（如模块导入）"""
+        timer = Timer(self.registry, f"{self.metric}_stage", {"stage": stage})
+        timer.elapsed = seconds
+        self.registry.observe(f"{self.metric}_stage_seconds", seconds, stage=stage)
+        self.spans.append((stage, timer))
+
+    def finish(self):
+        total = time.perf_counter() - self.started
+        self.registry.observe(f"{self.metric}_seconds", total, **{self.metric: self.name})
+        detail = ", ".join(f"{stage} {timer.elapsed:.3f}s" for stage, timer in self.spans)
+        log_info(f"{self.name} 耗时 {total:.3f}s ({detail})")
+        return total
+
+metrics = Registry()
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # 抓取请求不写日志
+
+def dump_metrics(path=METRICS_DUMP_PATH):
+    """把当前指标以 Prometheus 文本格式写入文件（先写临时文件再改名），供 node_exporter textfile 等采集"""
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        f.write(metrics.render())
+    os.replace(f"{path}.tmp", path)
+
+def start_metrics_server(port=METRICS_PORT):
+    """在后台线程提供 Prometheus 抓取端点 /metrics；port 为 0 时不启动"""
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    except OSError as e:
+        log_error(f"指标端点启动失败: {str(e)}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    log_info(f"指标端点已启动: http://0.0.0.0:{port}/metrics")
+    return server
@@ -0,0 +1,102 @@
+import time
+import asyncio
+from config import PIPELINE_QUEUE_SIZE
+from utils import log_info, log_error
+from metrics import metrics
+
+class Stage:
+    """流水线阶段：workers 个协程从有界输入队列取任务，处理结果写入下游队列（下游满时阻塞，形成背压）"""
+
+    def __init__(self, name, handler, workers=1, queue_size=PIPELINE_QUEUE_SIZE):
+        self.name = name
+        self.handler = handler  # async (item) -> 可迭代的输出，返回 None 表示无输出
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.downstream = None
+        self.processed = 0
+        self.emitted = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.started_at = None
+        self._tasks = []
+
+    async def put(self, item):
+        await self.queue.put(item)
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _worker(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                with metrics.timer("pipeline_stage", stage=self.name):
+                    outputs = await self.handler(item)
+                self.processed += 1
+                for output in outputs or ():
+                    self.emitted += 1
+                    if self.downstream is not None:
+                        await self.downstream.put(output)
+            except Exception as e:
+                self.failed += 1
+                log_error(f"流水线阶段 {self.name} 处理失败: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    async def drain(self):
+        """等待队列中已有任务全部处理完并停止 worker"""
+        await self.queue.join()
+        await self.stop()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "queue_depth": self.queue.qsize(),
+            "max_queue_depth": self.max_depth,
+            "processed": self.processed,
+            "emitted": self.emitted,
+            "failed": self.failed,
+            "throughput": self.processed / elapsed if elapsed > 0 else 0.0
+        }
+
+class Pipeline:
+    """由有界队列串联的若干阶段，各阶段并发运行，互相重叠"""
+
+    def __init__(self, stages):
+        self.stages = stages
+        for upstream, downstream in zip(stages, stages[1:]):
+            upstream.downstream = downstream
+
+    async def run(self, source):
+        """把异步可迭代的 source 逐项送入第一阶段，然后按顺序排空各阶段"""
+        for stage in self.stages:
+            stage.start()
+        try:
+            async for item in source:
+                await self.stages[0].put(item)
+            for stage in self.stages:
+                await stage.drain()
+        finally:
+            for stage in self.stages:
+                await stage.stop()
+        return self.stats()
+
+    def stats(self):
+        return [stage.stats() for stage in self.stages]
+
+    def log_stats(self):
+        for s in self.stats():
+            log_info(
+                f"流水线阶段 {s['stage']}: 处理 {s['processed']}, 输出 {s['emitted']}, 失败 {s['failed']}, "
+                f"队列 {s['queue_depth']} (峰值 {s['max_queue_depth']}), 吞吐 {s['throughput']:.2f}/s"
+            )
@@ -0,0 +1,24 @@
+import re
+from config import PRIORITY_SCORE_THRESHOLD
+
+# 关键词权重：明确的突发标记权重最高，事件类词汇次之
+PRIORITY_KEYWORDS = {
+    "breaking": 3, "🚨": 3, "突发": 3, "重大": 2, "紧急": 2, "just in": 2, "快讯": 1,
+    "hack": 2, "hacked": 2, "exploit": 2, "drained": 2, "黑客": 2, "被盗": 2, "攻击": 1, "漏洞": 1,
+    "delist": 2, "下架": 2, "listing": 1, "上线": 1, "上币": 1,
+    "sec": 1, "etf": 1, "approved": 1, "approves": 1, "批准": 1, "通过": 1, "lawsuit": 1, "起诉": 1, "arrested": 2, "逮捕": 2,
+    "liquidated": 1, "liquidation": 1, "爆仓": 1, "depeg": 2, "脱锚": 2, "halt": 2, "暂停": 1, "bankrupt": 2, "破产": 2
+}
+# 英文关键词按整词匹配，避免 "sec" 命中 "second" 之类
+KEYWORD_PATTERN = re.compile("|".join(
+    rf"\b{re.escape(keyword)}\b" if keyword.isascii() and keyword.replace(" ", "").isalpha() else re.escape(keyword)
+    for keyword in sorted(PRIORITY_KEYWORDS, key=len, reverse=True)
+))
+
+def priority_score(message):
+    """本地关键词打分，估计消息属于 Breaking 的可能性，不调用 LLM"""
+    text = message.get("content", "").lower()
+    return sum(PRIORITY_KEYWORDS[match] for match in set(KEYWORD_PATTERN.findall(text)))
+
+def is_priority(message, threshold=PRIORITY_SCORE_THRESHOLD):
+    return priority_score(message) >= threshold
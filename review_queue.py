@@ -0,0 +1,80 @@
+import time
+import secrets
+from datetime import datetime, timedelta
+from collections import OrderedDict
+from config import REVIEW_CACHE_SIZE, REVIEW_TTL_HOURS, TIMEZONE
+from utils import log_info
+from s3_storage import async_save_to_s3, async_load_from_s3, async_list_s3_files, async_delete_keys_from_s3, load_many, save_many
+
+REVIEW_FOLDER = "review_queue"
+BATCH_TIME_FORMAT = "%y%m%d%H%M"
+
+class ReviewQueue:
+    """待审核总结队列：短 ID、内存 LRU + S3 持久化（重启不丢）、按 TTL 过期，支持按批次整体通过/驳回。
+    每条记录存放在 review_queue/<批次>/<ID>.json，批次以创建时间开头，便于按时间清理"""
+
+    def __init__(self, capacity=REVIEW_CACHE_SIZE, ttl_hours=REVIEW_TTL_HOURS):
+        self.capacity = capacity
+        self.ttl_seconds = ttl_hours * 3600
+        self.cache = OrderedDict()  # (批次, ID) -> 记录
+
+    def new_batch(self):
+        """每个总结周期一个批次号：创建时间 + 随机后缀，不含下划线以便放进 callback_data"""
+        return f"{TIMEZONE.localize(datetime.now()).strftime(BATCH_TIME_FORMAT)}{secrets.token_hex(2)}"
+
+    def _remember(self, item):
+        key = (item["batch"], item["id"])
+        self.cache[key] = item
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.capacity:
+            self.cache.popitem(last=False)
+
+    def _expired(self, item):
+        return time.time() - item.get("created", 0) > self.ttl_seconds
+
+    async def add(self, summary, batch, review_id=None):
+        """review_id 为空时随机生成；传入确定的 ID 时重复添加只会覆盖同一条记录"""
+        item = {"id": review_id or secrets.token_hex(3), "batch": batch, "summary": summary, "created": time.time()}
+        await async_save_to_s3(item, f"{REVIEW_FOLDER}/{batch}", f"{item['id']}.json")
+        self._remember(item)
+        return item
+
+    async def pop(self, batch, review_id):
+        """取出并删除一条待审核记录；不存在或已过期时返回 None"""
+        item = self.cache.pop((batch, review_id), None)
+        if item is None:
+            item = await async_load_from_s3(f"{REVIEW_FOLDER}/{batch}", f"{review_id}.json")
+            if item is None:
+                return None
+        await async_delete_keys_from_s3([f"{REVIEW_FOLDER}/{batch}/{review_id}.json"])
+        return None if self._expired(item) else item
+
+    async def pop_batch(self, batch):
+        """取出并删除整个批次中仍待审核的记录（一次 LIST + 并发 GET），按创建顺序返回"""
+        files = await async_list_s3_files(f"{REVIEW_FOLDER}/{batch}")
+        keys = [key for _, key in files]
+        items = [self.cache.pop((batch, key.split("/")[-1][:-len(".json")]), None) for key in keys]
+        missing = [i for i, item in enumerate(items) if item is None]
+        loaded = await load_many(f"{REVIEW_FOLDER}/{batch}", [keys[i].split("/")[-1] for i in missing])
+        for i, item in zip(missing, loaded):
+            items[i] = item
+        await async_delete_keys_from_s3(keys)
+        return sorted((item for item in items if item and not self._expired(item)), key=lambda item: item["created"])
+
+    async def restore(self, items):
+        """把已取出但发布失败的记录放回队列，保留原创建时间（仍按原 TTL 过期）"""
+        await save_many([(item, f"{REVIEW_FOLDER}/{item['batch']}", f"{item['id']}.json") for item in items])
+        for item in items:
+            self._remember(item)
+
+    async def purge_expired(self):
+        """删除创建时间早于 TTL 的批次，返回删除的记录数"""
+        cutoff = (TIMEZONE.localize(datetime.now()) - timedelta(seconds=self.ttl_seconds)).strftime(BATCH_TIME_FORMAT)
+        files = await async_list_s3_files(REVIEW_FOLDER)
+        expired = [key for _, key in files if key.split("/")[1][:len(cutoff)] < cutoff]
+        for batch, review_id in [key for key in self.cache if key[0][:len(cutoff)] < cutoff]:
+            del self.cache[(batch, review_id)]
+        if expired:
+            await async_delete_keys_from_s3(expired)
+            log_info(f"清理过期待审核记录: {len(expired)} 条")
+        return len(expired)
@@ -1,14 +1,28 @@
-import boto3
 import json
-from config import S3_BUCKET
-from utils import log_info, log_error, get_timestamp
+import gzip
+import uuid
+import asyncio
+import functools
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from config import S3_MAX_CONCURRENCY, S3_FETCH_RETRIES, S3_RETRY_BASE_DELAY, MEMPOOL_FLUSH_SIZE, MEMPOOL_FLUSH_SECONDS, MEMPOOL_GZIP, MEMPOOL_READ_SEGMENTS
+from utils import log_info, log_error, get_timestamp, strip_summary_header
+from storage_backend import create_backend, LazyBackend, ETagMismatch, ObjectNotFound
 
-s3_client = boto3.client("s3")  # 移除 aws_access_key_id 和 aws_secret_access_key
+# 所有持久化都经过存储后端：S3（默认）、本地 SQLite 或本地缓存 + S3 的分层模式；首次读写时才创建
+backend = LazyBackend(create_backend)
+# 后端接口是阻塞的，异步接口统一投递到有界线程池，避免卡住事件循环
+s3_executor = ThreadPoolExecutor(max_workers=S3_MAX_CONCURRENCY, thread_name_prefix="s3")
+
+def conditional_put():
+    """条件写入是否由存储端原子保证；否则退化为写前比对 ETag，调用方需回读确认"""
+    return backend.conditional_put
 
 def save_to_s3(data, folder, filename):
     try:
         key = f"{folder}/{filename}"
-        s3_client.put_object(Bucket=S3_BUCKET, Key=key, Body=json.dumps(data, ensure_ascii=False))
+        backend.put(key, json.dumps(data, ensure_ascii=False).encode("utf-8"))
         log_info(f"成功保存到 S3: {key}")
     except Exception as e:
         log_error(f"S3 保存失败: {key}, 错误: {str(e)}")
@@ -17,38 +31,308 @@ def save_to_s3(data, folder, filename):
 def load_from_s3(folder, filename):
     try:
         key = f"{folder}/{filename}"
-        response = s3_client.get_object(Bucket=S3_BUCKET, Key=key)
-        return json.loads(response["Body"].read().decode("utf-8"))
+        body, _ = backend.get(key)
+        return json.loads(body.decode("utf-8"))
     except Exception as e:
         log_error(f"S3 加载失败: {key}, 错误: {str(e)}")
         return None
 
-def list_s3_files(folder, start_time=None):
+def save_bytes_to_s3(data, folder, filename):
     try:
-        response = s3_client.list_objects_v2(Bucket=S3_BUCKET, Prefix=folder)
+        key = f"{folder}/{filename}"
+        backend.put(key, data)
+        log_info(f"成功保存到 S3: {key} ({len(data)} 字节)")
+    except Exception as e:
+        log_error(f"S3 保存失败: {key}, 错误: {str(e)}")
+        raise
+
+def load_bytes_from_s3(folder, filename):
+    try:
+        key = f"{folder}/{filename}"
+        return backend.get(key)[0]
+    except Exception as e:
+        log_error(f"S3 加载失败: {key}, 错误: {str(e)}")
+        return None
+
+def delete_keys_from_s3(keys):
+    """批量删除对象，返回删除数量"""
+    return backend.delete(keys) if keys else 0
+
+def filename_timestamp(filename):
+    """文件名以 YYYY-MM-DD_HH:MM:SS 开头（单条消息或分段），取出其时间戳"""
+    return filename[:19].replace("_", " ")
+
+def partition_path(timestamp):
+    """按小时分区的相对路径 YYYY/MM/DD/HH"""
+    return f"{timestamp[0:4]}/{timestamp[5:7]}/{timestamp[8:10]}/{timestamp[11:13]}"
+
+def load_json_with_etag(folder, filename):
+    """读取 JSON 对象及其 ETag；对象不存在时返回 (None, None)"""
+    key = f"{folder}/{filename}"
+    try:
+        body, etag = backend.get(key)
+        return json.loads(body.decode("utf-8")), etag
+    except ObjectNotFound:
+        return None, None
+    except Exception as e:
+        log_error(f"S3 加载失败: {key}, 错误: {str(e)}")
+        raise
+
+def save_json_if_match(data, folder, filename, etag):
+    """仅当对象 ETag 仍为 etag（None 表示对象不存在）时写入，返回新 ETag，否则抛出 ETagMismatch"""
+    key = f"{folder}/{filename}"
+    etag = backend.put(key, json.dumps(data, ensure_ascii=False).encode("utf-8"), if_match=etag)
+    log_info(f"成功保存到 S3: {key}")
+    return etag
+
+def list_s3_files(folder, start_time=None, partitioned=False):
+    """按键顺序列出目录下的对象；给定 start_time 时从存储端跳过更早的键（S3 StartAfter / SQLite 主键范围查询）"""
+    try:
+        start_after = None
+        if start_time:
+            # 键按时间字典序排列：分区布局跳到 start_time 所在小时分区，扁平布局跳到对应文件名
+            if partitioned:
+                start_after = f"{folder}/{partition_path(start_time)}/"
+            else:
+                start_after = f"{folder}/{start_time.replace(' ', '_')}"
         files = []
-        for obj in response.get("Contents", []):
-            filename = obj["Key"].split("/")[-1]
-            timestamp = filename.replace(".json", "").replace("_", " ")
+        for key in backend.list(f"{folder}/", start_after):
+            timestamp = filename_timestamp(key.split("/")[-1])
             if start_time and timestamp <= start_time:
                 continue
-            files.append((timestamp, obj["Key"]))
+            files.append((timestamp, key))
         files.sort()
         return files
     except Exception as e:
         log_error(f"S3 列出文件失败: {folder}, 错误: {str(e)}")
         return []
 
-def append_to_mempool(message):
-    timestamp = message.get("timestamp", get_timestamp())
-    filename = f"{timestamp.replace(' ', '_')}.json"
-    save_to_s3(message, "intel_mempool", filename)
-    log_info(f"已追加到 mempool: {filename}")
+COLUMNAR_SUFFIX = ".cols.json.gz"
+
+def encode_columns(messages):
+    """按列编码一批消息（每个字段一个数组，缺失字段为 null）并 gzip 压缩；同列取值相近，压缩率明显高于逐行 JSON"""
+    fields = sorted({field for message in messages for field in message})
+    columns = {field: [message.get(field) for message in messages] for field in fields}
+    return gzip.compress(json.dumps({"rows": len(messages), "columns": columns}, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+def decode_columns(data):
+    table = json.loads(gzip.decompress(data).decode("utf-8"))
+    columns = table["columns"]
+    return [
+        {field: values[i] for field, values in columns.items() if values[i] is not None}
+        for i in range(table["rows"])
+    ]
+
+def parse_mempool_object(filename, data):
+    """解析 mempool 对象：压缩归档的列式分段、JSONL 分段（可 gzip）或单条 JSON 消息，统一返回消息列表"""
+    if filename.endswith(COLUMNAR_SUFFIX):
+        return decode_columns(data)
+    if filename.endswith(".gz"):
+        data = gzip.decompress(data)
+    text = data.decode("utf-8")
+    if ".jsonl" in filename:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    return [json.loads(text)]
+
+def fetch_mempool_object(key):
+    """读取单个 mempool 对象，失败时直接抛出异常以便调用方重试"""
+    return parse_mempool_object(key, backend.get(key)[0])
+
+async def run_in_s3_executor(func, *args, **kwargs):
+    """在 S3 线程池中执行阻塞调用"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(s3_executor, functools.partial(func, *args, **kwargs))
 
-def save_published_message(message):
+async def async_save_to_s3(data, folder, filename):
+    return await run_in_s3_executor(save_to_s3, data, folder, filename)
+
+async def async_load_from_s3(folder, filename):
+    return await run_in_s3_executor(load_from_s3, folder, filename)
+
+async def async_save_bytes_to_s3(data, folder, filename):
+    return await run_in_s3_executor(save_bytes_to_s3, data, folder, filename)
+
+async def async_load_bytes_from_s3(folder, filename):
+    return await run_in_s3_executor(load_bytes_from_s3, folder, filename)
+
+async def async_list_s3_files(folder, start_time=None, partitioned=False):
+    return await run_in_s3_executor(list_s3_files, folder, start_time, partitioned)
+
+async def async_delete_keys_from_s3(keys):
+    return await run_in_s3_executor(delete_keys_from_s3, keys)
+
+async def save_published_messages(messages):
+    """保存一批已发布消息：并发写入记录，一次请求生成全部 Embedding，向量写成一个增量对象，完整快照防抖合并保存"""
+    if not messages:
+        return
+    from llm_agent import get_embeddings
+    from embedding_index import get_embedding_index
     timestamp = get_timestamp()
-    filename = f"{timestamp.replace(' ', '_')}.json"
-    save_to_s3(message, "intel_publish", filename)
-    from llm_agent import get_embedding
-    embedding = get_embedding(message["content"])
-    save_to_s3({"timestamp": timestamp, "content": message["content"], "embedding": embedding}, "embeddings", filename)
\ No newline at end of file
+    # 带 id 的消息（周期检查点重放）使用确定的文件名，重复写入只会覆盖同一个对象
+    await save_many([
+        (message, "intel_publish", f"{message.get('timestamp', timestamp).replace(' ', '_')}_{message['id']}.json" if message.get("id")
+         else f"{timestamp.replace(' ', '_')}_{uuid.uuid4().hex[:8]}.json")
+        for message in messages
+    ])
+    # 只对正文做 Embedding，与 filter_duplicates 去重时比较的总结正文一致，可直接命中缓存
+    embeddings = await get_embeddings([strip_summary_header(message["content"]) for message in messages])
+    index = await run_in_s3_executor(get_embedding_index)
+    added = [(message, embedding) for message, embedding in zip(messages, embeddings) if embedding is not None]
+    if added:
+        await run_in_s3_executor(index.add_many, [embedding for _, embedding in added], [timestamp] * len(added),
+                                 [message["content"] for message, _ in added])
+        index.save_later()
+
+async def save_published_message(message):
+    await save_published_messages([message])
+
+def load_many_sync(folder, filenames):
+    bodies = backend.get_many([f"{folder}/{filename}" for filename in filenames])
+    return [json.loads(body.decode("utf-8")) if body is not None else None for body in bodies]
+
+def save_many_sync(items):
+    backend.put_many([(f"{folder}/{filename}", json.dumps(data, ensure_ascii=False).encode("utf-8")) for data, folder, filename in items])
+
+async def load_many(folder, filenames):
+    """加载多个对象，按输入顺序返回，失败项为 None；本地后端一次查询完成，S3 后端并发请求"""
+    if backend.batched:
+        try:
+            return await run_in_s3_executor(load_many_sync, folder, filenames)
+        except Exception as e:
+            log_error(f"批量加载失败: {folder}, 错误: {str(e)}")
+            return [None] * len(filenames)
+    return await asyncio.gather(*(async_load_from_s3(folder, filename) for filename in filenames))
+
+async def save_many(items):
+    """保存 (data, folder, filename) 列表，返回失败数量；本地后端一次事务完成，S3 后端并发请求"""
+    if backend.batched:
+        try:
+            await run_in_s3_executor(save_many_sync, items)
+            return 0
+        except Exception as e:
+            log_error(f"批量保存失败: {len(items)} 个, 错误: {str(e)}")
+            return len(items)
+    results = await asyncio.gather(
+        *(async_save_to_s3(data, folder, filename) for data, folder, filename in items),
+        return_exceptions=True
+    )
+    return sum(1 for result in results if isinstance(result, Exception))
+
+class FetchStats:
+    """批量拉取统计：成功、失败与重试的对象数"""
+
+    def __init__(self):
+        self.fetched = 0
+        self.failed = 0
+        self.retries = 0
+        self.failed_keys = []  # 重试后仍失败的对象（不含已不存在的对象），游标不会越过它们
+
+    def __str__(self):
+        return f"成功 {self.fetched}, 失败 {self.failed}, 重试 {self.retries}"
+
+async def fetch_with_retry(key, stats, retries=S3_FETCH_RETRIES):
+    """带指数退避重试地拉取单个 mempool 对象，最终失败返回空列表"""
+    for attempt in range(retries + 1):
+        try:
+            messages = await run_in_s3_executor(fetch_mempool_object, key)
+            stats.fetched += 1
+            return messages
+        except ObjectNotFound:
+            log_error(f"mempool 对象不存在: {key}")
+            stats.failed += 1
+            return []
+        except Exception as e:
+            error = e
+        if attempt < retries:
+            stats.retries += 1
+            await asyncio.sleep(S3_RETRY_BASE_DELAY * 2 ** attempt)
+        else:
+            log_error(f"mempool 对象拉取失败: {key}, 错误: {str(error)}")
+    stats.failed += 1
+    stats.failed_keys.append(key)
+    return []
+
+async def iter_mempool(files, stats=None, concurrency=S3_MAX_CONCURRENCY, read_segments=MEMPOOL_READ_SEGMENTS):
+    """并发拉取 list_s3_files 的结果，按时间顺序流式产出 (timestamp, key, messages)，最多 concurrency 个对象在途"""
+    stats = stats if stats is not None else FetchStats()
+    if not read_segments:
+        files = [(timestamp, key) for timestamp, key in files if ".jsonl" not in key and not key.endswith(COLUMNAR_SUFFIX)]
+    remaining = iter(files)
+    pending = deque(
+        (timestamp, key, asyncio.ensure_future(fetch_with_retry(key, stats)))
+        for timestamp, key in itertools.islice(remaining, concurrency)
+    )
+    try:
+        while pending:
+            timestamp, key, task = pending.popleft()
+            for next_timestamp, next_key in itertools.islice(remaining, 1):
+                pending.append((next_timestamp, next_key, asyncio.ensure_future(fetch_with_retry(next_key, stats))))
+            yield timestamp, key, await task
+    finally:
+        for _, _, task in pending:
+            task.cancel()
+
+class MempoolBuffer:
+    """mempool 写缓冲：消息先在内存攒批，达到条数或时长上限后写成一个 JSONL 分段对象"""
+
+    def __init__(self, max_messages=MEMPOOL_FLUSH_SIZE, max_age=MEMPOOL_FLUSH_SECONDS, compress=MEMPOOL_GZIP):
+        self.max_messages = max_messages
+        self.max_age = max_age
+        self.compress = compress
+        self.instance_id = uuid.uuid4().hex[:8]  # 区分多个写入进程，保证键不冲突
+        self.sequence = 0
+        self.messages = []
+        self._lock = asyncio.Lock()
+        self._timer = None
+
+    def __len__(self):
+        return len(self.messages)
+
+    async def add(self, message):
+        self.messages.append(message)
+        if len(self.messages) >= self.max_messages:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.max_age)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception:
+            pass  # flush 已记录错误并保留消息，下一次触发时重试
+
+    def segment_filename(self, last_timestamp):
+        self.sequence += 1
+        suffix = ".jsonl.gz" if self.compress else ".jsonl"
+        return f"{partition_path(last_timestamp)}/{last_timestamp.replace(' ', '_')}_{self.instance_id}_{self.sequence:08d}{suffix}"
+
+    async def flush(self):
+        """把当前缓冲写成一个分段；写入失败时消息放回缓冲，不会丢失"""
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self.messages:
+                return None
+            batch, self.messages = self.messages, []
+            last_timestamp = max(m.get("timestamp", "") for m in batch) or get_timestamp()
+            filename = self.segment_filename(last_timestamp)
+            body = "\n".join(json.dumps(m, ensure_ascii=False) for m in batch).encode("utf-8")
+            if self.compress:
+                body = gzip.compress(body)
+            try:
+                await async_save_bytes_to_s3(body, "intel_mempool", filename)
+            except Exception:
+                self.messages = batch + self.messages
+                raise
+            log_info(f"mempool 分段已写入: {filename} ({len(batch)} 条)")
+            return filename
+
+    async def close(self):
+        """关闭时取消定时器并写出剩余消息"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
\ No newline at end of file
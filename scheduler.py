@@ -0,0 +1,144 @@
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from config import (SCHEDULER_MIN_INTERVAL_MINUTES, SCHEDULER_TARGET_BATCH, SCHEDULER_RATE_WINDOW_MINUTES, SCHEDULER_TOKEN_BUDGET,
+                    SCHEDULER_BUDGET_SOFT_LIMIT, SCHEDULER_MAX_STRETCH, TIMEZONE)
+from utils import log_info, log_error
+from metrics import metrics
+
+BUDGET_WINDOW_SECONDS = 3600
+TOKEN_METRICS = ("llm_tokens_total", "embedding_tokens_total")
+
+class SummaryScheduler:
+    """总结调度的唯一入口：任何时刻最多一个待执行的 run_once 任务，每轮结束后按负载重新计算下一次的间隔。
+    - 消息速率高时缩短间隔（每轮约 SCHEDULER_TARGET_BATCH 条），积压达到目标批量时尽快执行，空闲时退回管理员设置的周期
+    - 最近一小时的 LLM + Embedding token 接近 SCHEDULER_TOKEN_BUDGET 时拉长间隔、攒更大的批次，用尽时等到窗口内额度释放
+    并发由 summarize_cycle 的锁保证：执行中到来的触发合并为结束后再跑一轮"""
+
+    def __init__(self, run, base_interval, min_interval=SCHEDULER_MIN_INTERVAL_MINUTES * 60, target_batch=SCHEDULER_TARGET_BATCH,
+                 rate_window=SCHEDULER_RATE_WINDOW_MINUTES * 60, token_budget=SCHEDULER_TOKEN_BUDGET):
+        self.run = run  # 执行一轮总结的协程函数，参数为 context
+        self.base_interval = base_interval  # 返回管理员设置的周期（秒）的函数
+        self.min_interval = min_interval
+        self.target_batch = target_batch
+        self.rate_window = rate_window
+        self.token_budget = token_budget
+        self.arrivals = deque()  # 最近 rate_window 秒内消息到达的时间
+        self.backlog = 0  # 上一轮开始后入库的消息数
+        self.token_samples = deque()  # (时间, 累计 token 数)，用于计算最近一小时的用量
+        self.job = None
+        self.job_queue = None
+        self.next_run = None
+        self.interval = None
+        self.reason = "启动后立即执行"
+        self.last_run = None  # 上一次排定任务开始执行的时间
+
+    def start(self, job_queue):
+        """启动后立即执行第一轮，之后由每轮结束时自行排定"""
+        self.job_queue = job_queue
+        self.tokens_used()  # 记下启动时的累计值作为基线，第一轮的用量才计入窗口
+        self.schedule(job_queue, 0, self.reason)
+
+    def record_message(self):
+        now = time.monotonic()
+        self.arrivals.append(now)
+        self._trim_arrivals(now)
+        self.backlog += 1
+        if self.backlog == self.target_batch and self.job is not None:
+            self.schedule()  # 积压刚达到目标批量，不等原定时间
+
+    def cycle_started(self):
+        self.backlog = 0
+
+    def _trim_arrivals(self, now):
+        while self.arrivals and now - self.arrivals[0] > self.rate_window:
+            self.arrivals.popleft()
+
+    def rate(self):
+        """最近 rate_window 内的消息速率（条/秒）"""
+        now = time.monotonic()
+        self._trim_arrivals(now)
+        return len(self.arrivals) / self.rate_window
+
+    def tokens_used(self):
+        """最近一小时消耗的 LLM + Embedding token 数（按进程内指标计数的差值）"""
+        now = time.monotonic()
+        total = sum(metrics.total(name) for name in TOKEN_METRICS)
+        self.token_samples.append((now, total))
+        while len(self.token_samples) > 1 and now - self.token_samples[1][0] >= BUDGET_WINDOW_SECONDS:
+            self.token_samples.popleft()
+        return total - self.token_samples[0][1]
+
+    def budget_release_seconds(self):
+        """用量降到预算以下还需等待的秒数：最早一个样本滑出一小时窗口的时间"""
+        oldest = self.token_samples[0][0] if self.token_samples else time.monotonic()
+        return max(BUDGET_WINDOW_SECONDS - (time.monotonic() - oldest), self.min_interval)
+
+    def decide(self):
+        """返回 (下一轮延迟秒数, 原因)"""
+        base = max(self.base_interval(), self.min_interval)
+        rate = self.rate()
+        if self.token_budget:
+            pressure = self.tokens_used() / self.token_budget
+            if pressure >= 1:
+                return max(self.budget_release_seconds(), base), f"最近一小时 token 已用尽预算 ({pressure:.0%})，等待额度释放"
+            if pressure >= SCHEDULER_BUDGET_SOFT_LIMIT:
+                # 越接近预算间隔越长，同样的消息合并成更少、更大的批次
+                stretch = 1 + (pressure - SCHEDULER_BUDGET_SOFT_LIMIT) / (1 - SCHEDULER_BUDGET_SOFT_LIMIT) * (SCHEDULER_MAX_STRETCH - 1)
+                return base * stretch, f"token 用量 {pressure:.0%} 接近预算，间隔放大 {stretch:.1f} 倍"
+        if self.backlog >= self.target_batch:
+            elapsed = time.monotonic() - self.last_run if self.last_run is not None else self.min_interval
+            return max(self.min_interval - elapsed, 0), f"积压 {self.backlog} 条已达目标批量"
+        if rate > 0:
+            interval = min(max(self.target_batch / rate, self.min_interval), base)
+            if interval < base:
+                return interval, f"消息速率 {rate * 60:.1f} 条/分钟，按每轮约 {self.target_batch} 条缩短间隔"
+        return base, "负载正常，使用设定周期"
+
+    def schedule(self, job_queue=None, delay=None, reason=None):
+        """取消已排定的任务并重新排定下一轮；不给 delay 时按当前负载计算"""
+        job_queue = job_queue or self.job_queue
+        if job_queue is None:
+            return
+        self.job_queue = job_queue
+        if delay is None:
+            try:
+                delay, reason = self.decide()
+            except Exception as e:
+                log_error(f"调度决策失败，使用设定周期: {str(e)}")
+                delay, reason = self.base_interval(), "调度决策失败，使用设定周期"
+        if self.job is not None:
+            self.job.schedule_removal()
+        self.interval = delay
+        self.reason = reason
+        self.next_run = TIMEZONE.localize(datetime.now()) + timedelta(seconds=delay)
+        self.job = job_queue.run_once(self._run, when=delay, name="summarize_cycle")
+        log_info(f"下一轮总结: {delay / 60:.1f} 分钟后 ({reason})")
+
+    def trigger(self, job_queue, reason, force=False):
+        """连续模式等事件触发：尽快执行一轮；token 预算用尽时只有 force（疑似重大事件）才执行"""
+        if not force and self.token_budget and self.tokens_used() >= self.token_budget:
+            log_info(f"token 预算已用尽，忽略本次触发 ({reason})，等待下一次排定的总结")
+            return
+        self.schedule(job_queue, 0, f"事件触发: {reason}")
+
+    async def _run(self, context):
+        self.job = None
+        self.last_run = time.monotonic()
+        self.tokens_used()  # 本轮开始前取样，本轮消耗的 token 不会被算进基线
+        try:
+            await self.run(context)
+        finally:
+            self.schedule(context.job_queue)
+
+    def describe(self):
+        """管理菜单中展示的调度状态"""
+        lines = [f"总结调度: 设定周期 {self.base_interval() / 60:.0f} 分钟"]
+        if self.next_run:
+            remaining = max((self.next_run - TIMEZONE.localize(datetime.now())).total_seconds(), 0)
+            lines.append(f"下一轮: {self.next_run.strftime('%H:%M:%S')} (约 {remaining / 60:.1f} 分钟后)")
+        lines.append(f"决策: {self.reason}")
+        lines.append(f"消息速率: {self.rate() * 60:.1f} 条/分钟, 积压: {self.backlog} 条")
+        if self.token_budget:
+            lines.append(f"最近一小时 token: {self.tokens_used()}/{self.token_budget}")
+        return "\n".join(lines)
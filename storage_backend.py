@@ -0,0 +1,357 @@
+import time
+import sqlite3
+import hashlib
+import threading
+from config import S3_BUCKET, S3_ENDPOINT_URL, S3_MAX_CONCURRENCY, STORAGE_BACKEND, LOCAL_STORAGE_PATH, TIERED_CACHE_PREFIXES, TIERED_CACHE_DAYS
+from utils import log_info, log_error
+from metrics import metrics
+
+ANY = object()  # put 的 if_match 默认值：无条件写入；None 表示仅当对象不存在时写入
+NOT_FOUND_CODES = ("NoSuchKey", "404")
+PRECONDITION_CODES = ("PreconditionFailed", "412", "ConditionalRequestConflict")
+
+ClientError = None  # botocore 在创建 S3 后端时才导入，local 模式和不访问存储的导入路径都不需要它
+
+class ETagMismatch(Exception):
+    """对象已被其他写入方修改，ETag 与预期不一致"""
+
+class ObjectNotFound(Exception):
+    """对象不存在"""
+
+class S3Backend:
+    """S3 对象存储（或 MinIO / moto server 等兼容实现）"""
+
+    name = "s3"
+    batched = False  # 每个对象一次请求，批量操作由调用方并发执行
+
+    def __init__(self, bucket=S3_BUCKET, endpoint_url=S3_ENDPOINT_URL):
+        global ClientError
+        import boto3
+        from botocore.config import Config
+        from botocore.exceptions import ClientError
+        self.bucket = bucket
+        self.client = boto3.client(  # 移除 aws_access_key_id 和 aws_secret_access_key
+            "s3",
+            endpoint_url=endpoint_url,
+            config=Config(max_pool_connections=S3_MAX_CONCURRENCY)
+        )
+        # 新版 botocore 支持 PutObject 条件写入（IfMatch/IfNoneMatch），旧版退化为写前比对 ETag
+        self.conditional_put = "IfMatch" in self.client.meta.service_model.operation_model("PutObject").input_shape.members
+
+    def get(self, key):
+        """返回 (body, etag)，对象不存在时抛出 ObjectNotFound"""
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in NOT_FOUND_CODES:
+                raise ObjectNotFound(key)
+            raise
+        return response["Body"].read(), response["ETag"]
+
+    def put(self, key, body, if_match=ANY):
+        """写入并返回新 ETag；if_match 为 ETag 或 None（必须不存在）时条件写入，不满足抛出 ETagMismatch"""
+        params = {"Bucket": self.bucket, "Key": key, "Body": body}
+        if if_match is not ANY:
+            if self.conditional_put:
+                if if_match:
+                    params["IfMatch"] = if_match
+                else:
+                    params["IfNoneMatch"] = "*"
+            elif self.head(key) != if_match:
+                raise ETagMismatch(key)
+        try:
+            return self.client.put_object(**params)["ETag"]
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in PRECONDITION_CODES:
+                raise ETagMismatch(key)
+            raise
+
+    def head(self, key):
+        """返回对象 ETag，不存在时返回 None"""
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=key)["ETag"]
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in NOT_FOUND_CODES:
+                raise
+            return None
+
+    def list(self, prefix, start_after=None):
+        """按键的字典序分页列出 prefix 下的对象键"""
+        params = {"Bucket": self.bucket, "Prefix": prefix}
+        if start_after:
+            params["StartAfter"] = start_after
+        for page in self.client.get_paginator("list_objects_v2").paginate(**params):
+            for obj in page.get("Contents", []):
+                yield obj["Key"]
+
+    def delete(self, keys):
+        """批量删除（每次请求最多 1000 个键），返回删除数量"""
+        deleted = 0
+        for i in range(0, len(keys), 1000):
+            batch = keys[i:i + 1000]
+            try:
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True})
+                deleted += len(batch)
+            except Exception as e:
+                log_error(f"S3 删除失败: {batch[0]} 等 {len(batch)} 个, 错误: {str(e)}")
+        return deleted
+
+    def get_many(self, keys):
+        return [self._get_or_none(key) for key in keys]
+
+    def put_many(self, items):
+        return [self.put(key, body) for key, body in items]
+
+    def _get_or_none(self, key):
+        try:
+            return self.get(key)[0]
+        except ObjectNotFound:
+            return None
+
+class LocalBackend:
+    """本地 SQLite 存储：键为主键（B 树索引），按前缀和起始键的时间范围查询只扫描命中区间；
+    条件写入在事务内比对 ETag，是原子的。适合单节点部署，或作为分层存储的本地缓存"""
+
+    name = "local"
+    batched = True  # 批量读写在一次查询/事务中完成
+    conditional_put = True
+
+    def __init__(self, path=LOCAL_STORAGE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")  # 允许本机多个进程同时读写
+        self._db.execute("CREATE TABLE IF NOT EXISTS objects (key TEXT PRIMARY KEY, body BLOB NOT NULL, etag TEXT NOT NULL, updated REAL NOT NULL)")
+        self._db.commit()
+        log_info(f"本地存储已打开: {path}")
+
+    @staticmethod
+    def etag_of(body):
+        return f'"{hashlib.md5(body).hexdigest()}"'
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT body, etag FROM objects WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise ObjectNotFound(key)
+        return bytes(row[0]), row[1]
+
+    def put(self, key, body, if_match=ANY):
+        body = body.encode("utf-8") if isinstance(body, str) else bytes(body)
+        etag = self.etag_of(body)
+        with self._lock:
+            with self._db:
+                if if_match is not ANY:
+                    # BEGIN IMMEDIATE 先拿写锁，比对与写入之间不会插入其他进程的写入
+                    self._db.execute("BEGIN IMMEDIATE")
+                    row = self._db.execute("SELECT etag FROM objects WHERE key = ?", (key,)).fetchone()
+                    if (row[0] if row else None) != if_match:
+                        raise ETagMismatch(key)
+                self._db.execute("INSERT OR REPLACE INTO objects (key, body, etag, updated) VALUES (?, ?, ?, ?)", (key, body, etag, time.time()))
+        return etag
+
+    def head(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT etag FROM objects WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def list(self, prefix, start_after=None):
+        # 前缀区间 [prefix, prefix + U+FFFF) 与起始键一起构成主键上的范围查询
+        lower = max(prefix, start_after) if start_after else prefix
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key FROM objects WHERE key >= ? AND key < ? ORDER BY key", (lower, prefix + "\uffff")
+            ).fetchall()
+        return [key for key, in rows if key != start_after]
+
+    def delete(self, keys):
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM objects WHERE key = ?", [(key,) for key in keys])
+        return len(keys)
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self._db.execute(f"SELECT key, body FROM objects WHERE key IN ({','.join('?' * len(batch))})", batch).fetchall()
+                found.update((key, bytes(body)) for key, body in rows)
+        return [found.get(key) for key in keys]
+
+    def put_many(self, items):
+        now = time.time()
+        rows = []
+        for key, body in items:
+            body = body.encode("utf-8") if isinstance(body, str) else bytes(body)
+            rows.append((key, body, self.etag_of(body), now))
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO objects (key, body, etag, updated) VALUES (?, ?, ?, ?)", rows)
+        return [etag for _, _, etag, _ in rows]
+
+    def prune(self, max_age_seconds, prefixes):
+        """删除 prefixes 下超过 max_age_seconds 未更新的对象（用作缓存时控制体积）"""
+        cutoff = time.time() - max_age_seconds
+        with self._lock, self._db:
+            return sum(
+                self._db.execute("DELETE FROM objects WHERE key >= ? AND key < ? AND updated < ?", (prefix, prefix + "\uffff", cutoff)).rowcount
+                for prefix in prefixes
+            )
+
+class TieredBackend:
+    """分层存储：S3 为权威数据源，本地 SQLite 作为只写一次对象（mempool、发布记录）的读缓存。
+    写入先写 S3 再写本地，读取先查本地；列举、条件读写和可变对象（配置、检查点、租约）始终直达 S3"""
+
+    name = "tiered"
+    batched = False
+    PRUNE_EVERY = 1000
+
+    def __init__(self, remote=None, local=None, cache_prefixes=TIERED_CACHE_PREFIXES, cache_days=TIERED_CACHE_DAYS):
+        self.remote = remote or S3Backend()
+        self.local = local or LocalBackend()
+        self.cache_prefixes = tuple(cache_prefixes)
+        self.cache_seconds = cache_days * 86400
+        self.conditional_put = self.remote.conditional_put
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+
+    def cacheable(self, key):
+        return key.startswith(self.cache_prefixes)
+
+    def get(self, key):
+        if not self.cacheable(key):
+            return self.remote.get(key)
+        try:
+            body, etag = self.local.get(key)
+            self.hits += 1
+            return body, etag
+        except ObjectNotFound:
+            self.misses += 1
+        body, etag = self.remote.get(key)
+        self._cache([(key, body)])
+        return body, etag
+
+    def put(self, key, body, if_match=ANY):
+        etag = self.remote.put(key, body, if_match)
+        if self.cacheable(key):
+            self._cache([(key, body)])
+        return etag
+
+    def head(self, key):
+        return self.remote.head(key)
+
+    def list(self, prefix, start_after=None):
+        return self.remote.list(prefix, start_after)
+
+    def delete(self, keys):
+        deleted = self.remote.delete(keys)
+        self.local.delete([key for key in keys if self.cacheable(key)])
+        return deleted
+
+    def get_many(self, keys):
+        return [self.remote._get_or_none(key) if not self.cacheable(key) else self._get_or_none(key) for key in keys]
+
+    def put_many(self, items):
+        return [self.put(key, body) for key, body in items]
+
+    def _get_or_none(self, key):
+        try:
+            return self.get(key)[0]
+        except ObjectNotFound:
+            return None
+
+    def _cache(self, items):
+        try:
+            self.local.put_many(items)
+            self._writes += len(items)
+            if self._writes >= self.PRUNE_EVERY:
+                self._writes = 0
+                self.local.prune(self.cache_seconds, self.cache_prefixes)
+        except Exception as e:
+            log_error(f"本地缓存写入失败: {str(e)}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+class MeteredBackend:
+    """为后端的每个操作记录耗时直方图 storage_op_seconds{backend, op}；批量操作额外计入对象数"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.name = backend.name
+        self.batched = backend.batched
+        self.conditional_put = backend.conditional_put
+
+    def _timer(self, op):
+        return metrics.timer("storage_op", backend=self.name, op=op)
+
+    def get(self, key):
+        with self._timer("get"):
+            try:
+                return self.backend.get(key)
+            except ObjectNotFound:
+                metrics.inc("storage_not_found_total", backend=self.name)
+                raise
+
+    def put(self, key, body, if_match=ANY):
+        with self._timer("put"):
+            try:
+                return self.backend.put(key, body, if_match)
+            except ETagMismatch:
+                metrics.inc("storage_etag_conflicts_total", backend=self.name)
+                raise
+
+    def head(self, key):
+        with self._timer("head"):
+            return self.backend.head(key)
+
+    def list(self, prefix, start_after=None):
+        # 列举是惰性分页的，在计时范围内取完才能反映真实耗时
+        with self._timer("list"):
+            return list(self.backend.list(prefix, start_after))
+
+    def delete(self, keys):
+        metrics.inc("storage_objects_total", len(keys), backend=self.name, op="delete")
+        with self._timer("delete"):
+            return self.backend.delete(keys)
+
+    def get_many(self, keys):
+        metrics.inc("storage_objects_total", len(keys), backend=self.name, op="get_many")
+        with self._timer("get_many"):
+            return self.backend.get_many(keys)
+
+    def put_many(self, items):
+        metrics.inc("storage_objects_total", len(items), backend=self.name, op="put_many")
+        with self._timer("put_many"):
+            return self.backend.put_many(items)
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)  # stats、prune 等后端特有的方法
+
+class LazyBackend:
+    """首次访问时才创建后端（及 boto3 客户端）：导入 s3_storage 不再付出客户端初始化的开销"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._backend = None
+        self._lock = threading.Lock()
+
+    @property
+    def resolved(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = self._factory()
+        return self._backend
+
+    def __getattr__(self, name):
+        return getattr(self.resolved, name)
+
+def create_backend(kind=STORAGE_BACKEND):
+    """按配置创建存储后端：s3（默认）、local（单节点 SQLite）、tiered（本地缓存 + S3），外层统一记录操作耗时"""
+    if kind == "local":
+        return MeteredBackend(LocalBackend())
+    if kind == "tiered":
+        return MeteredBackend(TieredBackend())
+    return MeteredBackend(S3Backend())
@@ -0,0 +1,174 @@
+import time
+import asyncio
+from datetime import timedelta
+from telegram.error import RetryAfter, TelegramError
+from config import TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST, TELEGRAM_SEND_RETRIES
+from utils import log_info, log_error
+from metrics import metrics
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+COALESCE_SEPARATOR = "\n\n"
+
+class TokenBucket:
+    """令牌桶限流：rate 个/秒补充，最多积攒 capacity 个；pause 用于服从 Telegram 的 RetryAfter"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    async def acquire(self, count=1):
+        """取 count 个令牌（超过 capacity 时按 capacity 计），不足时等待补充"""
+        count = min(count, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= count:
+                    self.tokens -= count
+                    return
+                wait = max(self.updated - time.monotonic(), 0) + (count - self.tokens) / self.rate
+                await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        """清空令牌并在 seconds 秒内不再补充"""
+        self.tokens = 0
+        self.updated = max(self.updated, time.monotonic() + seconds)
+
+def split_text(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    """超长文本按行切分，单行仍超长时硬切"""
+    pieces, current = [], ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            pieces.append(current)
+            current = line
+        else:
+            current = candidate
+    if current:
+        pieces.append(current)
+    return pieces
+
+def retry_seconds(error):
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+
+class OutboundSender:
+    """Telegram 出站调度：全局与按会话的令牌桶、自动处理 RetryAfter，并把排队中的同频道消息合并到 4096 字符以内发送"""
+
+    def __init__(self, global_rate=TELEGRAM_GLOBAL_RATE, chat_rate=TELEGRAM_CHAT_RATE, chat_burst=TELEGRAM_CHAT_BURST, retries=TELEGRAM_SEND_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.retries = retries
+        self.chat_buckets = {}
+        self.pending = {}
+        self.workers = {}
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+        self.failed = 0
+
+    def chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(str(chat_id))
+        if bucket is None:
+            bucket = self.chat_buckets[str(chat_id)] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def acquire(self, chat_id):
+        await self.chat_bucket(chat_id).acquire()
+        await self.global_bucket.acquire()
+
+    async def send(self, bot, chat_id, text, **kwargs):
+        """限流后立即发送一条消息（不合并），遇到 RetryAfter 等待后重试；最终失败返回 None"""
+        await self.acquire(chat_id)
+        return await self._deliver(bot, chat_id, text, **kwargs)
+
+    async def _deliver(self, bot, chat_id, text, **kwargs):
+        """调用方已为首次尝试取得令牌"""
+        bucket = self.chat_bucket(chat_id)
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await self.acquire(chat_id)
+            try:
+                with metrics.timer("telegram_send"):
+                    message = await bot.send_message(chat_id, text, **kwargs)
+                self.sent += 1
+                metrics.inc("telegram_messages_total", result="sent")
+                return message
+            except RetryAfter as e:
+                seconds = retry_seconds(e)
+                self.retried += 1
+                metrics.inc("telegram_messages_total", result="retried")
+                bucket.pause(seconds)
+                log_info(f"Telegram 限流，{seconds:.0f} 秒后重试 - chat_id: {chat_id}")
+            except TelegramError as e:
+                log_error(f"Telegram 发送失败 - chat_id: {chat_id}, 错误: {str(e)}")
+                break
+        self.failed += 1
+        metrics.inc("telegram_messages_total", result="failed")
+        return None
+
+    def enqueue(self, bot, chat_id, text):
+        """排队发送，可与同一频道中尚未发出的消息合并；返回的 Future 在全部分片处理完后给出每个分片是否发出"""
+        key = str(chat_id)
+        loop = asyncio.get_running_loop()
+        pieces = [(piece, loop.create_future()) for piece in split_text(text)]
+        self.pending.setdefault(key, []).extend(pieces)
+        if key not in self.workers:
+            self.workers[key] = asyncio.create_task(self._drain(bot, chat_id))
+        return asyncio.gather(*(future for _, future in pieces))
+
+    async def _drain(self, bot, chat_id):
+        key = str(chat_id)
+        try:
+            while self.pending.get(key):
+                # 先等令牌再取消息：等待期间新到的消息会被一起合并
+                await self.acquire(chat_id)
+                queue = self.pending[key]
+                text, future = queue.pop(0)
+                futures = [future]
+                while queue and len(text) + len(COALESCE_SEPARATOR) + len(queue[0][0]) <= TELEGRAM_MESSAGE_LIMIT:
+                    piece, future = queue.pop(0)
+                    text = f"{text}{COALESCE_SEPARATOR}{piece}"
+                    futures.append(future)
+                    self.coalesced += 1
+                sent = False
+                try:
+                    sent = await self._deliver(bot, chat_id, text) is not None
+                finally:
+                    for future in futures:
+                        if not future.done():
+                            future.set_result(sent)
+        finally:
+            for _, future in self.pending.pop(key, []):
+                if not future.done():
+                    future.set_result(False)
+            self.workers.pop(key, None)
+
+    async def flush(self):
+        """等待所有排队消息发送完毕"""
+        while self.workers:
+            await asyncio.gather(*list(self.workers.values()), return_exceptions=True)
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "retried": self.retried,
+            "failed": self.failed,
+            "queued": sum(len(queue) for queue in self.pending.values())
+        }
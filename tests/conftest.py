@@ -0,0 +1,32 @@
+import os
+import sys
+
+# config 在导入时读取环境变量：测试统一使用进程内 moto 模拟的 S3，重试不退避
+os.environ.setdefault("ADMIN_HANDLES", "@admin")
+os.environ["STORAGE_BACKEND"] = "s3"
+os.environ["S3_BUCKET"] = "x-intel-test"
+os.environ.pop("S3_ENDPOINT_URL", None)
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ["S3_RETRY_BASE_DELAY"] = "0"
+os.environ["CONFIG_SNAPSHOT_PATH"] = ""
+os.environ["EMBEDDING_SNAPSHOT_DIR"] = ""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+@pytest.fixture
+def s3():
+    """每个测试一个空的模拟桶；存储后端和进程内共享的向量索引在首次访问时重新创建"""
+    from moto import mock_aws
+    import boto3
+    import s3_storage
+    import embedding_index
+    with mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket=os.environ["S3_BUCKET"])
+        s3_storage.backend._backend = None
+        embedding_index._embedding_index = None
+        yield s3_storage.backend
+        s3_storage.backend._backend = None
+        embedding_index._embedding_index = None
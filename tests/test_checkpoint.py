@@ -0,0 +1,101 @@
+import gzip
+import json
+import asyncio
+import pytest
+from checkpoint import CycleCheckpoint, MEMPOOL_FOLDER
+from s3_storage import list_s3_files, iter_mempool, FetchStats, ETagMismatch
+
+BAD_KEY = f"{MEMPOOL_FOLDER}/2025/01/01/00/2025-01-01_00:00:00_bad_00000001.jsonl.gz"
+
+def put_segment(backend, timestamp, name, count=2):
+    key = f"{MEMPOOL_FOLDER}/{timestamp[0:4]}/{timestamp[5:7]}/{timestamp[8:10]}/{timestamp[11:13]}/{timestamp.replace(' ', '_')}_{name}_00000001.jsonl.gz"
+    body = "\n".join(json.dumps({"timestamp": timestamp, "content": f"{name}-{i}"}) for i in range(count))
+    backend.put(key, gzip.compress(body.encode("utf-8")))
+    return key
+
+def run_cycle(checkpoint, cycle, deferred=()):
+    """与 bot.run_cycle 相同的列出、选取、拉取、提交流程，返回 (本周期选中的键, 拉取到的消息)"""
+    async def go():
+        files = list_s3_files(MEMPOOL_FOLDER, checkpoint.list_start(), partitioned=True)
+        planned = checkpoint.select(files)
+        stats = FetchStats()
+        messages = [message async for _, _, batch in iter_mempool(planned, stats) for message in batch]
+        await checkpoint.commit(cycle, planned, stats.failed_keys, [], deferred)
+        return [key for _, key in planned], messages
+    return asyncio.run(go())
+
+def test_select_and_advance_consumes_new_keys(s3):
+    first = put_segment(s3, "2025-01-01 00:05:00", "a")
+    second = put_segment(s3, "2025-01-01 01:10:00", "b")
+    checkpoint = CycleCheckpoint(max_attempts=3)
+    keys, messages = run_cycle(checkpoint, "c1")
+    assert keys == [first, second]
+    assert len(messages) == 4
+    assert checkpoint.watermark == second
+    assert run_cycle(checkpoint, "c2") == ([], [])
+    third = put_segment(s3, "2025-01-01 02:00:00", "c")
+    assert run_cycle(checkpoint, "c3")[0] == [third]
+
+def test_late_segment_inside_settle_window_is_picked_up(s3):
+    put_segment(s3, "2025-01-01 00:05:00", "a")
+    checkpoint = CycleCheckpoint(settle_seconds=120)
+    run_cycle(checkpoint, "c1")
+    late = put_segment(s3, "2025-01-01 00:04:30", "late")
+    assert run_cycle(checkpoint, "c2")[0] == [late]
+    assert checkpoint.watermark.endswith("_a_00000001.jsonl.gz")
+
+def test_corrupt_object_is_dead_lettered_and_watermark_moves_on(s3):
+    s3.put(BAD_KEY, b"not gzip")
+    good = [put_segment(s3, f"2025-01-01 00:{minute:02d}:00", f"g{minute}") for minute in (5, 10, 15)]
+    checkpoint = CycleCheckpoint(max_attempts=3)
+    for attempt in (1, 2):
+        keys, _ = run_cycle(checkpoint, f"c{attempt}")
+        assert BAD_KEY in keys
+        assert checkpoint.watermark is None
+        assert checkpoint.attempts == {BAD_KEY: attempt}
+    # 第二轮起只重新选取失败的键，已消费的键不会重复拉取
+    assert keys == [BAD_KEY]
+    run_cycle(checkpoint, "c3")
+    assert checkpoint.watermark == good[-1]
+    assert checkpoint.attempts == {}
+    assert [entry["key"] for entry in checkpoint.dead_letter] == [BAD_KEY]
+    assert checkpoint.recent == {good[-1]}  # 沉淀窗口之外的键被修剪，检查点不再增长
+    assert checkpoint.list_start() == "2025-01-01 00:13:00"
+    assert run_cycle(checkpoint, "c4") == ([], [])
+    reloaded = CycleCheckpoint().load()
+    assert reloaded.watermark == good[-1]
+    assert reloaded.dead_letter == checkpoint.dead_letter
+
+def test_deferred_keys_are_retried_without_counting_attempts(s3):
+    key = put_segment(s3, "2025-01-01 00:05:00", "a")
+    checkpoint = CycleCheckpoint(max_attempts=1)
+    for cycle in ("c1", "c2"):
+        assert run_cycle(checkpoint, cycle, deferred=[key])[0] == [key]
+        assert checkpoint.watermark is None
+        assert checkpoint.dead_letter == []
+    run_cycle(checkpoint, "c3")
+    assert checkpoint.watermark == key
+
+def test_deposed_leader_cannot_overwrite_cursor(s3):
+    key = put_segment(s3, "2025-01-01 00:05:00", "a")
+    old = CycleCheckpoint(term=lambda: 1).load()
+    new = CycleCheckpoint(term=lambda: 2).load()
+    run_cycle(new, "new")
+    assert new.watermark == key
+    # 旧主节点持有过期的 ETag 和更低的任期，提交被拒绝且内存状态回滚
+    with pytest.raises(ETagMismatch):
+        asyncio.run(old.commit("old", [("2025-01-01 00:05:00", key)], [], ["stale"]))
+    assert old.outputs == []
+    old.etag = CycleCheckpoint().load().etag  # 即使 ETag 恰好一致，任期更低的写入也被拒绝
+    with pytest.raises(ETagMismatch):
+        asyncio.run(old.mark_delivered(0))
+    assert CycleCheckpoint().load().watermark == key
+
+def test_legacy_flat_keys_after_last_position_are_migrated(s3):
+    for timestamp, name in (("2025-01-01 00:04:00", "old"), ("2025-01-01 00:05:00", "same"), ("2025-01-01 00:06:00", "new")):
+        s3.put(f"{MEMPOOL_FOLDER}/{timestamp.replace(' ', '_')}_{name}.json",
+               json.dumps({"timestamp": timestamp, "content": name}).encode("utf-8"))
+    checkpoint = CycleCheckpoint().load("2025-01-01 00:05:00")
+    keys, messages = run_cycle(checkpoint, "c1")
+    assert keys == [f"{MEMPOOL_FOLDER}/2025/01/01/00/2025-01-01_00:06:00_new.json"]
+    assert [message["content"] for message in messages] == ["new"]
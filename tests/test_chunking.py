@@ -0,0 +1,32 @@
+from llm_agent import ChunkBuilder, estimate_tokens, format_message
+
+def message(content, key=None):
+    message = {"source": "src", "content": content}
+    if key:
+        message["mempool_keys"] = [key]
+    return message
+
+def build(messages, token_budget):
+    builder = ChunkBuilder(token_budget)
+    chunks = [chunk for chunk in map(builder.add, messages) if chunk]
+    last = builder.finish()
+    return chunks + ([last] if last else [])
+
+def test_chunks_respect_token_budget_and_keep_order():
+    messages = [message(f"{i}" * 40) for i in range(5)]
+    tokens = estimate_tokens(format_message(messages[0]))
+    chunks = build(messages, tokens * 2)
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert [line for chunk in chunks for line in chunk] == [format_message(m) for m in messages]
+
+def test_oversized_message_gets_its_own_chunk():
+    chunks = build([message("a"), message("b" * 400), message("c")], 20)
+    assert [len(chunk) for chunk in chunks] == [1, 1, 1]
+
+def test_chunk_sources_track_mempool_keys():
+    chunks = build([message("a" * 40, "k1"), message("b" * 40, "k2"), message("c" * 40), message("d" * 40, "k1")],
+                   estimate_tokens(format_message(message("a" * 40))) * 2)
+    assert [chunk.source_keys() for chunk in chunks] == [{"k1", "k2"}, {"k1"}]
+
+def test_empty_builder_finishes_with_nothing():
+    assert ChunkBuilder().finish() is None
@@ -0,0 +1,25 @@
+from compaction import compact_history
+from s3_storage import list_s3_files, fetch_mempool_object, COLUMNAR_SUFFIX
+from test_checkpoint import put_segment
+
+def test_unreadable_segment_does_not_block_other_groups(s3):
+    bad = "intel_mempool/2025/01/01/08/2025-01-01_08:30:00_bad_00000001.jsonl.gz"
+    s3.put(bad, b"not gzip")
+    put_segment(s3, "2025-01-01 08:10:00", "a")
+    put_segment(s3, "2025-01-01 09:10:00", "b")
+    put_segment(s3, "2025-01-01 09:20:00", "c")
+    for _ in range(2):
+        state = compact_history("2025-01-01 12:00:00", age_hours=0)
+        keys = [key for _, key in list_s3_files("intel_mempool")]
+        assert bad in keys
+        archives = [key for key in keys if key.endswith(COLUMNAR_SUFFIX)]
+        assert len(archives) == 2 and len(keys) == 3
+        assert state["intel_mempool"] > "2025-01-01 10"  # 状态越过了含损坏对象的小时
+    assert sorted(m["content"] for key in archives for m in fetch_mempool_object(key)) == ["a-0", "a-1", "b-0", "b-1", "c-0", "c-1"]
+
+def test_dead_lettered_segment_is_left_in_place(s3):
+    dead = put_segment(s3, "2025-01-01 08:10:00", "dead")
+    put_segment(s3, "2025-01-01 08:20:00", "a")
+    compact_history("2025-01-01 12:00:00", age_hours=0, dead_letter=[dead])
+    keys = [key for _, key in list_s3_files("intel_mempool")]
+    assert dead in keys and len(keys) == 2
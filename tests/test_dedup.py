@@ -0,0 +1,26 @@
+from dedup import normalize_link
+
+def test_query_parameters_that_identify_content_are_kept():
+    assert normalize_link("https://www.youtube.com/watch?v=AAA") != normalize_link("https://youtube.com/watch?v=BBB")
+    assert normalize_link("https://news.site/article.php?id=1") != normalize_link("https://news.site/article.php?id=2")
+
+def test_tracking_parameters_and_fragment_are_dropped():
+    assert normalize_link("https://news.site/article.php?utm_source=tg&id=1&fbclid=x#top") == "news.site/article.php?id=1"
+    assert normalize_link("https://news.site/a?b=2&a=1") == normalize_link("https://www.news.site/a/?a=1&b=2&ref=home")
+    assert normalize_link("https://news.site/a/?utm_medium=social") == "news.site/a"
+
+def test_twitter_mirrors_collapse_to_status_id():
+    assert normalize_link("https://fxtwitter.com/user/status/123?s=20") == normalize_link("https://x.com/other/status/123") == "x.com/status/123"
+
+def test_summaries_without_embedding_fall_back_to_text_comparison(s3, monkeypatch):
+    import asyncio
+    import llm_agent
+    from embedding_index import EmbeddingIndex
+    async def no_embeddings(texts):
+        return [None] * len(texts)
+    monkeypatch.setattr(llm_agent, "get_embeddings", no_embeddings)
+    content = "Bitcoin ETF 获批，市场大幅上涨，多家交易所成交量创下新高"
+    earlier = [{"content": content}]
+    summaries = [{"content": content + "。"}, {"content": "以太坊完成升级，Gas 费用明显下降"}, {"content": "以太坊完成升级，Gas 费用明显下降"}]
+    accepted = asyncio.run(llm_agent.filter_duplicates(summaries, EmbeddingIndex(), earlier))
+    assert [summary["content"] for summary in accepted] == ["以太坊完成升级，Gas 费用明显下降"]
@@ -0,0 +1,28 @@
+import time
+import sqlite3
+from embedding_cache import EmbeddingCache
+
+def test_disk_tier_evicts_least_recently_accessed_rows(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = EmbeddingCache(max_bytes=0, path=path, disk_max_rows=10)
+    for i in range(10):
+        cache.put_many([(f"k{i}", [float(i)] * 4)])
+        time.sleep(0.001)
+    assert cache.get("k0") is not None  # 磁盘命中，刷新访问时间
+    cache.put_many([("k10", [10.0] * 4)])
+    # 超出上限后删到 9 条：最久未访问的 k1、k2 被淘汰，刚读过的 k0 保留
+    assert cache.disk_rows == 9
+    keys = {row[0] for row in sqlite3.connect(path).execute("SELECT key FROM embeddings")}
+    assert "k0" in keys and "k10" in keys and "k1" not in keys and "k2" not in keys
+    assert EmbeddingCache(max_bytes=0, path=path, disk_max_rows=10).disk_rows == 9
+
+def test_legacy_cache_file_gains_access_time(tmp_path):
+    path = str(tmp_path / "cache.db")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+    db.executemany("INSERT INTO embeddings VALUES (?, ?)", [(f"old{i}", bytes(16)) for i in range(5)])
+    db.commit()
+    cache = EmbeddingCache(max_bytes=0, path=path, disk_max_rows=4)
+    assert cache.disk_rows == 3
+    cache.put_many([("new", [1.0] * 4)])
+    assert cache.get("new") is not None
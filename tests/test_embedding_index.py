@@ -0,0 +1,60 @@
+import asyncio
+import numpy as np
+from embedding_index import EmbeddingIndex, TAIL_FOLDER
+from s3_storage import list_s3_files
+
+TIMESTAMP = "2099-01-01 00:00:00"  # 晚于淘汰窗口，避免条目被 prune
+
+def vectors(count, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, 8))
+
+def test_save_and_load_round_trip(s3):
+    index = EmbeddingIndex.load()
+    for i, vector in enumerate(vectors(3)):
+        index.add(vector, TIMESTAMP, f"c{i}")
+    index.save()
+    loaded = EmbeddingIndex.load()
+    assert loaded.contents == ["c0", "c1", "c2"]
+    assert loaded.version == index.version
+    np.testing.assert_allclose(loaded.vectors, index.vectors, rtol=1e-6)
+    assert loaded.max_similarity(vectors(3)[:1])[0] > 0.999
+    assert loaded.unsaved == []
+
+def test_unsaved_tail_is_replayed_on_load(s3):
+    index = EmbeddingIndex.load()
+    index.add_many(vectors(2), [TIMESTAMP] * 2, ["a", "b"])
+    index.save()
+    assert list_s3_files(TAIL_FOLDER) == []  # 并入快照后删除增量对象
+    index.add_many(vectors(1, seed=1), [TIMESTAMP], ["c"])
+    # 进程在防抖保存前退出：快照只有 a、b，c 从增量对象补回
+    restarted = EmbeddingIndex.load()
+    assert restarted.contents == ["a", "b", "c"]
+    assert restarted.max_similarity(vectors(1, seed=1))[0] > 0.999
+    asyncio.run(restarted.flush())
+    assert list_s3_files(TAIL_FOLDER) == []
+    assert EmbeddingIndex.load().contents == ["a", "b", "c"]
+
+def test_save_later_coalesces_into_one_snapshot(s3):
+    async def go():
+        index = EmbeddingIndex.load()
+        for i, vector in enumerate(vectors(3)):
+            index.add_many([vector], [TIMESTAMP], [f"c{i}"])
+            index.save_later(delay=0.05)
+        assert index.version is None
+        await asyncio.sleep(0.2)
+        return index
+    index = asyncio.run(go())
+    assert index.version is not None and index.unsaved == [] and index.unsaved_tail == []
+    assert EmbeddingIndex.load().contents == ["c0", "c1", "c2"]
+
+def test_save_adopts_version_published_by_another_writer(s3):
+    bot = EmbeddingIndex.load()
+    bot.add(vectors(1)[0], TIMESTAMP, "a")
+    bot.save()
+    # 回填重建索引无条件发布新版本
+    rebuilt = EmbeddingIndex(vectors(3, seed=1), [TIMESTAMP] * 3, ["x", "y", "a"])
+    rebuilt.save(replace=True)
+    bot.add(vectors(1, seed=2)[0], TIMESTAMP, "b")
+    bot.save()
+    assert sorted(EmbeddingIndex.load().contents) == ["a", "b", "x", "y"]
+    assert bot.unsaved == []
@@ -0,0 +1,18 @@
+from leader import FileLease
+
+def test_file_lease_term_increases_across_processes(tmp_path):
+    path = str(tmp_path / "leader.lock")
+    first = FileLease(path, holder="a")
+    assert first.try_acquire() and first.term == 1
+    assert not FileLease(path, holder="b").try_acquire()
+    first.release()
+    # 新进程的 FileLease 从锁文件中的任期继续递增，而不是从 0 开始
+    second = FileLease(path, holder="b")
+    assert second.try_acquire() and second.term == 2
+    second.release()
+
+def test_legacy_lock_file_without_term(tmp_path):
+    path = tmp_path / "leader.lock"
+    path.write_text("old-holder")
+    lease = FileLease(str(path), holder="a")
+    assert lease.try_acquire() and lease.term == 1
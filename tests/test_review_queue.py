@@ -0,0 +1,17 @@
+import asyncio
+from review_queue import ReviewQueue
+
+def test_restored_item_can_be_approved_again(s3):
+    async def go():
+        queue = ReviewQueue()
+        batch = queue.new_batch()
+        item = await queue.add("summary", batch)
+        taken = await queue.pop(batch, item["id"])
+        assert await ReviewQueue().pop(batch, item["id"]) is None
+        # 发布失败后放回：重启后的新进程也能再次取出，创建时间不变
+        await queue.restore([taken])
+        again = await ReviewQueue().pop(batch, item["id"])
+        assert again == item
+        await queue.restore([again])
+        assert [entry["id"] for entry in await ReviewQueue().pop_batch(batch)] == [item["id"]]
+    asyncio.run(go())
@@ -0,0 +1,78 @@
+import asyncio
+import pytest
+from metrics import metrics
+from scheduler import SummaryScheduler
+
+class FakeJob:
+    def __init__(self, callback, when):
+        self.callback = callback
+        self.when = when
+        self.removed = False
+
+    def schedule_removal(self):
+        self.removed = True
+
+class FakeJobQueue:
+    def __init__(self):
+        self.jobs = []
+
+    def run_once(self, callback, when, name=None):
+        self.jobs.append(FakeJob(callback, when))
+        return self.jobs[-1]
+
+class FakeContext:
+    def __init__(self, job_queue):
+        self.job_queue = job_queue
+
+def make_scheduler(run=None, base_minutes=60, **kwargs):
+    async def noop(context):
+        pass
+    return SummaryScheduler(run or noop, lambda: base_minutes * 60, min_interval=300, target_batch=10, rate_window=600, **kwargs)
+
+def test_first_cycle_tokens_count_against_budget():
+    async def spend(context):
+        metrics.inc("llm_tokens_total", 1500)
+    scheduler = make_scheduler(spend, token_budget=1000)
+    queue = FakeJobQueue()
+    metrics.inc("llm_tokens_total", 10000)  # 启动前累计的用量不算进窗口
+    scheduler.start(queue)
+    assert queue.jobs[0].when == 0
+    asyncio.run(queue.jobs[0].callback(FakeContext(queue)))
+    assert scheduler.tokens_used() == 1500
+    assert "用尽预算" in scheduler.reason
+    assert queue.jobs[-1].when >= 3600 - 1
+
+def test_idle_uses_base_interval():
+    delay, reason = make_scheduler().decide()
+    assert delay == 3600
+    assert "设定周期" in reason
+
+def test_high_rate_shortens_interval_but_not_below_minimum():
+    scheduler = make_scheduler()
+    for _ in range(5):
+        scheduler.record_message()
+    delay, _ = scheduler.decide()
+    assert delay == pytest.approx(10 / (5 / 600))  # 每轮约 target_batch 条
+    for _ in range(100):
+        scheduler.arrivals.append(scheduler.arrivals[-1])
+    assert scheduler.decide()[0] == 300
+
+def test_backlog_at_target_runs_soon_and_reschedules_immediately():
+    scheduler = make_scheduler()
+    queue = FakeJobQueue()
+    scheduler.schedule(queue, 3600, "设定周期")
+    for _ in range(10):
+        scheduler.record_message()
+    assert queue.jobs[0].removed
+    assert queue.jobs[-1].when == 0
+    assert "目标批量" in scheduler.reason
+    scheduler.cycle_started()
+    assert scheduler.backlog == 0
+
+def test_token_pressure_stretches_interval():
+    scheduler = make_scheduler(token_budget=1000)
+    scheduler.tokens_used()
+    metrics.inc("embedding_tokens_total", 900)
+    delay, reason = scheduler.decide()
+    assert delay == pytest.approx(3600 * 2.5)  # 用量 90%：在软上限 80% 与预算之间线性放大到最多 4 倍
+    assert "接近预算" in reason
@@ -1,9 +1,31 @@
+import re
+import queue
+import atexit
 import logging
+import logging.handlers
 from datetime import datetime
 import pytz
-from config import TIMEZONE
+from config import TIMEZONE, LOG_LEVEL
 
-logging.basicConfig(filename="x-intel.log", level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+def setup_logging(filename="x-intel.log"):
+    """日志经 QueueHandler 入队，由后台线程的 QueueListener 写文件和控制台，事件循环中记录日志不会阻塞在磁盘 IO 上"""
+    root = logging.getLogger()
+    if any(isinstance(handler, logging.handlers.QueueHandler) for handler in root.handlers):
+        return
+    formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    handlers = [logging.FileHandler(filename), logging.StreamHandler()]  # StreamHandler 输出到控制台
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    log_queue = queue.SimpleQueue()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(LOG_LEVEL)
+    for name in ("httpx", "httpcore", "urllib3", "botocore", "boto3", "s3transfer", "openai"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+setup_logging()
 logger = logging.getLogger(__name__)
 
 class NoGetUpdatesFilter(logging.Filter):
@@ -31,4 +53,10 @@ def format_summary(category, content, importance=None):
         return f"[{timestamp}] 重要快讯 Just in (重要性: {importance}):\n{content}"
     elif category == "Curated":
         return f"[{timestamp}] 收录发言/观点 Curated ({'价值内容' if importance == 1 else 'meme内容'}):\n{content}"
-    return f"[{timestamp}] {content}"
\ No newline at end of file
+    return f"[{timestamp}] {content}"
+
+SUMMARY_HEADER = re.compile(r"^\[\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\] (?:(?:重大事件 Breaking|重要快讯 Just in \([^\n]*\)|收录发言/观点 Curated \([^\n]*\)):\n)?")
+
+def strip_summary_header(summary):
+    """去掉 format_summary 添加的时间戳和分类头，得到总结正文"""
+    return SUMMARY_HEADER.sub("", summary, count=1)
\ No newline at end of file